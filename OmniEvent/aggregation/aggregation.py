@@ -76,6 +76,52 @@ def aggregate(config,
         raise ValueError("Invaild %s aggregation method" % config.aggregation)
 
 
+def aggregate_spans(config,
+                    method,
+                    hidden_states: torch.Tensor,
+                    span_index: torch.Tensor,
+                    trigger_left: torch.Tensor,
+                    trigger_right: torch.Tensor,
+                    argument_left: torch.Tensor,
+                    argument_right: torch.Tensor) -> torch.Tensor:
+    """Aggregates information to each argument span of the sequences.
+
+    Aggregates information to each span as `aggregate()` does to each sequence, while a sequence may hold several
+    spans, so that the sequence is encoded once for all its spans. The spans are not marked in the sequences, hence
+    only the aggregation methods locating the argument, i.e. selecting the representations of its first and last
+    tokens, and dynamic multi-pooling, are supported.
+
+    Args:
+        config:
+            The configurations of the model.
+        method:
+            The method proposed to be utilized in the aggregation process.
+        hidden_states (`torch.Tensor`):
+            A tensor representing the hidden states output by the backbone model.
+        span_index (`torch.Tensor`):
+            A tensor indicating the index in the batch of the sequence of each span.
+        trigger_left (`torch.Tensor`):
+            A tensor indicating the left position of the trigger of each sequence.
+        trigger_right (`torch.Tensor`):
+            A tensor indicating the right position of the trigger of each sequence.
+        argument_left (`torch.Tensor`):
+            A tensor indicating the left position of each span.
+        argument_right (`torch.Tensor`):
+            A tensor indicating the right position of each span.
+    """
+    if config.aggregation == "marker":
+        # index the flattened sequences instead of repeating each sequence for its spans
+        batch_size, seq_length, hidden_size = hidden_states.size()
+        offsets = span_index.to(torch.long) * seq_length
+        return method(hidden_states.reshape(1, batch_size * seq_length, hidden_size),
+                      offsets + argument_left.to(torch.long),
+                      offsets + argument_right.to(torch.long))
+    elif config.aggregation == "dynamic_pooling":
+        return method(hidden_states[span_index], trigger_left[span_index], argument_left)
+    else:
+        raise ValueError("Invaild %s aggregation method for spans" % config.aggregation)
+
+
 def max_pooling(hidden_states: torch.Tensor) -> torch.Tensor:
     """Applies the max-pooling operation over the sentence representation.
 
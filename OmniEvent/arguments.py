@@ -99,7 +99,8 @@ class DataArguments:
     truncate_in_batch: bool = field(
         default=False,
         metadata={
-            "help": "whether truncate in batch. False only if mrc."
+            "help": "Whether to pad the evaluation batches to their longest inputs, as training batches always "
+                    "are. False only if mrc."
         }
     )
     language: str = field(
@@ -130,6 +131,19 @@ class DataArguments:
             "help": "Mrc template, 0: role_name, 1: role_name in [trigger], 2: guidelines, 3: guidelines in [trigger]"
         }
     )
+    preprocessing_num_workers: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "The number of processes to read and convert the examples with. The lines of the input files are "
+            "split into as many shards."
+        }
+    )
+    feature_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Directory to cache the tokenized features in. Features are converted every time if not set."
+        }
+    )
 
 
 @dataclass
@@ -168,7 +182,8 @@ class ModelArguments:
     paradigm: str = field(
         default="token_classification",
         metadata={
-            "help": "Paradigm of the method. Selected in ['token_classification', 'sequence_labeling', 'seq2seq', and 'mrc']."
+            "help": "Paradigm of the method. Selected in ['token_classification', 'span_classification', "
+                    "'sequence_labeling', 'seq2seq', and 'mrc']."
         }
     )
     config_name: Optional[str] = field(
@@ -291,6 +306,14 @@ class TrainingArguments(TrainingArguments):
             "help": "Model parallelism."
         }
     )
+    max_tokens_per_batch: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "The maximum number of padded input tokens of a training batch, instead of a fixed batch size. The "
+                    "features are then batched with others of similar lengths, as with `group_by_length`, every epoch "
+                    "keeping the number of batches of the first one."
+        }
+    )
 
 
 class ArgumentParser(HfArgumentParser):
@@ -1,5 +1,8 @@
 import os 
 import json 
+import threading
+
+from collections import OrderedDict
 from .arguments import (
     ArgumentParser, 
     ModelArguments,
@@ -17,6 +20,10 @@ from transformers import (
     BartTokenizerFast
 )
 from .infer_module.seq2seq import (
+    EDProcessor,
+    EAEProcessor,
+    get_device,
+    set_cpu_threads,
     do_event_detection, 
     do_event_argument_extraction,
     get_ed_result,
@@ -24,6 +31,9 @@ from .infer_module.seq2seq import (
     prepare_for_eae_from_input,
     prepare_for_eae_from_pred
 )
+from .infer_module.quantization import get_quantized
+from .infer_module.pipeline import run_pipeline
+from .infer_module.constraint import register_schema_labels, load_schema_labels
 
 class AttrDict(dict):
     def __init__(self, *args, **kwargs):
@@ -54,7 +64,15 @@ def get_model(model_args, model_name_or_path):
     return model
     
 
-def get_pretrained(model_name_or_path):
+def get_pretrained(model_name_or_path, device=None, quantize=False):
+    """Loads a released seq2seq model and its tokenizer.
+
+    Args:
+        model_name_or_path (`str`): Model identifier (e.g. `s2s-mt5-ed`) or path to a checkpoint directory.
+        device (`str`, *optional*): Device to load the model on. Defaults to CUDA if available, otherwise CPU.
+        quantize (`bool`): Whether to load a dynamic-int8 quantized copy of the model for CPU inference. The quantized
+            state dict is exported next to the checkpoint on first use and reused while the checkpoint is unchanged.
+    """
     # config 
     # parser = ArgumentParser((ModelArguments, DataArguments, TrainingArguments))
     # model_args, data_args, training_args = parser.from_pretrained(model_name_or_path)
@@ -63,15 +81,263 @@ def get_pretrained(model_name_or_path):
         "paradigm": "seq2seq",
         "model_type": "mt5"
     })
-    model = get_model(model_args, model_name_or_path)
-    model.cuda()
+    if quantize:
+        if get_device(device).type != "cpu":
+            raise ValueError("Quantized models only run on CPU, got device %s" % device)
+        path = check_web_and_convert_path(model_name_or_path, "model")
+        model = get_quantized(get_model_cls(model_args), path)
+    else:
+        model = get_model(model_args, model_name_or_path)
+        model.to(get_device(device))
+        model.eval()
     # tokenizer 
     tokenizer = get_tokenizer(model_name_or_path)
 
     return model, tokenizer
 
 
-def infer(text, model=None, tokenizer=None, triggers=None, schema="ace", task="ED"):
+def get_model_memory(model):
+    """Returns the number of bytes held by the parameters and buffers of `model`."""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelRegistry(object):
+    """Process-wide LRU cache of loaded `(model, tokenizer)` pairs.
+
+    Pairs are keyed by the model identifier and the keyword arguments passed to `get_pretrained`, so repeated calls
+    only load each checkpoint once. When the models held exceed `max_memory` bytes, the least recently used ones are
+    evicted; the most recently requested model is always kept. The registry is safe to use from multiple threads.
+
+    Attributes:
+        max_memory (`int`, *optional*):
+            Memory budget in bytes for all cached models. `None` means no limit.
+    """
+
+    def __init__(self, max_memory=None):
+        """Constructs a `ModelRegistry`."""
+        self.max_memory = max_memory
+        self._entries = OrderedDict()
+        self._memory = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _evict(self):
+        """Drops least recently used entries until the cache fits into the memory budget."""
+        if self.max_memory is None:
+            return
+        while len(self._entries) > 1 and sum(self._memory.values()) > self.max_memory:
+            key, _ = self._entries.popitem(last=False)
+            self._memory.pop(key)
+            self._key_locks.pop(key, None)
+
+    def get(self, model_name_or_path, **kwargs):
+        """Returns the cached `(model, tokenizer)` pair, loading it with `get_pretrained` on a miss."""
+        key = (model_name_or_path, tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # load outside the registry lock so that other checkpoints stay available meanwhile
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    return self._entries[key]
+            pair = get_pretrained(model_name_or_path, **kwargs)
+            with self._lock:
+                self._entries[key] = pair
+                self._memory[key] = get_model_memory(pair[0])
+                self._evict()
+        return pair
+
+    def clear(self):
+        """Drops all cached models."""
+        with self._lock:
+            self._entries.clear()
+            self._memory.clear()
+            self._key_locks.clear()
+
+    def __contains__(self, model_name_or_path):
+        with self._lock:
+            return any(key[0] == model_name_or_path for key in self._entries)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+MODEL_REGISTRY = ModelRegistry(max_memory=int(os.environ["OMNIEVENT_MODEL_MEMORY"])
+                               if "OMNIEVENT_MODEL_MEMORY" in os.environ else None)
+
+
+SUPPORTED_SCHEMAS = ['ace', 'kbp', 'ere', 'maven', 'leven', 'duee', 'fewfc']
+
+
+def load_models(model=None, tokenizer=None, task="ED", device=None, quantize=False):
+    """Returns the (model, tokenizer) pairs used by `task`, taking the released checkpoints from `MODEL_REGISTRY` if
+    none are given."""
+    kwargs = dict(device=str(get_device(device)), quantize=quantize)
+    if task == "ED":
+        if model is None or tokenizer is None:
+            return MODEL_REGISTRY.get("s2s-mt5-ed", **kwargs), None
+        return (model, tokenizer), None
+    elif task == "EAE":
+        if model is None or tokenizer is None:
+            return None, MODEL_REGISTRY.get("s2s-mt5-eae", **kwargs)
+        return None, (model, tokenizer)
+    else:
+        if model is None or tokenizer is None:
+            return MODEL_REGISTRY.get("s2s-mt5-ed", **kwargs), MODEL_REGISTRY.get("s2s-mt5-eae", **kwargs)
+        return (model[0], tokenizer[0]), (model[1], tokenizer[1])
+
+
+def infer_micro_batch(texts, schemas, all_triggers, ed_pair, eae_pair, task, bf16=False, max_tokens=None,
+                      share_encoder=False, constrained=False, num_beams=4):
+    """Runs ED and/or EAE on a single micro-batch of texts."""
+    if task == "ED":
+        events = do_event_detection(ed_pair[0], ed_pair[1], texts, schemas, bf16=bf16, max_tokens=max_tokens,
+                                    constrained=constrained, num_beams=num_beams)
+        return get_ed_result(texts, events)
+    if task == "EAE":
+        instances = prepare_for_eae_from_input(texts, all_triggers, schemas)
+    else:
+        events = do_event_detection(ed_pair[0], ed_pair[1], texts, schemas, bf16=bf16, max_tokens=max_tokens,
+                                    constrained=constrained, num_beams=num_beams)
+        instances = prepare_for_eae_from_pred(texts, events, schemas)
+    if sum(len(instance["triggers"]) for instance in instances) == 0:
+        return get_eae_result(instances, [])
+    arguments = do_event_argument_extraction(eae_pair[0], eae_pair[1], instances, bf16=bf16,
+                                             max_tokens=max_tokens, share_encoder=share_encoder,
+                                             constrained=constrained, num_beams=num_beams)
+    return get_eae_result(instances, arguments)
+
+
+def get_pipeline_stages(ed_pair, eae_pair, task, bf16=False, max_tokens=None, share_encoder=False,
+                        constrained=False, num_beams=4):
+    """Splits `infer_micro_batch` into stages for `run_pipeline`.
+
+    Tokenization and generation are separate stages, so the next micro-batch is tokenized while the current one is
+    generated and, for EE, EAE of a micro-batch runs while ED continues on the next one. Each stage takes and returns
+    a dict holding the `texts`, `schemas` and `triggers` of a micro-batch; the last stage returns its results.
+    """
+    def encode_ed(batch):
+        data_processor = EDProcessor(ed_pair[1], device=ed_pair[0].device)
+        batch["ed_features"] = data_processor.encode(batch["texts"], batch["schemas"])
+        return batch
+
+    def detect(batch):
+        events = do_event_detection(ed_pair[0], ed_pair[1], batch["texts"], batch["schemas"], bf16=bf16,
+                                    max_tokens=max_tokens, features=batch["ed_features"], constrained=constrained,
+                                    num_beams=num_beams)
+        if task == "ED":
+            return get_ed_result(batch["texts"], events)
+        batch["instances"] = prepare_for_eae_from_pred(batch["texts"], events, batch["schemas"])
+        return batch
+
+    def encode_eae(batch):
+        if task == "EAE":
+            batch["instances"] = prepare_for_eae_from_input(batch["texts"], batch["triggers"], batch["schemas"])
+        data_processor = EAEProcessor(eae_pair[1], device=eae_pair[0].device)
+        if share_encoder:
+            batch["eae_features"] = data_processor.encode_shared(batch["instances"])
+        else:
+            batch["eae_features"] = data_processor.encode(batch["instances"])
+        return batch
+
+    def extract(batch):
+        instances = batch["instances"]
+        if sum(len(instance["triggers"]) for instance in instances) == 0:
+            return get_eae_result(instances, [])
+        arguments = do_event_argument_extraction(eae_pair[0], eae_pair[1], instances, bf16=bf16,
+                                                 max_tokens=max_tokens, share_encoder=share_encoder,
+                                                 features=batch["eae_features"], constrained=constrained,
+                                                 num_beams=num_beams)
+        return get_eae_result(instances, arguments)
+
+    if task == "ED":
+        return [encode_ed, detect]
+    elif task == "EAE":
+        return [encode_eae, extract]
+    else:
+        return [encode_ed, detect, encode_eae, extract]
+
+
+def infer_batch(texts, schemas="ace", task="ED", batch_size=16, model=None, tokenizer=None, triggers=None,
+                device=None, num_threads=None, bf16=False, quantize=False, max_tokens=None,
+                share_encoder=False, pipeline=False, constrained=False, num_beams=4):
+    """Batched infer method.
+
+    Args:
+        texts (`List[str]`): Input plain texts.
+        schemas (`Union[str, List[str]]`): Schema used for ED and EAE, either one for all texts or one per text.
+            Selected in ['ace', 'kbp', 'ere', 'maven', 'leven', 'duee', 'fewfc']
+        task (`str`): Task type. Selected in ['ED', 'EAE', 'EE']
+        batch_size (`int`): Number of texts fed to `model.generate` at once.
+        triggers (`List[List[List]]`, *optional*): Triggers of each text. Only useful for EAE.
+        device (`str`, *optional*): Device the released checkpoints are loaded on. Defaults to CUDA if available,
+            otherwise CPU. Inputs always follow the device of the model.
+        num_threads (`int`, *optional*): Intra-op thread count for CPU inference. Defaults to the available cores.
+        bf16 (`bool`): Whether to run generation under bf16 autocast.
+        quantize (`bool`): Whether to use dynamic-int8 quantized copies of the released checkpoints. CPU only.
+        max_tokens (`int`, *optional*): Token budget of a generation batch. If given, the inputs of each micro-batch
+            are sorted by length and split into buckets of at most `max_tokens` padded tokens, which cuts padding
+            when lengths vary. Use a large `batch_size` to give the bucketing more inputs to sort.
+        share_encoder (`bool`): Whether EAE encodes each sentence once for all its triggers instead of once per
+            trigger. Trigger positions are signalled by adding the marker embeddings to the encoder states, which
+            only approximates the marker-insertion inputs the released models are trained on.
+        pipeline (`bool`): Whether to run tokenization, ED and EAE as overlapping stages in separate threads, so that
+            the next micro-batch is tokenized during generation and, for EE, EAE of a micro-batch overlaps ED of the
+            next one. Worth it with several micro-batches on multi-core hosts or with the models on different devices.
+        constrained (`bool`): Whether to constrain generation to the labels registered for each schema (see
+            `register_schema_labels`) and to spans copied from the input text. The decoder of each schema is built
+            once and reused by later calls.
+        num_beams (`int`): Beam size of generation. `1` runs greedy decoding, which drops each finished output from
+            the batch. With `constrained=True`, an output can only end between two records.
+
+    Returns:
+        results (`List`): Predicted results in the same order as `texts`. See `infer` for the format.
+    """
+    assert task in ['ED', 'EAE', 'EE']
+    assert batch_size > 0
+    assert max_tokens is None or max_tokens > 0
+    assert num_beams > 0
+    if isinstance(schemas, str):
+        schemas = [schemas] * len(texts)
+    assert len(schemas) == len(texts)
+    assert all(schema in SUPPORTED_SCHEMAS for schema in schemas)
+    schemas = [f"<{schema}>" for schema in schemas]
+    if task == "EAE":
+        assert triggers is not None and len(triggers) == len(texts)
+    ed_pair, eae_pair = load_models(model, tokenizer, task, device, quantize)
+    if get_device(device).type == "cpu":
+        set_cpu_threads(num_threads)
+
+    results = []
+    if pipeline:
+        batches = [{
+            "texts": texts[start:start+batch_size],
+            "schemas": schemas[start:start+batch_size],
+            "triggers": triggers[start:start+batch_size] if triggers is not None else None
+        } for start in range(0, len(texts), batch_size)]
+        stages = get_pipeline_stages(ed_pair, eae_pair, task, bf16, max_tokens, share_encoder, constrained,
+                                     num_beams)
+        for batch_results in run_pipeline(batches, stages):
+            results.extend(batch_results)
+        return results
+    for start in range(0, len(texts), batch_size):
+        end = start + batch_size
+        batch_triggers = triggers[start:end] if triggers is not None else None
+        results.extend(infer_micro_batch(texts[start:end], schemas[start:end], batch_triggers,
+                                         ed_pair, eae_pair, task, bf16=bf16, max_tokens=max_tokens,
+                                         share_encoder=share_encoder, constrained=constrained,
+                                         num_beams=num_beams))
+    return results
+
+
+def infer(text, model=None, tokenizer=None, triggers=None, schema="ace", task="ED", device=None, bf16=False,
+          quantize=False, constrained=False, num_beams=4):
     """Infer method.
 
     Args:
@@ -79,6 +345,13 @@ def infer(text, model=None, tokenizer=None, triggers=None, schema="ace", task="E
         triggers (`List[List]`, *optional*): List of triggers in the text. Only useful for EAE. Examples: [(moving, 2, 8), ...]
         schema (`str`): Schema used for ED and EAE. Selected in ['ace', 'kbp', 'ere', 'maven', 'leven', 'duee', 'fewfc']
         task (`str`): Task type. Selected in ['ED', 'EAE', 'EE']
+        device (`str`, *optional*): Device the released checkpoints are loaded on. Selected in ['cuda', 'cpu', ...]
+            Defaults to CUDA if available, otherwise CPU.
+        bf16 (`bool`): Whether to run generation under bf16 autocast, mainly useful for CPU inference.
+        quantize (`bool`): Whether to use dynamic-int8 quantized copies of the released checkpoints. CPU only.
+        constrained (`bool`): Whether to constrain generation to the labels registered for `schema` and to spans of
+            `text`. See `infer_batch`.
+        num_beams (`int`): Beam size of generation, `1` for greedy decoding. See `infer_batch`.
     
     Returns:
         results (`List`): Predicted results. The format is 
@@ -102,40 +375,19 @@ def infer(text, model=None, tokenizer=None, triggers=None, schema="ace", task="E
             } 
         ]
     """
-    assert schema in ['ace', 'kbp', 'ere', 'maven', 'leven', 'duee', 'fewfc']
+    assert schema in SUPPORTED_SCHEMAS
     assert task in ['ED', 'EAE', 'EE']
-    schema = f"<{schema}>"
-    if task == "ED":
-        if model is None or tokenizer is None:
-            ed_model, ed_tokenizer = get_pretrained("s2s-mt5-ed")
-        else:
-            ed_model, ed_tokenizer = model, tokenizer
-        events = do_event_detection(ed_model, ed_tokenizer, [text], [schema])
-        results = get_ed_result([text], events)
-    elif task == "EAE":
-        if model is None or tokenizer is None:
-            eae_model, eae_tokenizer = get_pretrained("s2s-mt5-eae")
-        else:
-            eae_model, eae_tokenizer = model, tokenizer
-        instances = prepare_for_eae_from_input([text], [triggers], [schema])
-        arguments = do_event_argument_extraction(eae_model, eae_tokenizer, instances)
-        results = get_eae_result(instances, arguments)
-    elif task == "EE":
-        if model is None or tokenizer is None:
-            ed_model, ed_tokenizer = get_pretrained("s2s-mt5-ed")
-            eae_model, eae_tokenizer = get_pretrained("s2s-mt5-eae")
-        else:
-            ed_model, ed_tokenizer = model[0], tokenizer[0]
-            eae_model, eae_tokenizer = model[1], tokenizer[1]
-        events = do_event_detection(ed_model, ed_tokenizer, [text], [schema])
-        instances = prepare_for_eae_from_pred([text], events, [schema])
-        if len(instances[0]["triggers"]) == 0:
-            results = [{
-                "text": instances[0]["text"],
-                "events": []
-            }]
-            return results
-        arguments = do_event_argument_extraction(eae_model, eae_tokenizer, instances)
-        results = get_eae_result(instances, arguments)
+    results = infer_batch([text],
+                          schemas=schema,
+                          task=task,
+                          batch_size=1,
+                          model=model,
+                          tokenizer=tokenizer,
+                          triggers=[triggers] if task == "EAE" else None,
+                          device=device,
+                          bf16=bf16,
+                          quantize=quantize,
+                          constrained=constrained,
+                          num_beams=num_beams)
     print(results)
     return results
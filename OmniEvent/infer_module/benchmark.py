@@ -0,0 +1,179 @@
+import json
+import time
+import argparse
+
+from ..input_engineering.input_utils import get_plain_label
+from .seq2seq import get_device, set_cpu_threads, do_event_detection, do_event_argument_extraction, get_ed_result
+from .constraint import load_schema_labels
+
+
+SAMPLE_TEXT = "U.S. and British troops were moving on the strategic southern port city of Basra Saturday after a " \
+              "massive aerial assault pounded Baghdad at dawn"
+SAMPLE_TRIGGERS = [("moving", 29, 35), ("assault", 113, 120), ("pounded", 121, 128)]
+
+
+def load_eae_instances(data_file, schema="ace", max_instances=None):
+    """Reads instances with golden triggers from a jsonl file in the unified OmniEvent format."""
+    instances = []
+    with open(data_file) as f:
+        for line in f:
+            item = json.loads(line.strip())
+            triggers = [{"mention": trigger["trigger_word"], "offset": trigger["position"]}
+                        for event in item["events"] for trigger in event["triggers"]]
+            if len(triggers) == 0:
+                continue
+            instances.append({"text": item["text"], "schema": f"<{schema}>", "triggers": triggers})
+            if max_instances is not None and len(instances) == max_instances:
+                break
+    return instances
+
+
+def load_ed_instances(data_file, max_instances=None):
+    """Reads texts and their golden `(start, end, type)` triggers from a jsonl file in the unified OmniEvent format."""
+    texts, golds = [], []
+    with open(data_file) as f:
+        for line in f:
+            item = json.loads(line.strip())
+            texts.append(item["text"])
+            golds.append(set((trigger["position"][0], trigger["position"][1], get_plain_label(event["type"]))
+                             for event in item.get("events", []) for trigger in event["triggers"]))
+            if max_instances is not None and len(texts) == max_instances:
+                break
+    return texts, golds
+
+
+def get_sample_instances(num_instances, schema="ace"):
+    triggers = [{"mention": trigger[0], "offset": [trigger[1], trigger[2]]} for trigger in SAMPLE_TRIGGERS]
+    return [{"text": SAMPLE_TEXT, "schema": f"<{schema}>", "triggers": triggers} for _ in range(num_instances)]
+
+
+def benchmark_eae(model, tokenizer, instances, batch_size=16, share_encoder=False, bf16=False, constrained=False):
+    """Runs EAE over `instances` in batches and returns the predicted arguments and the elapsed seconds."""
+    arguments = []
+    start = time.perf_counter()
+    for i in range(0, len(instances), batch_size):
+        arguments.extend(do_event_argument_extraction(model, tokenizer, instances[i:i+batch_size],
+                                                      bf16=bf16, share_encoder=share_encoder,
+                                                      constrained=constrained))
+    return arguments, time.perf_counter() - start
+
+
+def benchmark_ed(model, tokenizer, texts, schema="ace", batch_size=16, bf16=False, constrained=False, num_beams=4):
+    """Runs ED over `texts` in batches and returns the results in the format of `infer` and the elapsed seconds."""
+    results = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        batch = texts[i:i+batch_size]
+        triggers = do_event_detection(model, tokenizer, batch, [f"<{schema}>"] * len(batch), bf16=bf16,
+                                      constrained=constrained, num_beams=num_beams)
+        results.extend(get_ed_result(batch, triggers))
+    return results, time.perf_counter() - start
+
+
+def get_trigger_f1(results, golds):
+    """Returns the micro F1 of the predicted `(start, end, type)` triggers against `golds`."""
+    num_pred, num_gold, num_correct = 0, 0, 0
+    for result, gold in zip(results, golds):
+        pred = set((event["offset"][0], event["offset"][1], event["type"]) for event in result["events"])
+        num_pred += len(pred)
+        num_gold += len(gold)
+        num_correct += len(pred & gold)
+    precision = num_correct / max(num_pred, 1)
+    recall = num_correct / max(num_gold, 1)
+    return 2 * precision * recall / max(precision + recall, 1e-12)
+
+
+def benchmark_greedy(model, tokenizer, args):
+    """Compares the latency and trigger F1 of beam search and greedy decoding for ED, with and without the
+    constraints of the schema."""
+    if args.eval_file is not None:
+        texts, golds = load_ed_instances(args.eval_file, args.num_instances)
+    else:
+        texts, golds = [SAMPLE_TEXT] * args.num_instances, None
+    settings = [("beam search", False, 4), ("greedy", False, 1)]
+    if args.type2id_file is not None:
+        load_schema_labels(args.type2id_file, args.schema, "ED")
+        settings += [("constrained beam search", True, 4), ("constrained greedy", True, 1)]
+    print("%d sentences" % len(texts))
+    for name, constrained, num_beams in settings:
+        # warm up, which also builds the decoder of the schema
+        benchmark_ed(model, tokenizer, texts[:args.batch_size], args.schema, args.batch_size, args.bf16,
+                     constrained, num_beams)
+        results, elapsed = benchmark_ed(model, tokenizer, texts, args.schema, args.batch_size, args.bf16,
+                                        constrained, num_beams)
+        f1 = " F1 %.2f%%," % (100 * get_trigger_f1(results, golds)) if golds is not None else ""
+        print("%-24s%s %.2fs, %.1f sentences/s" % (name + ":", f1, elapsed, len(texts) / elapsed))
+
+
+def get_agreement(arguments, reference):
+    """Returns the fraction of triggers whose predicted (role, mention) set matches `reference`."""
+    same = sum(set(argu[1:] for argu in a) == set(argu[1:] for argu in b) for a, b in zip(arguments, reference))
+    return same / max(len(reference), 1)
+
+
+def main():
+    from ..infer import get_pretrained
+
+    arg_parser = argparse.ArgumentParser(description="Benchmark shared-encoder EAE against marker insertion, and "
+                                                     "optionally constrained against unconstrained decoding. With "
+                                                     "`--task ED`, benchmark greedy decoding against beam search.")
+    arg_parser.add_argument("--task", type=str, default="EAE", choices=["EAE", "ED"])
+    arg_parser.add_argument("--model", type=str, default=None,
+                            help="Model identifier or path to a seq2seq checkpoint directory. Defaults to "
+                                 "s2s-mt5-eae or s2s-mt5-ed depending on the task.")
+    arg_parser.add_argument("--eval_file", type=str, default=None,
+                            help="jsonl file in the unified format whose golden triggers are used. Defaults to a "
+                                 "repeated sample sentence, without F1 for ED.")
+    arg_parser.add_argument("--schema", type=str, default="ace")
+    arg_parser.add_argument("--num_instances", type=int, default=64)
+    arg_parser.add_argument("--batch_size", type=int, default=16)
+    arg_parser.add_argument("--device", type=str, default=None)
+    arg_parser.add_argument("--bf16", action="store_true")
+    arg_parser.add_argument("--role2id_file", type=str, default=None,
+                            help="role2id.json of the schema. If given, also measures the overhead of constrained "
+                                 "decoding with these roles.")
+    arg_parser.add_argument("--type2id_file", type=str, default=None,
+                            help="type2id.json of the schema. If given, ED is also benchmarked with constrained "
+                                 "decoding with these types.")
+    args = arg_parser.parse_args()
+
+    if args.model is None:
+        args.model = "s2s-mt5-ed" if args.task == "ED" else "s2s-mt5-eae"
+    model, tokenizer = get_pretrained(args.model, device=args.device)
+    if get_device(args.device).type == "cpu":
+        set_cpu_threads()
+    if args.task == "ED":
+        benchmark_greedy(model, tokenizer, args)
+        return
+    if args.eval_file is not None:
+        instances = load_eae_instances(args.eval_file, args.schema, args.num_instances)
+    else:
+        instances = get_sample_instances(args.num_instances, args.schema)
+    num_triggers = sum(len(instance["triggers"]) for instance in instances)
+
+    # warm up
+    benchmark_eae(model, tokenizer, instances[:args.batch_size], args.batch_size, bf16=args.bf16)
+    marker_arguments, marker_time = benchmark_eae(model, tokenizer, instances, args.batch_size, bf16=args.bf16)
+    shared_arguments, shared_time = benchmark_eae(model, tokenizer, instances, args.batch_size, share_encoder=True,
+                                                  bf16=args.bf16)
+    print("%d sentences, %d triggers" % (len(instances), num_triggers))
+    print("marker insertion: %.2fs, %.1f triggers/s" % (marker_time, num_triggers / marker_time))
+    print("shared encoder:   %.2fs, %.1f triggers/s" % (shared_time, num_triggers / shared_time))
+    print("speedup: %.2fx, agreement with marker insertion: %.2f%%"
+          % (marker_time / shared_time, 100 * get_agreement(shared_arguments, marker_arguments)))
+
+    if args.role2id_file is not None:
+        load_schema_labels(args.role2id_file, args.schema, "EAE")
+        # the first call builds the decoder of the schema
+        benchmark_eae(model, tokenizer, instances[:args.batch_size], args.batch_size, bf16=args.bf16,
+                      constrained=True)
+        constrained_arguments, constrained_time = benchmark_eae(model, tokenizer, instances, args.batch_size,
+                                                                bf16=args.bf16, constrained=True)
+        print("constrained:      %.2fs, %.1f triggers/s" % (constrained_time, num_triggers / constrained_time))
+        print("constraint overhead: %.1f%%, agreement with unconstrained decoding: %.2f%%"
+              % (100 * (constrained_time / marker_time - 1),
+                 100 * get_agreement(constrained_arguments, marker_arguments)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import json
+import logging
+import threading
+
+from collections import OrderedDict
+from ..input_engineering.input_utils import get_plain_label
+from ..model.constraint_decoding import StruConstraintDecoder, MultiSchemaConstraintDecoder
+
+logger = logging.getLogger(__name__)
+
+split_word = ":"
+
+# labels the models generate for each schema, filled by `register_schema_labels`
+SCHEMA_LABELS = {"ED": dict(), "EAE": dict()}
+
+# the decoders built by `get_schema_decoder` and `get_multi_schema_decoder`, least recently used first. They keep
+# their tokenizer alive, so the id of a tokenizer in the keys is not reused while its decoders are cached.
+MAX_CACHED_DECODERS = 64
+_decoders = OrderedDict()
+_decoders_lock = threading.RLock()
+
+
+def register_schema_labels(schema, labels, task="ED"):
+    """Registers the event types (ED) or argument roles (EAE) a model may generate for `schema`.
+
+    The released checkpoints do not ship their label lists, so constrained decoding needs them to be registered
+    once, e.g. from the `type2id.json` / `role2id.json` files of the processed datasets, see `load_schema_labels`.
+
+    Args:
+        schema (`str`): Schema name, with or without brackets, e.g. `ace` or `<ace>`.
+        labels (`List[str]`): Plain labels, as returned by `get_plain_label`. `NA` is ignored.
+        task (`str`): Selected in ['ED', 'EAE'].
+    """
+    assert task in ["ED", "EAE"]
+    schema = get_schema_marker(schema)
+    labels = sorted(set(label for label in labels if label != "NA"))
+    if len(labels) == 0:
+        raise ValueError("No labels given for %s." % schema)
+    with _decoders_lock:
+        SCHEMA_LABELS[task][schema] = labels
+        # the multi-schema decoder of the task is keyed by None
+        for key in [key for key in _decoders if key[1:] in [(schema, task), (None, task)]]:
+            del _decoders[key]
+
+
+def load_schema_labels(label2id_file, schema, task="ED"):
+    """Registers the labels of a `type2id.json` (ED) or `role2id.json` (EAE) file for `schema`."""
+    with open(label2id_file) as f:
+        labels = [get_plain_label(label) for label in json.load(f)]
+    register_schema_labels(schema, labels, task)
+
+
+def get_schema_marker(schema):
+    return schema if schema.startswith("<") else f"<{schema}>"
+
+
+def tokenize_schema_marker(tokenizer, schema):
+    """Returns the tokens of the schema marker ED inputs start with, the marker being their first word, see
+    `EDProcessor.tokenize_per_instance`."""
+    return tokenizer([schema], is_split_into_words=True, add_special_tokens=False)["input_ids"]
+
+
+def _get_cached_decoder(key):
+    decoder = _decoders.get(key, None)
+    if decoder is not None:
+        _decoders.move_to_end(key)
+    return decoder
+
+
+def _cache_decoder(key, decoder):
+    _decoders[key] = decoder
+    while len(_decoders) > MAX_CACHED_DECODERS:
+        _decoders.popitem(last=False)
+
+
+def get_schema_decoder(tokenizer, schema, task="ED"):
+    """Returns the constraint decoder of `schema`, built once per tokenizer, schema and task.
+
+    The decoder allows the generated records to use the registered labels only, and their spans to be copied from
+    the input. Its label-name tree is compiled on first use and kept with the decoder, so later calls only pay for
+    the decoding itself.
+    """
+    assert task in ["ED", "EAE"]
+    schema = get_schema_marker(schema)
+    key = (id(tokenizer), schema, task)
+    with _decoders_lock:
+        decoder = _get_cached_decoder(key)
+        if decoder is not None:
+            return decoder
+        if schema not in SCHEMA_LABELS[task]:
+            raise ValueError("No %s labels are registered for %s, see `register_schema_labels`." % (task, schema))
+        labels = SCHEMA_LABELS[task][schema]
+        # ED inputs start with the schema marker, which is not part of any span
+        decoder = StruConstraintDecoder(tokenizer,
+                                        {"role_list": [f"{label}{split_word}" for label in labels]},
+                                        source_prefix=schema if task == "ED" else None,
+                                        source_prefix_tokenized=tokenize_schema_marker(tokenizer, schema)
+                                        if task == "ED" else None)
+        _cache_decoder(key, decoder)
+        logger.info("Built the %s constraint decoder of %s with %d labels" % (task, schema, len(labels)))
+        return decoder
+
+
+def get_multi_schema_decoder(tokenizer, schemas, task="ED"):
+    """Returns a `MultiSchemaConstraintDecoder` over all the schemas registered for `task`, which picks the decoder
+    of each input from the schema marker it starts with, so that inputs of different schemas are generated together.
+
+    Only ED inputs start with their schema marker. Raises a `ValueError` if one of `schemas` is not registered.
+    """
+    assert task == "ED"
+    with _decoders_lock:
+        for schema in set(schemas):
+            get_schema_decoder(tokenizer, schema, task)
+        key = (id(tokenizer), None, task)
+        decoder = _get_cached_decoder(key)
+        if decoder is not None:
+            return decoder
+        decoder = MultiSchemaConstraintDecoder(tokenizer, {schema: get_schema_decoder(tokenizer, schema, task)
+                                                           for schema in SCHEMA_LABELS[task]})
+        _cache_decoder(key, decoder)
+        return decoder
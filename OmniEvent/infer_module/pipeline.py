@@ -0,0 +1,84 @@
+import queue
+import threading
+
+
+class _Failure(object):
+    """Carries an exception raised by a stage down the pipeline."""
+    def __init__(self, exception):
+        self.exception = exception
+
+
+_STOP = object()
+
+
+def _put(q, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop_event):
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _STOP
+
+
+def run_pipeline(items, stages, max_queue_size=2):
+    """Runs `items` through `stages`, each stage in its own thread, and yields the outputs in input order.
+
+    Consecutive stages are connected by bounded queues, so stage `i` works on item `k + 1` while stage `i + 1` works
+    on item `k`. An exception raised by a stage is re-raised by the generator, and all threads are stopped once the
+    generator is exhausted or closed.
+
+    Args:
+        items (`Iterable`): Inputs of the first stage.
+        stages (`List[Callable]`): Functions mapping the output of the previous stage to the input of the next one.
+        max_queue_size (`int`): Maximum number of items waiting between two stages.
+    """
+    stop_event = threading.Event()
+    queues = [queue.Queue(max_queue_size) for _ in range(len(stages) + 1)]
+
+    def feed():
+        for item in items:
+            if not _put(queues[0], item, stop_event):
+                return
+        _put(queues[0], _STOP, stop_event)
+
+    def work(stage, in_queue, out_queue):
+        while True:
+            item = _get(in_queue, stop_event)
+            if item is _STOP:
+                _put(out_queue, _STOP, stop_event)
+                return
+            if not isinstance(item, _Failure):
+                try:
+                    item = stage(item)
+                except Exception as e:
+                    item = _Failure(e)
+            if not _put(out_queue, item, stop_event):
+                return
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=work, args=(stage, queues[i], queues[i + 1]), daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _STOP:
+                break
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,175 @@
+import io
+import os
+import argparse
+import logging
+import tempfile
+import numpy as np
+import torch
+import torch.nn as nn
+
+from torch.utils.data import DataLoader
+from torch.ao.quantization import quantize_dynamic
+from transformers import AutoConfig
+
+from ..utils import hash_file, hash_json
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_WEIGHTS_NAME = "pytorch_model.int8.bin"
+
+
+def quantize_model(model):
+    """Applies dynamic int8 quantization to the Linear layers of `model`. Quantized models only run on CPU."""
+    model.cpu()
+    model.eval()
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def get_quantized_path(path):
+    """Returns the path of the cached quantized state dict for the checkpoint directory `path`."""
+    return os.path.join(path, QUANTIZED_WEIGHTS_NAME)
+
+
+def get_checkpoint_hash(path):
+    """Returns the sha256 of the config and fp32 weight files of the checkpoint directory `path`."""
+    names = [name for name in os.listdir(path) if name == "config.json" or name.endswith(".safetensors")
+             or (name.startswith("pytorch_model") and name.endswith(".bin") and name != QUANTIZED_WEIGHTS_NAME)]
+    return hash_json({name: hash_file(os.path.join(path, name)) for name in sorted(names)})
+
+
+def save_quantized(model, path, checkpoint_hash):
+    """Quantizes `model` and caches its state dict next to the checkpoint in `path`, with the hash of the fp32
+    checkpoint it was quantized from. The quantized model is still returned if `path` is not writable."""
+    quantized_model = quantize_model(model)
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=path, suffix=".tmp")
+    except OSError as e:
+        logger.warning("Cannot cache the quantized model in %s, quantizing in memory only: %s", path, e)
+        return quantized_model
+    # written aside and renamed, so that an interrupted export does not leave a truncated cache
+    with os.fdopen(fd, "wb") as f:
+        torch.save({"checkpoint_hash": checkpoint_hash, "state_dict": quantized_model.state_dict()}, f)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, get_quantized_path(path))
+    return quantized_model
+
+
+def load_quantized(model_cls, path, checkpoint_hash):
+    """Loads the cached quantized checkpoint in `path` without loading the fp32 weights. Returns `None` if there is
+    none, or if it was quantized from other fp32 weights than those of `checkpoint_hash`."""
+    quantized_path = get_quantized_path(path)
+    if not os.path.exists(quantized_path):
+        return None
+    cached = torch.load(quantized_path, map_location="cpu")
+    if not isinstance(cached, dict) or cached.get("checkpoint_hash") != checkpoint_hash:
+        logger.info("The quantized model in %s is outdated, quantizing the checkpoint again.", path)
+        return None
+    config = AutoConfig.from_pretrained(path)
+    model = quantize_model(model_cls(config))
+    model.load_state_dict(cached["state_dict"])
+    return model
+
+
+def get_quantized(model_cls, path):
+    """Returns the quantized model of the checkpoint in `path`, loaded from the cache if it is up to date, otherwise
+    quantized from the fp32 weights and cached."""
+    checkpoint_hash = get_checkpoint_hash(path)
+    model = load_quantized(model_cls, path, checkpoint_hash)
+    if model is None:
+        model = save_quantized(model_cls.from_pretrained(path), path, checkpoint_hash)
+    return model
+
+
+def get_model_size(model):
+    """Returns the size in bytes of the serialized state dict of `model`."""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+
+def pad_to_max_len(array, max_length, pad_value):
+    """Pads a 2-D integer array on the right to `max_length`."""
+    padded = np.full((array.shape[0], max_length), pad_value, dtype=array.dtype)
+    padded[:, :array.shape[1]] = array[:, :max_length]
+    return padded
+
+
+def evaluate_seq2seq(model,
+                     tokenizer,
+                     data_file,
+                     task="ED",
+                     language="English",
+                     batch_size=32,
+                     max_seq_length=160,
+                     max_out_length=128,
+                     num_beams=4):
+    """Computes `compute_seq_F1` of a seq2seq model on a labeled file in the unified OmniEvent format."""
+    from ..infer import AttrDict
+    from ..evaluation.metric import compute_seq_F1
+    from ..input_engineering.seq2seq_processor import EDSeq2SeqProcessor, EAESeq2SeqProcessor
+
+    config = AttrDict(
+        max_seq_length=max_seq_length,
+        max_out_length=max_out_length,
+        language=language,
+        markers=["<event>", "</event>"],
+        golden_trigger=True,
+        eae_eval_mode="default",
+        return_token_type_ids=False,
+        truncate_in_batch=True,
+        truncate_seq2seq_output=True
+    )
+    if task == "ED":
+        dataset = EDSeq2SeqProcessor(config, tokenizer, data_file)
+    else:
+        dataset = EAESeq2SeqProcessor(config, tokenizer, data_file, None, False)
+    dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=dataset.collate_fn)
+
+    device = model.device
+    all_preds, all_labels = [], []
+    for batch in dataloader:
+        with torch.inference_mode():
+            generated_tokens = model.generate(batch["input_ids"].to(device),
+                                              attention_mask=batch["attention_mask"].to(device),
+                                              max_length=max_out_length,
+                                              num_beams=num_beams)
+        all_preds.append(pad_to_max_len(generated_tokens.cpu().numpy(), max_out_length, tokenizer.pad_token_id))
+        all_labels.append(pad_to_max_len(batch["labels"].numpy(), max_out_length, -100))
+
+    training_args = AttrDict(task_name=task)
+    if task == "EAE":
+        training_args.data_for_evaluation = dataset.get_data_for_evaluation()
+    metrics = compute_seq_F1(np.concatenate(all_preds), np.concatenate(all_labels),
+                             tokenizer=tokenizer, training_args=training_args)
+    return metrics["micro_f1"]
+
+
+def main():
+    from ..infer import get_pretrained
+
+    arg_parser = argparse.ArgumentParser(description="Export a dynamic-int8 quantized seq2seq checkpoint for CPU.")
+    arg_parser.add_argument("--model", type=str, default="s2s-mt5-ed",
+                            help="Model identifier (s2s-mt5-ed, s2s-mt5-eae) or path to a checkpoint directory.")
+    arg_parser.add_argument("--eval_file", type=str, default=None,
+                            help="Held-out jsonl file used to report the F1 delta of the quantized model.")
+    arg_parser.add_argument("--task", type=str, default="ED", choices=["ED", "EAE"])
+    arg_parser.add_argument("--language", type=str, default="English", choices=["English", "Chinese"])
+    arg_parser.add_argument("--batch_size", type=int, default=32)
+    args = arg_parser.parse_args()
+
+    model, tokenizer = get_pretrained(args.model, device="cpu")
+    fp32_size = get_model_size(model)
+    if args.eval_file is not None:
+        fp32_f1 = evaluate_seq2seq(model, tokenizer, args.eval_file, args.task, args.language, args.batch_size)
+    # `get_pretrained` exports the quantized state dict on the first call
+    quantized_model, _ = get_pretrained(args.model, device="cpu", quantize=True)
+    int8_size = get_model_size(quantized_model)
+    print("fp32 size: %.1fMB, int8 size: %.1fMB" % (fp32_size / 2**20, int8_size / 2**20))
+    if args.eval_file is not None:
+        int8_f1 = evaluate_seq2seq(quantized_model, tokenizer, args.eval_file, args.task, args.language,
+                                   args.batch_size)
+        print("fp32 F1: %.2f, int8 F1: %.2f, delta: %.2f" % (fp32_f1, int8_f1, int8_f1 - fp32_f1))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,41 @@
+import os 
 import re 
 import torch 
+import torch.nn.functional as F
 
 from collections import defaultdict
+from transformers import LogitsProcessorList
+from transformers.modeling_outputs import BaseModelOutput
 from .io_format import Result, Event
+from .constraint import get_schema_decoder, get_multi_schema_decoder
+from ..model.constraint_logits_processor import get_constraint_logits_processor
 
 
 split_word = ":"
 
+
+def get_device(device=None):
+    """Returns `device` as a `torch.device`, picking CUDA when available if no device is given."""
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(device)
+
+
+def get_num_cpu_threads():
+    """Returns the number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def set_cpu_threads(num_threads=None):
+    """Sets the intra-op thread count of torch for CPU inference, defaulting to the cores available to the process."""
+    num_threads = num_threads if num_threads is not None else get_num_cpu_threads()
+    if torch.get_num_threads() != num_threads:
+        torch.set_num_threads(num_threads)
+    return num_threads
+
+
 def get_words(text, language):
     if language == "English":
         words = text.split()
@@ -17,19 +46,61 @@ def get_words(text, language):
     return words
 
 
+def collate_features(features, pad_token_id, device):
+    """Right-pads unpadded features to the longest one and stacks them into a batch on `device`."""
+    input_length = max(len(feature["input_ids"]) for feature in features)
+    output_batch = defaultdict(list)
+    for key in features[0].keys():
+        pad_value = pad_token_id if key == "input_ids" else 0
+        output_batch[key] = torch.stack([
+            F.pad(feature[key], (0, input_length - len(feature[key])), value=pad_value) for feature in features
+        ], dim=0).to(device)
+    return output_batch
+
+
+def get_length_buckets(lengths, max_tokens=None):
+    """Groups instance indices into buckets of similar length.
+
+    Instances are sorted by length and a bucket is closed once its padded size, i.e. the number of instances times
+    the longest length, would exceed `max_tokens`. A bucket always holds at least one instance. Without `max_tokens`
+    all instances form a single bucket in their original order.
+
+    Args:
+        lengths (`List[int]`): Token length of each instance.
+        max_tokens (`int`, *optional*): Token budget of a bucket.
+
+    Returns:
+        buckets (`List[List[int]]`): Indices of the instances in each bucket.
+    """
+    if max_tokens is None:
+        return [list(range(len(lengths)))] if len(lengths) > 0 else []
+    buckets, bucket, bucket_length = [], [], 0
+    for index in sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True):
+        if bucket and (len(bucket) + 1) * bucket_length > max_tokens:
+            buckets.append(bucket)
+            bucket = []
+        if not bucket:
+            bucket_length = lengths[index]
+        bucket.append(index)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
 class EDProcessor():
-    def __init__(self, tokenizer, max_seq_length=160):
+    def __init__(self, tokenizer, max_seq_length=160, device=None):
         self.tokenizer = tokenizer 
         self.max_seq_length = max_seq_length
+        self.device = get_device(device)
 
     def tokenize_per_instance(self, text, schema):
+        # the schema marker is a word of its own, as in `EDSeq2SeqProcessor`, so that the input starts with its tokens
         if schema in ["<duee>", "<fewfc>", "<leven>"]:
-            words = get_words(schema+text, "Chinese")
+            words = [schema] + get_words(text, "Chinese")
         else:
-            words = get_words(schema+text, "English")
+            words = [schema] + get_words(text, "English")
         input_context = self.tokenizer(words,
                                        truncation=True,
-                                       padding="max_length",
                                        max_length=self.max_seq_length,
                                        is_split_into_words=True)
         return dict(
@@ -38,27 +109,18 @@ class EDProcessor():
         )
 
 
+    def encode(self, texts, schemas):
+        return [self.tokenize_per_instance(text, schema) for text, schema in zip(texts, schemas)]
+
     def tokenize(self, texts, schemas):
-        batch = []
-        for text, schema in zip(texts, schemas):
-            batch.append(self.tokenize_per_instance(text, schema))
-        # output batch features 
-        output_batch = defaultdict(list)
-        for key in batch[0].keys():
-            output_batch[key] = torch.stack([x[key] for x in batch], dim=0)
-        # truncate
-        input_length = int(output_batch["attention_mask"].sum(-1).max())
-        for key in ["input_ids", "attention_mask", "token_type_ids"]:
-            if key not in output_batch:
-                continue
-            output_batch[key] = output_batch[key][:, :input_length].cuda()
-        return output_batch
+        return collate_features(self.encode(texts, schemas), self.tokenizer.pad_token_id, self.device)
 
 
 class EAEProcessor():
-    def __init__(self, tokenizer, max_seq_length=160):
+    def __init__(self, tokenizer, max_seq_length=160, device=None):
         self.tokenizer = tokenizer 
         self.max_seq_length = max_seq_length
+        self.device = get_device(device)
 
     def insert_marker(self, text, trigger_pos, whitespace=True):
         space = " " if whitespace else ""
@@ -85,7 +147,6 @@ class EAEProcessor():
         words = get_words(text, language)
         input_context = self.tokenizer(words,
                                        truncation=True,
-                                       padding="max_length",
                                        max_length=self.max_seq_length,
                                        is_split_into_words=True)
         return dict(
@@ -93,22 +154,45 @@ class EAEProcessor():
             attention_mask=torch.tensor(input_context["attention_mask"], dtype=torch.float32)
         )
 
-    def tokenize(self, instances):
+    def encode(self, instances):
         batch = []
         for i, instance in enumerate(instances):
             for trigger in instance["triggers"]:
                 batch.append(self.tokenize_per_instance(instance["text"], trigger, instance["schema"]))
-        # output batch features 
-        output_batch = defaultdict(list)
-        for key in batch[0].keys():
-            output_batch[key] = torch.stack([x[key] for x in batch], dim=0)
-        # truncate
-        input_length = int(output_batch["attention_mask"].sum(-1).max())
-        for key in ["input_ids", "attention_mask", "token_type_ids"]:
-            if key not in output_batch:
-                continue
-            output_batch[key] = output_batch[key][:, :input_length].cuda()
-        return output_batch
+        return batch
+
+    def encode_shared(self, instances):
+        """Tokenizes each sentence once without markers.
+
+        Returns one feature per instance and, for each trigger in input order, the index of its instance and the
+        token span `[start, end)` it covers (`None` if the trigger is truncated away).
+        """
+        features, trigger_rows, trigger_spans = [], [], []
+        for i, instance in enumerate(instances):
+            language = "Chinese" if instance["schema"] in ["<duee>", "<fewfc>", "<leven>"] else "English"
+            if language == "English":
+                word_spans = [match.span() for match in re.finditer(r"\S+", instance["text"])]
+            else:
+                word_spans = [(j, j + 1) for j in range(len(instance["text"]))]
+            input_context = self.tokenizer(get_words(instance["text"], language),
+                                           truncation=True,
+                                           max_length=self.max_seq_length,
+                                           is_split_into_words=True)
+            word_ids = input_context.word_ids()
+            features.append(dict(
+                input_ids=torch.tensor(input_context["input_ids"], dtype=torch.long),
+                attention_mask=torch.tensor(input_context["attention_mask"], dtype=torch.float32)
+            ))
+            for trigger in instance["triggers"]:
+                start, end = trigger["offset"]
+                tokens = [j for j, word_id in enumerate(word_ids) if word_id is not None
+                          and word_spans[word_id][0] < end and word_spans[word_id][1] > start]
+                trigger_rows.append(i)
+                trigger_spans.append((tokens[0], tokens[-1] + 1) if len(tokens) > 0 else None)
+        return features, trigger_rows, trigger_spans
+
+    def tokenize(self, instances):
+        return collate_features(self.encode(instances), self.tokenizer.pad_token_id, self.device)
 
 
 def find_position(mention, text):
@@ -117,51 +201,108 @@ def find_position(mention, text):
     return [char_start, char_end]
 
 
+class MentionIndex(object):
+    """Maps generated mentions back to character spans of a text.
+
+    The text is indexed once with its whitespace removed, since generated mentions may differ from the text in
+    spacing. A mention matches every occurrence in the index, and each call prefers an occurrence not yet used under
+    the same `key`. Among those it takes the one nearest to `near` if given, otherwise the first that starts and ends
+    on word boundaries, otherwise the first.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.positions = [i for i, char in enumerate(text) if not char.isspace()]
+        self.compact_text = "".join(text[i] for i in self.positions)
+        self.candidates = dict()
+        self.used = set()
+
+    def get_candidates(self, mention):
+        mention = "".join(mention.split())
+        if mention not in self.candidates:
+            spans = []
+            start = self.compact_text.find(mention) if mention != "" else -1
+            while start != -1:
+                spans.append((self.positions[start], self.positions[start + len(mention) - 1] + 1))
+                start = self.compact_text.find(mention, start + 1)
+            self.candidates[mention] = spans
+        return self.candidates[mention]
+
+    def is_word(self, span):
+        return (span[0] == 0 or not self.text[span[0] - 1].isalnum() or not self.text[span[0]].isalnum()) and \
+               (span[1] == len(self.text) or not self.text[span[1]].isalnum() or not self.text[span[1] - 1].isalnum())
+
+    def find(self, mention, key=None, near=None):
+        """Returns the `[char start, char end]` span chosen for `mention`, or None if it does not occur."""
+        candidates = self.get_candidates(mention)
+        if len(candidates) == 0:
+            return None
+        candidates = [span for span in candidates if (key, span) not in self.used] or candidates
+        if near is not None:
+            span = min(candidates, key=lambda span: abs(span[0] - near[0]))
+        else:
+            span = next((span for span in candidates if self.is_word(span)), candidates[0])
+        self.used.add((key, span))
+        return list(span)
+
+
+def group_by_instance(predictions, num_instances):
+    """Groups `(instance_id, ...)` predictions by instance id in one pass."""
+    grouped = [[] for _ in range(num_instances)]
+    for prediction in predictions:
+        grouped[prediction[0]].append(prediction)
+    return grouped
+
+
+def align_triggers(text, triggers):
+    """Maps the predicted `(instance_id, type, mention)` triggers of `text` to character spans. A repeated mention of
+    the same type takes a different occurrence each time, while one span may carry several event types."""
+    mention_index = MentionIndex(text)
+    aligned = []
+    for _, type, mention in triggers:
+        offset = mention_index.find(mention, key=type)
+        if offset is None:
+            continue
+        aligned.append({
+            "type": type,
+            "trigger": text[offset[0]:offset[1]],
+            "offset": offset
+        })
+    return aligned
+
+
 def get_ed_result(texts, triggers):
     results = []
-    for i, text in enumerate(texts):
-        triggers_in_text = [trigger for trigger in triggers if trigger[0]==i]
-        result = Result()
-        events = []
-        for trigger in triggers_in_text:
-            type = trigger[1]
-            mention = trigger[2]
-            if mention not in text:
-                continue
-            offset = find_position(mention, text)
-            event = {
-                "type": type,
-                "trigger": mention,
-                "offset": offset
-            }
-            events.append(event)
+    for text, triggers_in_text in zip(texts, group_by_instance(triggers, len(texts))):
         results.append({
             "text": text,
-            "events": events 
+            "events": align_triggers(text, triggers_in_text)
         })
     return results
 
 
 def get_eae_result(instances, arguments):
     results = []
+    # `arguments` holds one entry per trigger, flattened over all instances
+    trigger_idx = 0
     for i, instance in enumerate(instances):
-        result = Result()
+        mention_index = MentionIndex(instance["text"])
         events = []
-        for trigger, argus_in_trigger in zip(instance["triggers"], arguments):
-            event = Event()
+        for trigger in instance["triggers"]:
+            argus_in_trigger = arguments[trigger_idx]
             event_arguments = []
             for argu in argus_in_trigger:
                 role = argu[1]
-                mention = argu[2]
-                if mention not in instance["text"]:
+                # arguments of a trigger are matched to the occurrences nearest to it
+                offset = mention_index.find(argu[2], key=(trigger_idx, role), near=trigger["offset"])
+                if offset is None:
                     continue
-                offset = find_position(mention, instance["text"])
                 argument = {
-                    "mention": mention,
+                    "mention": instance["text"][offset[0]:offset[1]],
                     "offset": offset,
                     "role": role
                 }
                 event_arguments.append(argument)
+            trigger_idx += 1
             events.append({
                 "type": trigger["type"] if "type" in trigger else "NA",
                 "offset": trigger["offset"], 
@@ -194,25 +335,16 @@ def prepare_for_eae_from_input(texts, all_triggers, schemas):
 
 def prepare_for_eae_from_pred(texts, triggers, schemas):
     instances = []
-    for i, text in enumerate(texts):
-        triggers_in_text = [trigger for trigger in triggers if trigger[0]==i]
-        instance = {
-            "text": text,
+    for i, triggers_in_text in enumerate(group_by_instance(triggers, len(texts))):
+        instances.append({
+            "text": texts[i],
             "schema": schemas[i],
-            "triggers": []
-        }
-        for trigger in triggers_in_text:
-            type = trigger[1]
-            mention = trigger[2]
-            if mention not in text:
-                continue
-            offset = find_position(mention, text)
-            instance["triggers"].append({
-                "type": type, 
-                "mention": mention,
-                "offset": offset
-            })
-        instances.append(instance)
+            "triggers": [{
+                "type": trigger["type"],
+                "mention": trigger["trigger"],
+                "offset": trigger["offset"]
+            } for trigger in align_triggers(texts[i], triggers_in_text)]
+        })
     return instances 
 
 
@@ -228,34 +360,180 @@ def extract_argument(raw_text, instance_id, template=re.compile(r"<|>")):
         value = words[1].strip().replace(" ", "")
         if role != "" and value != "":
             arguments.append((instance_id, role, value))
-    arguments = list(set(arguments))
+    # drop duplicates but keep the generation order, which the alignment relies on
+    arguments = list(dict.fromkeys(arguments))
     return arguments
 
 
-def generate(model, tokenizer, inputs):
+def greedy_generate(model, tokenizer, inputs, max_length=128, bf16=False, logits_processor=None):
+    """Greedy decoding without beam bookkeeping, returning the generated token ids of each row.
+
+    A row ends with the eos it generates. Under the flat-record grammar of `StruConstraintLogitsProcessor`, eos is
+    allowed at the start and after each record only, so a constrained row can only end between records. The tokens
+    allowed by `logits_processor` (built with `num_beams=1`) are known before the decoder runs, so a row the grammar
+    allows nothing but eos, i.e. an invalid or broken record or a source without any span to copy, is finished without
+    another decoder step. Finished rows are dropped from the batch, together with their cache and encoder states, so
+    the remaining steps only run the rows still generating.
+    """
+    device = inputs["attention_mask"].device
+    eos_token_id = tokenizer.eos_token_id
+    with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+        encoder_outputs = inputs.get("encoder_outputs", None)
+        if encoder_outputs is None:
+            encoder_outputs = model.get_encoder()(input_ids=inputs["input_ids"],
+                                                  attention_mask=inputs["attention_mask"])
+        hidden_states = encoder_outputs.last_hidden_state
+        attention_mask = inputs["attention_mask"]
+        num_rows = hidden_states.shape[0]
+        input_ids = torch.full((num_rows, 1), model.config.decoder_start_token_id, dtype=torch.long, device=device)
+        rows = list(range(num_rows))
+        outputs = [None] * num_rows
+        past_key_values = None
+        while True:
+            done = input_ids[:, -1] == eos_token_id
+            forced = torch.zeros_like(done)
+            allowed = None
+            if logits_processor is not None:
+                allowed = logits_processor(input_ids, torch.zeros((input_ids.shape[0], model.config.vocab_size),
+                                                                  device=device)) == 0
+                # the grammar allows no further record
+                forced = ~done & allowed[:, eos_token_id] & (allowed.sum(-1) == 1)
+            if input_ids.shape[1] >= max_length:
+                forced = torch.zeros_like(done)
+                done = torch.ones_like(done)
+            done |= forced
+            for i in done.nonzero().view(-1).tolist():
+                outputs[rows[i]] = input_ids[i].tolist() + ([eos_token_id] if forced[i] else [])
+            if bool(done.all()):
+                break
+            if bool(done.any()):
+                keep = (~done).nonzero().view(-1)
+                rows = [rows[i] for i in keep.tolist()]
+                input_ids, attention_mask = input_ids[keep], attention_mask[keep]
+                hidden_states = hidden_states[keep]
+                if allowed is not None:
+                    allowed = allowed[keep]
+                    logits_processor.select_rows(keep)
+                if past_key_values is not None:
+                    past_key_values = tuple(tuple(state[keep] for state in layer) for layer in past_key_values)
+            model_outputs = model(encoder_outputs=BaseModelOutput(last_hidden_state=hidden_states),
+                                  attention_mask=attention_mask,
+                                  decoder_input_ids=input_ids[:, -1:],
+                                  past_key_values=past_key_values,
+                                  use_cache=True)
+            past_key_values = model_outputs.past_key_values
+            logits = model_outputs.logits[:, -1].float()
+            if allowed is not None:
+                logits = logits.masked_fill(~allowed[:, :logits.shape[-1]], -float("inf"))
+            input_ids = torch.cat([input_ids, logits.argmax(-1)[:, None]], dim=1)
+    return outputs
+
+
+def generate(model, tokenizer, inputs, bf16=False, constraint_decoder=None, src_input_ids=None, num_beams=4):
+    """Generates from `inputs`. With `constraint_decoder`, the outputs follow its grammar over the source
+    `src_input_ids`, which defaults to the `input_ids` of `inputs`. With `num_beams=1`, `greedy_generate` is used."""
     gen_kwargs = {
         "max_length": 128,
-        "num_beams": 4,
+        "num_beams": num_beams,
         "synced_gpus": False,
         "prefix_allowed_tokens_fn": None 
     }
+    if num_beams == 1:
+        logits_processor = None
+        if constraint_decoder is not None:
+            src_input_ids = src_input_ids if src_input_ids is not None else inputs["input_ids"]
+            logits_processor = get_constraint_logits_processor(constraint_decoder, src_input_ids, num_beams=1)
+        generated_tokens = greedy_generate(model, tokenizer, inputs, gen_kwargs["max_length"], bf16,
+                                           logits_processor)
+        return tokenizer.batch_decode(generated_tokens, skip_special_tokens=False)
 
     if "attention_mask" in inputs:
         gen_kwargs["attention_mask"] = inputs.get("attention_mask", None)
+    if "encoder_outputs" in inputs:
+        gen_kwargs["encoder_outputs"] = inputs["encoder_outputs"]
+    if constraint_decoder is not None:
+        src_input_ids = src_input_ids if src_input_ids is not None else inputs["input_ids"]
+        gen_kwargs["logits_processor"] = LogitsProcessorList([
+            get_constraint_logits_processor(constraint_decoder, src_input_ids, gen_kwargs["num_beams"])
+        ])
+
+    generation_inputs = inputs.get("input_ids", None)
+
+    with torch.inference_mode(), torch.autocast(device_type=inputs["attention_mask"].device.type,
+                                                dtype=torch.bfloat16,
+                                                enabled=bf16):
+        generated_tokens = model.generate(
+            generation_inputs,
+            **gen_kwargs,
+        )
+    return tokenizer.batch_decode(generated_tokens, skip_special_tokens=False)
 
-    generation_inputs = inputs["input_ids"]
 
-    generated_tokens = model.generate(
-        generation_inputs,
-        **gen_kwargs,
+def encode_with_trigger_markers(model, tokenizer, inputs, trigger_rows, trigger_spans, bf16=False):
+    """Encodes each sentence of `inputs` once and builds one encoder output per trigger.
+
+    The encoder states of a sentence are copied for each of its triggers, and the embeddings of the `<event>` and
+    `</event>` markers are added to the first and last token of the trigger in place of inserting the markers into
+    the input. This approximates the marker-insertion inputs the EAE models are trained on; use
+    `OmniEvent.infer_module.benchmark` to check the agreement on your data.
+    """
+    marker_ids = tokenizer.convert_tokens_to_ids(["<event>", "</event>"])
+    assert tokenizer.unk_token_id not in marker_ids, "The tokenizer has no <event> markers."
+    device = inputs["input_ids"].device
+    rows = torch.tensor(trigger_rows, dtype=torch.long, device=device)
+    with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=torch.bfloat16, enabled=bf16):
+        hidden_states = model.get_encoder()(input_ids=inputs["input_ids"],
+                                            attention_mask=inputs["attention_mask"]).last_hidden_state
+        hidden_states = hidden_states.index_select(0, rows).clone()
+        markers = model.get_input_embeddings()(torch.tensor(marker_ids, device=device)).to(hidden_states.dtype)
+        for i, span in enumerate(trigger_spans):
+            if span is None:
+                continue
+            hidden_states[i, span[0]] += markers[0]
+            hidden_states[i, span[1] - 1] += markers[1]
+    return dict(
+        encoder_outputs=BaseModelOutput(last_hidden_state=hidden_states),
+        attention_mask=inputs["attention_mask"].index_select(0, rows)
     )
-    return tokenizer.batch_decode(generated_tokens, skip_special_tokens=False)
 
 
-def do_event_detection(model, tokenizer, texts, schemas):
-    data_processor = EDProcessor(tokenizer)
-    inputs = data_processor.tokenize(texts, schemas)
-    decoded_preds = generate(model, tokenizer, inputs)
+def split_by_decoder(rows, decoders=None):
+    """Splits `rows` into `(decoder, rows)` groups sharing the same constraint decoder, keeping their order."""
+    if decoders is None:
+        return [(None, rows)] if len(rows) > 0 else []
+    groups = dict()
+    for row in rows:
+        groups.setdefault(id(decoders[row]), (decoders[row], []))[1].append(row)
+    return list(groups.values())
+
+
+def generate_in_buckets(model, tokenizer, features, device, max_tokens=None, bf16=False, decoders=None,
+                        num_beams=4):
+    """Runs `generate` over length buckets of `features` and returns the decoded predictions in input order.
+
+    `decoders` optionally holds the constraint decoder of each feature; a bucket is split by decoder.
+    """
+    decoded_preds = [None] * len(features)
+    for bucket in get_length_buckets([len(feature["input_ids"]) for feature in features], max_tokens):
+        for decoder, rows in split_by_decoder(bucket, decoders):
+            inputs = collate_features([features[i] for i in rows], tokenizer.pad_token_id, device)
+            for i, pred in zip(rows, generate(model, tokenizer, inputs, bf16=bf16, constraint_decoder=decoder,
+                                              num_beams=num_beams)):
+                decoded_preds[i] = pred
+    return decoded_preds
+
+
+def do_event_detection(model, tokenizer, texts, schemas, device=None, bf16=False, max_tokens=None, features=None,
+                       constrained=False, num_beams=4):
+    data_processor = EDProcessor(tokenizer, device=device if device is not None else model.device)
+    if features is None:
+        features = data_processor.encode(texts, schemas)
+    decoders = None
+    if constrained:
+        # the inputs start with their schema marker, so one decoder handles all schemas
+        decoders = [get_multi_schema_decoder(tokenizer, schemas, "ED")] * len(features)
+    decoded_preds = generate_in_buckets(model, tokenizer, features, data_processor.device, max_tokens, bf16,
+                                        decoders, num_beams)
     def clean_str(x_str):
         for to_remove_token in [tokenizer.eos_token, tokenizer.pad_token]:
             x_str = x_str.replace(to_remove_token, '')
@@ -267,10 +545,51 @@ def do_event_detection(model, tokenizer, texts, schemas):
     return pred_triggers
 
 
-def do_event_argument_extraction(model, tokenizer, instances):
-    data_processor = EAEProcessor(tokenizer)
-    inputs = data_processor.tokenize(instances)
-    decoded_preds = generate(model, tokenizer, inputs)
+def generate_with_shared_encoder(model, tokenizer, features, trigger_rows, trigger_spans, device, max_tokens=None,
+                                 bf16=False, decoders=None, num_beams=4):
+    """Runs `generate` over length buckets of sentences, encoding each sentence once for all its triggers, and returns
+    the decoded predictions in trigger order. `decoders` optionally holds the constraint decoder of each sentence."""
+    decoded_preds = [None] * len(trigger_rows)
+    triggers_per_row = defaultdict(list)
+    for i, row in enumerate(trigger_rows):
+        triggers_per_row[row].append(i)
+    for bucket in get_length_buckets([len(feature["input_ids"]) for feature in features], max_tokens):
+        bucket = [row for row in bucket if row in triggers_per_row]
+        for decoder, rows in split_by_decoder(bucket, decoders):
+            inputs = collate_features([features[row] for row in rows], tokenizer.pad_token_id, device)
+            triggers = [i for row in rows for i in triggers_per_row[row]]
+            position = {row: j for j, row in enumerate(rows)}
+            positions = [position[trigger_rows[i]] for i in triggers]
+            src_input_ids = inputs["input_ids"][positions]
+            inputs = encode_with_trigger_markers(model, tokenizer, inputs, positions,
+                                                 [trigger_spans[i] for i in triggers], bf16=bf16)
+            preds = generate(model, tokenizer, inputs, bf16=bf16, constraint_decoder=decoder,
+                             src_input_ids=src_input_ids, num_beams=num_beams)
+            for i, pred in zip(triggers, preds):
+                decoded_preds[i] = pred
+    return decoded_preds
+
+
+def do_event_argument_extraction(model, tokenizer, instances, device=None, bf16=False, max_tokens=None,
+                                 share_encoder=False, features=None, constrained=False, num_beams=4):
+    data_processor = EAEProcessor(tokenizer, device=device if device is not None else model.device)
+    decoders = None
+    if constrained:
+        decoders = [get_schema_decoder(tokenizer, instance["schema"], "EAE") for instance in instances]
+    if share_encoder:
+        if features is None:
+            features = data_processor.encode_shared(instances)
+        features, trigger_rows, trigger_spans = features
+        decoded_preds = generate_with_shared_encoder(model, tokenizer, features, trigger_rows, trigger_spans,
+                                                     data_processor.device, max_tokens, bf16, decoders, num_beams)
+    else:
+        if features is None:
+            features = data_processor.encode(instances)
+        if decoders is not None:
+            # one feature per trigger
+            decoders = [decoder for instance, decoder in zip(instances, decoders) for _ in instance["triggers"]]
+        decoded_preds = generate_in_buckets(model, tokenizer, features, data_processor.device, max_tokens, bf16,
+                                            decoders, num_beams)
     def clean_str(x_str):
         for to_remove_token in [tokenizer.eos_token, tokenizer.pad_token]:
             x_str = x_str.replace(to_remove_token, '')
@@ -0,0 +1,234 @@
+import json
+import time
+import queue
+import logging
+import argparse
+import threading
+
+from collections import defaultdict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+def check_triggers(text, triggers):
+    """Raises a `ValueError` unless `triggers` is a list of `[mention, char start, char end]` spans of `text`."""
+    if not isinstance(triggers, list):
+        raise ValueError("triggers must be a list.")
+    for trigger in triggers:
+        if not isinstance(trigger, (list, tuple)) or len(trigger) != 3:
+            raise ValueError("Each trigger must be a [mention, start, end] list, got %r." % (trigger,))
+        mention, start, end = trigger
+        if not isinstance(mention, str) or any(not isinstance(x, int) or isinstance(x, bool) for x in (start, end)):
+            raise ValueError("Each trigger must be a [mention, start, end] list, got %r." % (trigger,))
+        if not 0 <= start <= end <= len(text):
+            raise ValueError("Trigger offsets %d-%d are out of the text." % (start, end))
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent inference requests into micro-batches run by a single worker thread.
+
+    The worker waits for a first request, then keeps collecting requests until `max_batch_size` is reached or
+    `max_wait` seconds have passed since the first one arrived. Requests of the batch are grouped by task, run
+    through `infer_micro_batch`, and each request's future is resolved with its own result. Payloads are validated
+    in `submit`; a batch that still fails is re-run request by request, so that only the failing request fails.
+
+    Args:
+        ed_pair (`Tuple`, *optional*): (model, tokenizer) used for ED and EE.
+        eae_pair (`Tuple`, *optional*): (model, tokenizer) used for EAE and EE.
+        max_batch_size (`int`): Maximum number of requests in a micro-batch.
+        max_wait (`float`): Maximum time in seconds the first request of a batch waits for others.
+        bf16 (`bool`): Whether to run generation under bf16 autocast.
+        max_tokens (`int`, *optional*): Token budget of a generation batch, see `infer_batch`.
+    """
+    def __init__(self, ed_pair=None, eae_pair=None, max_batch_size=32, max_wait=0.01, bf16=False, max_tokens=None):
+        assert max_batch_size > 0 and max_wait >= 0
+        self.ed_pair = ed_pair
+        self.eae_pair = eae_pair
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.bf16 = bf16
+        self.max_tokens = max_tokens
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="omnievent-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text, schema="ace", task="ED", triggers=None):
+        """Queues one text and returns a `Future` resolved with its result in the format of `infer`."""
+        from ..infer import SUPPORTED_SCHEMAS
+
+        if task not in ["ED", "EAE", "EE"]:
+            raise ValueError("Unknown task %s." % task)
+        if schema not in SUPPORTED_SCHEMAS:
+            raise ValueError("Unknown schema %s." % schema)
+        if task in ["ED", "EE"] and self.ed_pair is None or task in ["EAE", "EE"] and self.eae_pair is None:
+            raise ValueError("No model is loaded for task %s." % task)
+        if not isinstance(text, str):
+            raise ValueError("text must be a string.")
+        if task == "EAE" and triggers is None:
+            raise ValueError("EAE requires triggers.")
+        if triggers is not None:
+            check_triggers(text, triggers)
+        future = Future()
+        self._queue.put((future, text, f"<{schema}>", task, triggers))
+        return future
+
+    def close(self):
+        """Stops the worker after the queued requests are served."""
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect(self):
+        requests = [self._queue.get()]
+        if requests[0] is None:
+            return None
+        deadline = time.monotonic() + self.max_wait
+        while len(requests) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # serve what is collected, then stop
+                self._queue.put(None)
+                break
+            requests.append(request)
+        return requests
+
+    def _run(self):
+        from ..infer import infer_micro_batch
+
+        while True:
+            requests = self._collect()
+            if requests is None:
+                return
+            requests_per_task = defaultdict(list)
+            for request in requests:
+                requests_per_task[request[3]].append(request)
+            for task, task_requests in requests_per_task.items():
+                task_requests = [request for request in task_requests if request[0].set_running_or_notify_cancel()]
+                if len(task_requests) == 0:
+                    continue
+                self._infer(infer_micro_batch, task, task_requests)
+
+    def _infer(self, infer_micro_batch, task, requests):
+        """Resolves the futures of `requests`. If the batch fails, its requests are run one by one, so that a
+        request failing inference does not fail the others."""
+        try:
+            results = infer_micro_batch([request[1] for request in requests],
+                                        [request[2] for request in requests],
+                                        [request[4] for request in requests],
+                                        self.ed_pair,
+                                        self.eae_pair,
+                                        task,
+                                        bf16=self.bf16,
+                                        max_tokens=self.max_tokens)
+        except Exception as e:
+            if len(requests) > 1:
+                logger.warning("Inference failed for a batch of %d requests, retrying them one by one"
+                               % len(requests))
+                for request in requests:
+                    self._infer(infer_micro_batch, task, [request])
+                return
+            logger.exception("Inference failed for a request")
+            requests[0][0].set_exception(e)
+            return
+        for request, result in zip(requests, results):
+            request[0].set_result(result)
+
+
+def get_handler(batcher, timeout=None):
+    """Returns a request handler class serving `POST /infer` and `GET /health` with `batcher`."""
+
+    class InferHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path != "/health":
+                self._send_json(404, {"error": "Not found."})
+                return
+            self._send_json(200, {"status": "ok"})
+
+        def do_POST(self):
+            if self.path != "/infer":
+                self._send_json(404, {"error": "Not found."})
+                return
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                future = batcher.submit(request["text"],
+                                        schema=request.get("schema", "ace"),
+                                        task=request.get("task", "EE"),
+                                        triggers=request.get("triggers", None))
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            try:
+                result = future.result(timeout=timeout)
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, result)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return InferHandler
+
+
+def main():
+    from ..infer import MODEL_REGISTRY
+    from .seq2seq import get_device, set_cpu_threads
+
+    arg_parser = argparse.ArgumentParser(description="Serve OmniEvent inference over HTTP with micro-batching.")
+    arg_parser.add_argument("--host", type=str, default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--task", type=str, default="EE", choices=["ED", "EAE", "EE"],
+                            help="Tasks to load models for. EE serves all three tasks.")
+    arg_parser.add_argument("--ed_model", type=str, default="s2s-mt5-ed",
+                            help="Model identifier or checkpoint directory used for ED.")
+    arg_parser.add_argument("--eae_model", type=str, default="s2s-mt5-eae",
+                            help="Model identifier or checkpoint directory used for EAE.")
+    arg_parser.add_argument("--max_batch_size", type=int, default=32)
+    arg_parser.add_argument("--max_wait_ms", type=float, default=10,
+                            help="Maximum time a request waits for others to join its batch.")
+    arg_parser.add_argument("--max_tokens", type=int, default=None)
+    arg_parser.add_argument("--timeout", type=float, default=None, help="Per-request timeout in seconds.")
+    arg_parser.add_argument("--device", type=str, default=None)
+    arg_parser.add_argument("--num_threads", type=int, default=None)
+    arg_parser.add_argument("--bf16", action="store_true")
+    arg_parser.add_argument("--quantize", action="store_true")
+    args = arg_parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(name)s - %(message)s", level=logging.INFO)
+
+    pairs = dict()
+    for task, name in [("ED", args.ed_model), ("EAE", args.eae_model)]:
+        if args.task in [task, "EE"]:
+            pairs[task] = MODEL_REGISTRY.get(name, device=str(get_device(args.device)), quantize=args.quantize)
+    ed_pair, eae_pair = pairs.get("ED", None), pairs.get("EAE", None)
+    if get_device(args.device).type == "cpu":
+        set_cpu_threads(args.num_threads)
+    batcher = MicroBatcher(ed_pair, eae_pair, args.max_batch_size, args.max_wait_ms / 1000, args.bf16,
+                           args.max_tokens)
+    server = ThreadingHTTPServer((args.host, args.port), get_handler(batcher, args.timeout))
+    logger.info("Serving on http://%s:%d" % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+
+
+if __name__ == "__main__":
+    main()
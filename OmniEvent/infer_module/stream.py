@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import logging
+import contextlib
+import argparse
+
+logger = logging.getLogger(__name__)
+
+
+def read_lines(stream, offset=0):
+    """Yields `(line, end_offset)` for each line of a binary stream, starting at byte `offset`.
+
+    Seekable streams jump to `offset` directly, others (e.g. stdin) skip the first `offset` bytes.
+    """
+    if offset > 0:
+        if stream.seekable():
+            stream.seek(offset)
+        else:
+            remaining = offset
+            while remaining > 0:
+                chunk = stream.read(min(remaining, 1 << 20))
+                if not chunk:
+                    raise ValueError("The input ends before the resume offset %d." % offset)
+                remaining -= len(chunk)
+    for line in stream:
+        offset += len(line)
+        yield line, offset
+
+
+def parse_line(line, input_format, schema):
+    """Parses one input line into a document dict, or returns None for a line to skip. Raises a `ValueError` for a
+    malformed line or a document of an unsupported schema."""
+    from ..infer import SUPPORTED_SCHEMAS
+
+    line = line.decode("utf-8").rstrip("\r\n")
+    if line.strip() == "":
+        return None
+    if input_format == "text":
+        return {"text": line, "schema": schema, "triggers": []}
+    item = json.loads(line)
+    if "text" not in item:
+        raise ValueError("Missing field `text`.")
+    if not isinstance(item["text"], str):
+        raise ValueError("Field `text` is not a string.")
+    if item.get("schema", schema) not in SUPPORTED_SCHEMAS:
+        raise ValueError("Unsupported schema %s." % item["schema"])
+    return {
+        "id": item.get("id", None),
+        "text": item["text"],
+        "schema": item.get("schema", schema),
+        "triggers": [tuple(trigger) for trigger in item.get("triggers", [])]
+    }
+
+
+def read_batches(lines, input_format, schema, batch_size):
+    """Groups parsed documents into batches and yields `(docs, end_offset)`, where `end_offset` is the byte offset
+    right after the last line consumed by the batch."""
+    docs, end_offset = [], None
+    for line, end_offset in lines:
+        try:
+            doc = parse_line(line, input_format, schema)
+        except ValueError as e:
+            logger.warning("Skipping the malformed line ending at byte %d: %s" % (end_offset, e))
+            continue
+        if doc is None:
+            continue
+        docs.append(doc)
+        if len(docs) == batch_size:
+            yield docs, end_offset
+            docs = []
+    if docs or end_offset is not None:
+        yield docs, end_offset
+
+
+def to_result(doc, result):
+    """Converts a predicted result into the `Result`/`Event` shape of `io_format.py`, keeping the input id if any."""
+    output = {"id": doc["id"]} if doc.get("id", None) is not None else {}
+    output["text"] = result["text"]
+    output["events"] = [{
+        "trigger": event["trigger"],
+        "type": event["type"],
+        "offset": event["offset"],
+        "arguments": event.get("arguments", [])
+    } for event in result["events"]]
+    return output
+
+
+def load_checkpoint(checkpoint_file):
+    """Returns the saved `(input_offset, output_offset)`, or zeros if there is no checkpoint."""
+    if checkpoint_file is None or not os.path.exists(checkpoint_file):
+        return 0, 0
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    return checkpoint["input_offset"], checkpoint["output_offset"]
+
+
+def save_checkpoint(checkpoint_file, input_offset, output_offset):
+    """Atomically records how far the input has been consumed and how much output has been written for it."""
+    tmp_file = checkpoint_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"input_offset": input_offset, "output_offset": output_offset}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, checkpoint_file)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Stream JSONL or plain-text documents through OmniEvent "
+                                                     "inference and write one JSON result per line.")
+    arg_parser.add_argument("input", nargs="?", default="-",
+                            help="Input file, or `-` for stdin. JSONL lines hold `text` and optionally `id`, "
+                                 "`schema` and `triggers`; plain-text lines are one document each.")
+    arg_parser.add_argument("-o", "--output", type=str, default="-", help="Output jsonl file, or `-` for stdout.")
+    arg_parser.add_argument("--format", type=str, default="jsonl", choices=["jsonl", "text"])
+    arg_parser.add_argument("--task", type=str, default="EE", choices=["ED", "EAE", "EE"])
+    arg_parser.add_argument("--schema", type=str, default="ace", help="Schema of documents that do not set one.")
+    arg_parser.add_argument("--ed_model", type=str, default="s2s-mt5-ed",
+                            help="Model identifier or checkpoint directory used for ED.")
+    arg_parser.add_argument("--eae_model", type=str, default="s2s-mt5-eae",
+                            help="Model identifier or checkpoint directory used for EAE.")
+    arg_parser.add_argument("--batch_size", type=int, default=64)
+    arg_parser.add_argument("--max_tokens", type=int, default=None)
+    arg_parser.add_argument("--device", type=str, default=None)
+    arg_parser.add_argument("--num_threads", type=int, default=None)
+    arg_parser.add_argument("--bf16", action="store_true")
+    arg_parser.add_argument("--quantize", action="store_true")
+    arg_parser.add_argument("--share_encoder", action="store_true")
+    arg_parser.add_argument("--offset", type=int, default=None,
+                            help="Byte offset of the input to start from. Defaults to the checkpoint, if any.")
+    arg_parser.add_argument("--checkpoint", type=str, default=None,
+                            help="File recording the progress after each batch, used to resume after a crash. "
+                                 "Defaults to `<output>.offset` when writing to a file.")
+    arg_parser.add_argument("--log_every", type=int, default=10, help="Report throughput every N batches.")
+    args = arg_parser.parse_args()
+    logging.basicConfig(format="%(asctime)s - %(levelname)s - %(name)s - %(message)s", level=logging.INFO)
+
+    from ..infer import MODEL_REGISTRY, SUPPORTED_SCHEMAS, infer_batch
+    from .seq2seq import get_device
+
+    if args.schema not in SUPPORTED_SCHEMAS:
+        arg_parser.error("Unsupported schema %s, selected in %s." % (args.schema, SUPPORTED_SCHEMAS))
+
+    to_file = args.output != "-"
+    checkpoint_file = args.checkpoint
+    if checkpoint_file is None and to_file:
+        checkpoint_file = args.output + ".offset"
+    input_offset, output_offset = load_checkpoint(checkpoint_file)
+    if args.offset is not None:
+        input_offset = args.offset
+    if to_file:
+        output = open(args.output, "ab")
+        if os.path.exists(checkpoint_file):
+            # drop results written after the last checkpoint, they are recomputed
+            output.truncate(output_offset)
+    else:
+        output = sys.stdout.buffer
+    stream = open(args.input, "rb") if args.input != "-" else sys.stdin.buffer
+    if input_offset > 0:
+        logger.info("Resuming from byte %d of the input" % input_offset)
+
+    pairs = []
+    # keep stdout clean for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        for task, name in [("ED", args.ed_model), ("EAE", args.eae_model)]:
+            if args.task in [task, "EE"]:
+                pairs.append(MODEL_REGISTRY.get(name, device=str(get_device(args.device)), quantize=args.quantize))
+    model, tokenizer = pairs[0] if len(pairs) == 1 else tuple(zip(*pairs))
+
+    num_docs, num_batches, start_time = 0, 0, time.perf_counter()
+    for docs, end_offset in read_batches(read_lines(stream, input_offset), args.format, args.schema,
+                                         args.batch_size):
+        if docs:
+            results = infer_batch([doc["text"] for doc in docs],
+                                  schemas=[doc["schema"] for doc in docs],
+                                  task=args.task,
+                                  batch_size=args.batch_size,
+                                  model=model,
+                                  tokenizer=tokenizer,
+                                  triggers=[doc["triggers"] for doc in docs] if args.task == "EAE" else None,
+                                  device=args.device,
+                                  num_threads=args.num_threads,
+                                  bf16=args.bf16,
+                                  max_tokens=args.max_tokens,
+                                  share_encoder=args.share_encoder)
+            output.write("".join(json.dumps(to_result(doc, result), ensure_ascii=False) + "\n"
+                                 for doc, result in zip(docs, results)).encode("utf-8"))
+        output.flush()
+        if checkpoint_file is not None:
+            if to_file:
+                os.fsync(output.fileno())
+            save_checkpoint(checkpoint_file, end_offset, output.tell() if to_file else 0)
+        num_docs += len(docs)
+        num_batches += 1
+        if num_batches % args.log_every == 0:
+            elapsed = time.perf_counter() - start_time
+            logger.info("%d docs, %.1f docs/s, input offset %d" % (num_docs, num_docs / elapsed, end_offset))
+    elapsed = time.perf_counter() - start_time
+    logger.info("Done: %d docs in %.1fs, %.1f docs/s" % (num_docs, elapsed, num_docs / max(elapsed, 1e-6)))
+    if to_file:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,15 @@ import os
 import json
 import torch
 import logging
+import numpy as np
 
 from torch.utils.data import Dataset
 from typing import Dict, List, Optional, Union
 
+from .feature_cache import get_cache_path
+from .feature_store import pad_and_stack
+from .sharding import Shard, read_and_convert
+
 logger = logging.getLogger(__name__)
 
 
@@ -222,9 +227,19 @@ class EDDataProcessor(Dataset):
             The tokenizer method proposed for the tokenization process.
         examples (`List[EDInputExample]`):
             A list of `EDInputExample`s constructed based on the input dataset.
-        input_features (`List[EDInputFeatures]`):
-            A list of `EDInputFeatures`s corresponding to the `EDInputExample`s.
+        input_features (`Sequence[EDInputFeatures]`):
+            The `EDInputFeatures`s corresponding to the `EDInputExample`s, in a `FeatureStore` once converted.
+        shard (`Shard`):
+            The range of lines of the input file `read_examples()` reads, the whole file by default.
+        progress_bar (`bool`):
+            A boolean variable indicating whether to show the progress of reading and converting the examples.
     """
+    feature_class = EDInputFeatures
+    # the fields of the features fed to the model, and their type if not `torch.long`
+    input_names = ["input_ids", "attention_mask", "token_type_ids", "trigger_left", "trigger_right", "labels"]
+    input_dtypes = {"attention_mask": torch.float32, "trigger_left": torch.float32, "trigger_right": torch.float32}
+    # the fields holding a value per input token, whose trailing padding the `FeatureStore` drops
+    token_names = ["input_ids", "attention_mask", "token_type_ids", "labels"]
 
     def __init__(self,
                  config,
@@ -235,6 +250,9 @@ class EDDataProcessor(Dataset):
         self.examples = []
         self.input_features = []
         self.is_overflow = []
+        # the lines of the input file `read_examples` reads
+        self.shard = Shard()
+        self.progress_bar = True
 
     def read_examples(self,
                       input_file: str):
@@ -245,6 +263,16 @@ class EDDataProcessor(Dataset):
         """Converts the `EDInputExample`s into `EDInputFeatures`s."""
         raise NotImplementedError
 
+    def read_and_convert(self,
+                         input_file: str) -> None:
+        """Reads the `EDInputExample`s of `input_file` and converts them into `EDInputFeatures`s.
+
+        The features are cached in `config.feature_cache_dir` if it is set, keyed by the content of `input_file`, the
+        tokenizer and the configurations the features depend on. If `config.preprocessing_num_workers` is larger than
+        1, the file is read and converted in shards by a pool of processes, see `sharding.read_and_convert`.
+        """
+        read_and_convert(self, input_file, get_cache_path(self, input_file))
+
     def _truncate(self,
                   outputs: dict,
                   max_seq_length: int):
@@ -270,41 +298,66 @@ class EDDataProcessor(Dataset):
         """Returns the length of the examples."""
         return len(self.input_features)
 
+    def get_pad_values(self) -> Dict[str, int]:
+        """Returns the value the sequences of each field of the features are padded with."""
+        return {"input_ids": self.tokenizer.pad_token_id,
+                "attention_mask": 0,
+                "token_type_ids": self.tokenizer.pad_token_type_id,
+                "labels": -100}
+
     def __getitem__(self,
                     index: int) -> Dict[str, torch.Tensor]:
-        """Obtains the features of a given example index and converts them into a dictionary."""
-        features = self.input_features[index]
-        data_dict = dict(
-            input_ids=torch.tensor(features.input_ids, dtype=torch.long),
-            attention_mask=torch.tensor(features.attention_mask, dtype=torch.float32)
-        )
-        if features.token_type_ids is not None and self.config.return_token_type_ids:
-            data_dict["token_type_ids"] = torch.tensor(features.token_type_ids, dtype=torch.long)
-        if features.trigger_left is not None:
-            data_dict["trigger_left"] = torch.tensor(features.trigger_left, dtype=torch.float32)
-        if features.trigger_right is not None:
-            data_dict["trigger_right"] = torch.tensor(features.trigger_right, dtype=torch.float32)
-        if features.labels is not None:
-            data_dict["labels"] = torch.tensor(features.labels, dtype=torch.long)
-        return data_dict
-
-    def collate_fn(self, batch) -> Dict[str, torch.Tensor]:
-        """Collates the samples in batches."""
+        """Obtains the features of a given example index in a dictionary of tensors.
+
+        The tensors are views of the `FeatureStore`, without padding, which `collate_fn()` pads in batches.
+        """
+        names = [name for name in self.input_names
+                 if name != "token_type_ids" or self.config.return_token_type_ids]
+        return self.input_features.get_tensors(index, names)
+
+    def get_widths(self) -> Dict[str, int]:
+        """Returns the length the sequences of each field of the features are padded to without `truncate_in_batch`."""
+        return {"input_ids": self.config.max_seq_length,
+                "attention_mask": self.config.max_seq_length,
+                "token_type_ids": self.config.max_seq_length,
+                "labels": self.config.max_seq_length}
+
+    def get_lengths(self) -> np.ndarray:
+        """Returns the number of input tokens of each feature, e.g. to batch the features of similar lengths."""
+        return self.input_features.get_lengths("input_ids")
+
+    def collate_fn(self, batch, training: bool = False) -> Dict[str, torch.Tensor]:
+        """Collates the samples in batches, padding the sequences.
+
+        In training batches, the fields of `token_names` are padded to the longest inputs of the batch, and the other
+        sequences, e.g. the seq2seq labels, to their own longest. Otherwise, the sequences are padded to the lengths of
+        `get_widths()`, so that the predictions of different runs can be concatenated. With `config.truncate_in_batch`,
+        the inputs are padded to the longest of the batch instead, and so are the labels with
+        `config.truncate_seq2seq_output`, the other sequence labels being cut to the length of the inputs.
+        """
+        if training:
+            input_length = max(len(x["attention_mask"]) for x in batch)
+            widths = {key: input_length for key in self.token_names}
+        else:
+            widths = self.get_widths()
+        if self.config.truncate_in_batch and not training:
+            input_length = max(len(x["attention_mask"]) for x in batch)
+            for key in ["input_ids", "attention_mask", "token_type_ids"]:
+                widths[key] = input_length
+            if self.config.truncate_seq2seq_output:
+                del widths["labels"]
+            else:
+                widths["labels"] = min(widths["labels"], input_length)
+        pad_values = self.get_pad_values()
         output_batch = dict()
         for key in batch[0].keys():
-            output_batch[key] = torch.stack([x[key] for x in batch], dim=0)
-        if self.config.truncate_in_batch:
-            input_length = int(output_batch["attention_mask"].sum(-1).max())
-            for key in ["input_ids", "attention_mask", "token_type_ids"]:
-                if key not in output_batch:
-                    continue
-                output_batch[key] = output_batch[key][:, :input_length]
-            if "labels" in output_batch and len(output_batch["labels"].shape) == 2:
-                if self.config.truncate_seq2seq_output:
-                    output_length = int((output_batch["labels"] != -100).sum(-1).max())
-                    output_batch["labels"] = output_batch["labels"][:, :output_length]
-                else:
-                    output_batch["labels"] = output_batch["labels"][:, :input_length]
+            pad_value = pad_values.get(key, None)
+            output_batch[key] = pad_and_stack([x[key] for x in batch],
+                                              pad_value if pad_value is not None else 0,
+                                              self.input_dtypes.get(key, torch.long),
+                                              widths.get(key, None))
+            if key in widths and output_batch[key].dim() == 2:
+                output_batch[key] = output_batch[key][:, :widths[key]]
         return output_batch
 
 
@@ -323,13 +376,24 @@ class EAEDataProcessor(Dataset):
             A boolean variable indicating the state is training or not.
         examples (`List[EDInputExample]`):
             A list of `EDInputExample`s constructed based on the input dataset.
-        input_features (`List[EAEInputFeatures]`):
-            A list of `EAEInputFeatures`s corresponding to the `EAEInputExample`s.
+        input_features (`Sequence[EAEInputFeatures]`):
+            The `EAEInputFeatures`s corresponding to the `EAEInputExample`s, in a `FeatureStore` once converted.
+        shard (`Shard`):
+            The range of lines of the input file `read_examples()` reads, the whole file by default.
+        progress_bar (`bool`):
+            A boolean variable indicating whether to show the progress of reading and converting the examples.
         data_for_evaluation (`dict`):
             A dictionary representing the evaluation data.
         event_preds (`list`):
             A list of event prediction data if the file exists.
     """
+    feature_class = EAEInputFeatures
+    # the fields of the features fed to the model, and their type if not `torch.long`
+    input_names = ["input_ids", "attention_mask", "token_type_ids", "trigger_left", "trigger_right", "argument_left",
+                   "argument_right", "start_positions", "end_positions", "labels"]
+    input_dtypes = {"attention_mask": torch.float32}
+    # the fields holding a value per input token, whose trailing padding the `FeatureStore` drops
+    token_names = ["input_ids", "attention_mask", "token_type_ids", "labels"]
 
     def __init__(self,
                  config,
@@ -345,6 +409,9 @@ class EAEDataProcessor(Dataset):
         self.examples = []
         self.input_features = []
         self.is_overflow = []
+        # the lines of the input file `read_examples` reads
+        self.shard = Shard()
+        self.progress_bar = True
         # data for trainer evaluation 
         self.data_for_evaluation = {}
         # event prediction file path 
@@ -367,6 +434,23 @@ class EAEDataProcessor(Dataset):
         """Converts the `EAEInputExample`s into `EAEInputFeatures`s."""
         raise NotImplementedError
 
+    def read_and_convert(self,
+                         input_file: str) -> None:
+        """Reads the `EAEInputExample`s of `input_file` and converts them into `EAEInputFeatures`s.
+
+        The features are cached in `config.feature_cache_dir` if it is set, keyed by the content of `input_file`, the
+        tokenizer, the event predictions and the configurations the features depend on. If
+        `config.preprocessing_num_workers` is larger than 1, the file is read and converted in shards by a pool of
+        processes, see `sharding.read_and_convert`.
+        """
+        if input_file is None:
+            return
+        # the event types of the examples depend on the predictions and the split, see `get_single_pred`
+        extra = {"is_training": self.is_training,
+                 "train_file": "train" in input_file,
+                 "event_preds": self.event_preds}
+        read_and_convert(self, input_file, get_cache_path(self, input_file, extra))
+
     def get_data_for_evaluation(self) -> Dict[str, Union[int, List[str]]]:
         """Obtains the data for evaluation."""
         self.data_for_evaluation["pred_types"] = self.get_pred_types()
@@ -429,47 +513,64 @@ class EAEDataProcessor(Dataset):
         """Returns the length of the examples."""
         return len(self.input_features)
 
+    def get_pad_values(self) -> Dict[str, int]:
+        """Returns the value the sequences of each field of the features are padded with."""
+        return {"input_ids": self.tokenizer.pad_token_id,
+                "attention_mask": 0,
+                "token_type_ids": self.tokenizer.pad_token_type_id,
+                "labels": -100}
+
     def __getitem__(self,
                     index: int) -> Dict[str, torch.Tensor]:
-        """Returns the features of a given example index in a dictionary."""
-        features = self.input_features[index]
-        data_dict = dict(
-            input_ids=torch.tensor(features.input_ids, dtype=torch.long),
-            attention_mask=torch.tensor(features.attention_mask, dtype=torch.float32)
-        )
-        if features.token_type_ids is not None and self.config.return_token_type_ids:
-            data_dict["token_type_ids"] = torch.tensor(features.token_type_ids, dtype=torch.long)
-        if features.trigger_left is not None:
-            data_dict["trigger_left"] = torch.tensor(features.trigger_left, dtype=torch.long)
-        if features.trigger_right is not None:
-            data_dict["trigger_right"] = torch.tensor(features.trigger_right, dtype=torch.long)
-        if features.argument_left is not None:
-            data_dict["argument_left"] = torch.tensor(features.argument_left, dtype=torch.long)
-        if features.argument_right is not None:
-            data_dict["argument_right"] = torch.tensor(features.argument_right, dtype=torch.long)
-        if features.start_positions is not None:
-            data_dict["start_positions"] = torch.tensor(features.start_positions, dtype=torch.long)
-        if features.end_positions is not None:
-            data_dict["end_positions"] = torch.tensor(features.end_positions, dtype=torch.long)
-        if features.labels is not None:
-            data_dict["labels"] = torch.tensor(features.labels, dtype=torch.long)
-        return data_dict
-
-    def collate_fn(self, batch) -> Dict[str, torch.Tensor]:
-        """Collates the samples in batches."""
+        """Obtains the features of a given example index in a dictionary of tensors.
+
+        The tensors are views of the `FeatureStore`, without padding, which `collate_fn()` pads in batches.
+        """
+        names = [name for name in self.input_names
+                 if name != "token_type_ids" or self.config.return_token_type_ids]
+        return self.input_features.get_tensors(index, names)
+
+    def get_widths(self) -> Dict[str, int]:
+        """Returns the length the sequences of each field of the features are padded to without `truncate_in_batch`."""
+        return {"input_ids": self.config.max_seq_length,
+                "attention_mask": self.config.max_seq_length,
+                "token_type_ids": self.config.max_seq_length,
+                "labels": self.config.max_seq_length}
+
+    def get_lengths(self) -> np.ndarray:
+        """Returns the number of input tokens of each feature, e.g. to batch the features of similar lengths."""
+        return self.input_features.get_lengths("input_ids")
+
+    def collate_fn(self, batch, training: bool = False) -> Dict[str, torch.Tensor]:
+        """Collates the samples in batches, padding the sequences.
+
+        In training batches, the fields of `token_names` are padded to the longest inputs of the batch, and the other
+        sequences, e.g. the seq2seq labels, to their own longest. Otherwise, the sequences are padded to the lengths of
+        `get_widths()`, so that the predictions of different runs can be concatenated. With `config.truncate_in_batch`,
+        the inputs are padded to the longest of the batch instead, and so are the labels with
+        `config.truncate_seq2seq_output`, the other sequence labels being cut to the length of the inputs.
+        """
+        if training:
+            input_length = max(len(x["attention_mask"]) for x in batch)
+            widths = {key: input_length for key in self.token_names}
+        else:
+            widths = self.get_widths()
+        if self.config.truncate_in_batch and not training:
+            input_length = max(len(x["attention_mask"]) for x in batch)
+            for key in ["input_ids", "attention_mask", "token_type_ids"]:
+                widths[key] = input_length
+            if self.config.truncate_seq2seq_output:
+                del widths["labels"]
+            else:
+                widths["labels"] = min(widths["labels"], input_length)
+        pad_values = self.get_pad_values()
         output_batch = dict()
         for key in batch[0].keys():
-            output_batch[key] = torch.stack([x[key] for x in batch], dim=0)
-        if self.config.truncate_in_batch:
-            input_length = int(output_batch["attention_mask"].sum(-1).max())
-            for key in ["input_ids", "attention_mask", "token_type_ids"]:
-                if key not in output_batch:
-                    continue
-                output_batch[key] = output_batch[key][:, :input_length]
-            if "labels" in output_batch and len(output_batch["labels"].shape) == 2:
-                if self.config.truncate_seq2seq_output:
-                    output_length = int((output_batch["labels"] != -100).sum(-1).max())
-                    output_batch["labels"] = output_batch["labels"][:, :output_length]
-                else:
-                    output_batch["labels"] = output_batch["labels"][:, :input_length]
+            pad_value = pad_values.get(key, None)
+            output_batch[key] = pad_and_stack([x[key] for x in batch],
+                                              pad_value if pad_value is not None else 0,
+                                              self.input_dtypes.get(key, torch.long),
+                                              widths.get(key, None))
+            if key in widths and output_batch[key].dim() == 2:
+                output_batch[key] = output_batch[key][:, :widths[key]]
         return output_batch
@@ -0,0 +1,198 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+import numpy as np
+
+from typing import Any, Dict, Optional
+
+from .feature_store import FeatureStore, ShardedFeatures, compact_features
+from ..utils import hash_file, hash_json
+
+logger = logging.getLogger(__name__)
+
+# bump when the layout of the cached files or the features computed by the processors change
+CACHE_VERSION = 4
+
+# fields of the config the features depend on
+CACHE_CONFIG_FIELDS = ["max_seq_length", "max_out_length", "language", "golden_trigger", "eae_eval_mode",
+                       "mrc_template_id", "markers", "type2id", "role2id", "dataset_name"]
+CACHE_CONFIG_FILES = ["template_file", "prompt_file"]
+
+
+def get_tokenizer_fingerprint(tokenizer) -> str:
+    """Returns a fingerprint of everything of the tokenizer that changes the tokenized features.
+
+    The vocabulary, including the added tokens, is hashed rather than the tokenizer name, so that a tokenizer with
+    extra markers or a local copy of a hub tokenizer get their own cache entries.
+    """
+    return hash_json({
+        "class": type(tokenizer).__name__,
+        "vocab": sorted(tokenizer.get_vocab().items()),
+        "special_tokens": tokenizer.special_tokens_map,
+        "model_max_length": tokenizer.model_max_length,
+        "padding_side": tokenizer.padding_side,
+        "truncation_side": getattr(tokenizer, "truncation_side", "right"),
+    })
+
+
+def get_cache_key(processor,
+                  input_file: str,
+                  extra: Optional[Dict[str, Any]] = None) -> str:
+    """Returns the content-addressed key of the features of `processor` for `input_file`.
+
+    Args:
+        processor:
+            The data processor whose examples have been read.
+        input_file (`str`):
+            The file the examples are read from.
+        extra (`Dict[str, Any]`, `optional`, defaults to `None`):
+            Any other json-serializable state the features depend on, e.g. the event predictions of EAE.
+    """
+    config = processor.config
+    state = {
+        "version": CACHE_VERSION,
+        "processor": type(processor).__name__,
+        "input_file": hash_file(input_file),
+        "tokenizer": get_tokenizer_fingerprint(processor.tokenizer),
+        "config": {name: getattr(config, name, None) for name in CACHE_CONFIG_FIELDS},
+        "extra": extra,
+    }
+    for name in CACHE_CONFIG_FILES:
+        path = getattr(config, name, None)
+        state["config"][name] = hash_file(path) if path is not None and os.path.isfile(path) else None
+    return hash_json(state)
+
+
+def get_cache_path(processor,
+                   input_file: str,
+                   extra: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """Returns the path of the cache entry of `input_file`, or `None` if `config.feature_cache_dir` is not set."""
+    cache_dir = getattr(processor.config, "feature_cache_dir", None)
+    if cache_dir is None or input_file is None:
+        return None
+    return os.path.join(cache_dir, get_cache_key(processor, input_file, extra))
+
+
+def create_entry(cache_path: str) -> str:
+    """Creates and returns a temporary directory to write the entry of `cache_path` to, see `commit_entry`."""
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    return tempfile.mkdtemp(dir=cache_dir, prefix=".tmp-")
+
+
+def commit_entry(tmp_path: str,
+                 cache_path: str,
+                 meta: Dict[str, Any]) -> None:
+    """Writes `meta` and renames the temporary directory to `cache_path`.
+
+    A cache entry is thus either complete or missing, even if several processes convert the same file.
+    """
+    try:
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        try:
+            os.rename(tmp_path, cache_path)
+        except OSError:
+            # another process has written the same entry
+            if not os.path.isdir(cache_path):
+                raise
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+
+
+def save_features(cache_path: str,
+                  input_features: FeatureStore,
+                  state: Dict[str, Any]) -> None:
+    """Saves the `FeatureStore` and the json-serializable `state` of a processor under `cache_path`."""
+    tmp_path = create_entry(cache_path)
+    try:
+        meta = {"length": len(input_features), "columns": dict(), "json": dict(), "state": state}
+        for name, (kind, data) in input_features.columns.items():
+            meta["columns"][name] = kind
+            if kind == "json":
+                meta["json"][name] = data
+            elif kind == "ragged":
+                np.save(os.path.join(tmp_path, f"{name}.npy"), data[0])
+                np.save(os.path.join(tmp_path, f"{name}.offsets.npy"), data[1])
+            elif kind != "none":
+                np.save(os.path.join(tmp_path, f"{name}.npy"), data)
+    except BaseException:
+        shutil.rmtree(tmp_path)
+        raise
+    commit_entry(tmp_path, cache_path, meta)
+
+
+def load_features(cache_path: str,
+                  feature_class):
+    """Loads the features and the state saved by `save_features`, memory-mapping the arrays copy-on-write.
+
+    An entry written in shards, see `sharding.py`, lists the entries of its shards instead of columns.
+
+    Returns (`Sequence`, `Dict[str, Any]`).
+    """
+    with open(os.path.join(cache_path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    if "shards" in meta:
+        shards = [load_features(os.path.join(cache_path, name), feature_class)[0] for name in meta["shards"]]
+        return ShardedFeatures(shards), meta["state"]
+    columns = dict()
+    for name, kind in meta["columns"].items():
+        if kind == "json":
+            data = meta["json"][name]
+        elif kind == "ragged":
+            data = (np.load(os.path.join(cache_path, f"{name}.npy"), mmap_mode="c"),
+                    np.load(os.path.join(cache_path, f"{name}.offsets.npy"), mmap_mode="c"))
+        elif kind == "none":
+            data = None
+        else:
+            data = np.load(os.path.join(cache_path, f"{name}.npy"), mmap_mode="c")
+        columns[name] = (kind, data)
+    return FeatureStore(feature_class, columns, meta["length"]), meta["state"]
+
+
+def load_cached_features(processor,
+                         cache_path: str) -> None:
+    """Fills `processor.input_features`, `is_overflow` and the evaluation data added by the conversion from the
+    cache entry `cache_path`."""
+    processor.input_features, state = load_features(cache_path, processor.feature_class)
+    processor.is_overflow = state["is_overflow"]
+    if getattr(processor, "data_for_evaluation", None) is not None:
+        processor.data_for_evaluation.update(state["data_for_evaluation"])
+    logger.info("Loaded %d features from %s" % (len(processor.input_features), cache_path))
+
+
+def convert_examples(processor) -> Dict[str, Any]:
+    """Runs `convert_examples_to_features()` and returns the state to cache with the features, i.e. `is_overflow`
+    and the evaluation data added by the conversion."""
+    data_for_evaluation = getattr(processor, "data_for_evaluation", None) or dict()
+    before = dict(data_for_evaluation)
+    processor.convert_examples_to_features()
+    return {
+        "is_overflow": list(processor.is_overflow),
+        "data_for_evaluation": {key: value for key, value in data_for_evaluation.items()
+                                if before.get(key, None) is not value},
+    }
+
+
+def load_or_convert_features(processor,
+                             cache_path: Optional[str] = None) -> None:
+    """Fills `processor.input_features`, from the cache entry `cache_path` if it exists.
+
+    The examples must have been read. Without a cache entry, this is `convert_examples_to_features()` followed by
+    `compact_features()`. Otherwise the features, `is_overflow` and the evaluation data added by the conversion are
+    saved on a miss, and loaded on a hit instead of tokenizing the examples again.
+    """
+    if cache_path is None:
+        processor.convert_examples_to_features()
+        compact_features(processor)
+        return
+    if os.path.isdir(cache_path):
+        load_cached_features(processor, cache_path)
+        return
+    state = convert_examples(processor)
+    compact_features(processor)
+    save_features(cache_path, processor.input_features, state)
+    logger.info("Saved %d features to %s" % (len(processor.input_features), cache_path))
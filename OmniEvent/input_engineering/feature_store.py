@@ -0,0 +1,262 @@
+import bisect
+import torch
+import numpy as np
+
+from collections.abc import Sequence
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def compact_dtype(array: np.ndarray) -> np.ndarray:
+    """Returns `array` in the smallest signed integer type holding its values."""
+    if array.size == 0:
+        return array.astype(np.int8)
+    low, high = int(array.min()), int(array.max())
+    for dtype in (np.int8, np.int16, np.int32):
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return array.astype(dtype)
+    return array.astype(np.int64)
+
+
+def _trim_rows(values: List[Any],
+               pad_value: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Flattens integer lists without their trailing `pad_value`s.
+
+    Returns (`values`, `offsets`): the `i`-th row is `values[offsets[i]:offsets[i + 1]]`.
+    """
+    lengths = [len(value) for value in values]
+    if len(set(lengths)) == 1 and lengths[0] > 0:
+        matrix = np.asarray(values)
+        if pad_value is None:
+            lengths = np.full(len(values), matrix.shape[1])
+        else:
+            # the position after the last non-padding value of each row
+            is_value = matrix != pad_value
+            lengths = np.where(is_value.any(1), matrix.shape[1] - np.argmax(is_value[:, ::-1], axis=1), 0)
+        flat = matrix[np.arange(matrix.shape[1])[None, :] < lengths[:, None]]
+    else:
+        rows = []
+        for value in values:
+            value = np.asarray(value) if len(value) != 0 else np.zeros(0, dtype=np.int64)
+            if pad_value is not None:
+                is_value = np.flatnonzero(value != pad_value)
+                value = value[:is_value[-1] + 1] if len(is_value) != 0 else value[:0]
+            rows.append(value)
+        lengths = [len(row) for row in rows]
+        flat = np.concatenate(rows) if len(rows) != 0 else np.zeros(0)
+    return flat, np.cumsum([0] + list(lengths), dtype=np.int64)
+
+
+def _to_column(values: List[Any],
+               pad_value: Optional[int] = None) -> Tuple[str, Any]:
+    """Converts the values of a feature field into a column.
+
+    Returns (`kind`, `data`): integers are stored as a 1-D array, and integer lists as their flattened values without
+    the trailing `pad_value`s and their offsets. Anything else is kept as json.
+    """
+    if all(value is None for value in values):
+        return "none", None
+    if all(isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in values):
+        return "scalar", compact_dtype(np.asarray(values, dtype=np.int64))
+    if all(isinstance(value, (list, tuple, np.ndarray)) for value in values):
+        try:
+            flat, offsets = _trim_rows(values, pad_value)
+        except (TypeError, ValueError):
+            return "json", values
+        if flat.size > 0 and not np.issubdtype(flat.dtype, np.integer):
+            return "json", values
+        return "ragged", (compact_dtype(flat), offsets)
+    return "json", values
+
+
+class FeatureStore(Sequence):
+    """The features of a processor stored by columns of contiguous arrays.
+
+    The integer fields of the features are stored in the smallest integer type holding them, and the integer lists
+    without padding, as flattened values and the offsets of the rows. The rows are thus views of the arrays, and
+    `collate_fn()` of the processors pads them in batches. The arrays can also be memory-mapped from the feature cache,
+    see `feature_cache.py`.
+
+    Attributes:
+        feature_class:
+            The class of the features, e.g. `EDInputFeatures`.
+        columns (`Dict[str, Tuple[str, Any]]`):
+            The kind and data of each field of the features.
+        length (`int`):
+            The number of features.
+    """
+
+    def __init__(self,
+                 feature_class,
+                 columns: Dict[str, Tuple[str, Any]],
+                 length: int) -> None:
+        """Constructs a `FeatureStore`."""
+        self.feature_class = feature_class
+        self.columns = columns
+        self.length = length
+        self._tensors = dict()
+
+    @classmethod
+    def from_features(cls,
+                      feature_class,
+                      input_features: List[Any],
+                      pad_values: Optional[Dict[str, int]] = None) -> "FeatureStore":
+        """Builds a `FeatureStore` from a list of feature objects.
+
+        Args:
+            feature_class:
+                The class of the features.
+            input_features (`List`):
+                The feature objects, e.g. `EDInputFeatures`s.
+            pad_values (`Dict[str, int]`, `optional`, defaults to `None`):
+                The padding value of the integer lists of each field, stripped from the end of the lists.
+        """
+        pad_values = pad_values if pad_values is not None else dict()
+        columns = dict()
+        names = list(vars(input_features[0])) if len(input_features) != 0 else []
+        for name in names:
+            columns[name] = _to_column([getattr(features, name) for features in input_features],
+                                       pad_values.get(name, None))
+        return cls(feature_class, columns, len(input_features))
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(vars(self))
+        state["_tensors"] = dict()
+        return state
+
+    def _check_index(self, index: int) -> int:
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("Feature index out of range.")
+        return index
+
+    def get_field(self, name: str, index: int):
+        """Returns the value of field `name` of the `index`-th feature."""
+        kind, data = self.columns[name]
+        if kind == "none":
+            return None
+        if kind == "scalar":
+            return int(data[index])
+        if kind == "ragged":
+            values, offsets = data
+            return values[offsets[index]:offsets[index + 1]]
+        return data[index]
+
+    def get_lengths(self, name: str) -> np.ndarray:
+        """Returns the length of the integer lists of field `name` of the features."""
+        kind, data = self.columns[name]
+        if kind != "ragged":
+            raise ValueError("Field %s of the features is not a list of integers." % name)
+        return np.diff(data[1])
+
+    def get_tensor(self, name: str, index: int) -> Optional[torch.Tensor]:
+        """Returns the value of field `name` of the `index`-th feature as a tensor, sharing the memory of the column
+        for integers and integer lists."""
+        kind, data = self.columns[name]
+        if kind == "json":
+            return torch.tensor(data[index]) if data[index] is not None else None
+        if kind == "none":
+            return None
+        if name not in self._tensors:
+            self._tensors[name] = torch.from_numpy(np.asarray(data[0] if kind == "ragged" else data))
+        if kind == "scalar":
+            return self._tensors[name][index]
+        offsets = data[1]
+        return self._tensors[name][int(offsets[index]):int(offsets[index + 1])]
+
+    def get_tensors(self,
+                    index: int,
+                    names: List[str]) -> Dict[str, torch.Tensor]:
+        """Returns the fields `names` of the `index`-th feature that are not `None`, see `get_tensor()`."""
+        index = self._check_index(index)
+        tensors = dict()
+        for name in names:
+            if name not in self.columns:
+                continue
+            tensor = self.get_tensor(name, index)
+            if tensor is not None:
+                tensors[name] = tensor
+        return tensors
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        index = self._check_index(index)
+        features = self.feature_class.__new__(self.feature_class)
+        for name in self.columns:
+            setattr(features, name, self.get_field(name, index))
+        return features
+
+
+class ShardedFeatures(Sequence):
+    """Features made of the `FeatureStore`s of consecutive shards, see `sharding.py`.
+
+    Attributes:
+        shards (`List[FeatureStore]`):
+            The features of each shard.
+        offsets (`List[int]`):
+            The index of the first feature of each shard, followed by the number of features.
+    """
+
+    def __init__(self,
+                 shards: List[FeatureStore]) -> None:
+        """Constructs a `ShardedFeatures`."""
+        self.shards = shards
+        self.offsets = [0]
+        for shard in shards:
+            self.offsets.append(self.offsets[-1] + len(shard))
+
+    def __len__(self) -> int:
+        return self.offsets[-1]
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        """Returns the shard of the `index`-th feature and its index in the shard."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Feature index out of range.")
+        shard_idx = bisect.bisect_right(self.offsets, index) - 1
+        return shard_idx, index - self.offsets[shard_idx]
+
+    def get_lengths(self, name: str) -> np.ndarray:
+        """Returns the length of the integer lists of field `name` of the features."""
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + [shard.get_lengths(name) for shard in self.shards
+                                                                if len(shard) != 0])
+
+    def get_tensors(self,
+                    index: int,
+                    names: List[str]) -> Dict[str, torch.Tensor]:
+        """Returns the fields `names` of the `index`-th feature as tensors, see `FeatureStore.get_tensors()`."""
+        shard_idx, index = self._locate(index)
+        return self.shards[shard_idx].get_tensors(index, names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        shard_idx, index = self._locate(index)
+        return self.shards[shard_idx][index]
+
+
+def pad_and_stack(tensors: List[torch.Tensor],
+                  pad_value: int,
+                  dtype: torch.dtype,
+                  length: Optional[int] = None) -> torch.Tensor:
+    """Stacks the tensors of a batch into a tensor of type `dtype`, padding 1-D tensors with `pad_value` to the longest
+    of them, or to `length` if longer."""
+    if tensors[0].dim() == 0:
+        return torch.stack(tensors).to(dtype)
+    length = max([length or 0] + [len(tensor) for tensor in tensors])
+    output = torch.full((len(tensors), length), pad_value, dtype=dtype)
+    for i, tensor in enumerate(tensors):
+        output[i, :len(tensor)] = tensor
+    return output
+
+
+def compact_features(processor) -> None:
+    """Replaces the list of feature objects of `processor` by a `FeatureStore` once they have been converted."""
+    if isinstance(processor.input_features, list):
+        processor.input_features = FeatureStore.from_features(processor.feature_class, processor.input_features,
+                                                              processor.get_pad_values())
@@ -3,10 +3,11 @@ import json
 import logging
 
 from pathlib import Path
+from itertools import islice
 from transformers import PreTrainedTokenizer
 from transformers.tokenization_utils import BatchEncoding
 from .whitespace_tokenizer import WordLevelTokenizer
-from typing import Dict, List, Optional, Union, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -206,6 +207,42 @@ def get_word_ids(tokenizer: PreTrainedTokenizer,
     return word_ids
 
 
+def tokenize_in_batches(tokenizer: PreTrainedTokenizer,
+                        texts: Iterable[Any],
+                        batch_size: int = 1024,
+                        **kwargs) -> Iterator[BatchEncoding]:
+    """Tokenizes the texts with one tokenizer call per batch and yields the outputs of each text.
+
+    Fast tokenizers encode a batch in parallel, so this is much faster than calling the tokenizer on each text. The
+    texts are consumed lazily, one batch at a time, and the outputs of each text are the same as those of a single
+    call, including `word_ids()` for fast tokenizers.
+
+    Args:
+        tokenizer (`PreTrainedTokenizer`):
+            The tokenizer used for tokenization.
+        texts (`Iterable[Any]`):
+            The texts, or lists of words if `is_split_into_words` is set.
+        batch_size (`int`, `optional`, defaults to 1024):
+            The number of texts tokenized by each call.
+        **kwargs:
+            The arguments of the tokenizer call, e.g. `padding` and `max_length`.
+
+    Yields:
+        outputs (`BatchEncoding`):
+            The outputs of the tokenizer for each text.
+    """
+    texts = iter(texts)
+    while True:
+        batch = list(islice(texts, batch_size))
+        if len(batch) == 0:
+            return
+        outputs = tokenizer(batch, **kwargs)
+        encodings = outputs.encodings
+        for i in range(len(batch)):
+            yield BatchEncoding({key: value[i] for key, value in outputs.items()},
+                                encoding=encodings[i] if encodings is not None else None)
+
+
 def check_pred_len(pred: List[str],
                    item: Dict[str, Union[str, List[dict]]],
                    language: str) -> None:
@@ -8,7 +8,7 @@ from .base_processor import (
     EAEInputFeatures
 )
 from .mrc_converter import read_query_templates
-from .input_utils import get_words, get_left_and_right_pos, get_word_ids
+from .input_utils import get_words, get_left_and_right_pos, get_word_ids, tokenize_in_batches
 from collections import defaultdict
 
 logger = logging.getLogger(__name__)
@@ -32,21 +32,22 @@ class EAEMRCProcessor(EAEDataProcessor):
                  is_training: bool = False) -> None:
         """Constructs a `EAEMRCProcessor`."""
         super().__init__(config, tokenizer, pred_file, is_training)
-        self.read_examples(input_file)
-        self.convert_examples_to_features()
+        self.read_and_convert(input_file)
 
     def read_examples(self,
                       input_file: str) -> None:
         """Obtains a collection of `EAEInputExample`s for the dataset."""
         self.examples = []
         self.data_for_evaluation["golden_arguments"] = []
-        trigger_idx = 0
+        trigger_idx = self.shard.start_trigger
         query_templates = read_query_templates(self.config.prompt_file,
                                                translate=self.config.dataset_name == "ACE2005-ZH")
         template_id = self.config.mrc_template_id
         language = self.config.language
         with open(input_file, "r", encoding="utf-8") as f:
-            for idx, line in enumerate(tqdm(f.readlines(), desc="Reading from %s" % input_file)):
+            for idx, line in enumerate(tqdm(self.shard.read_lines(f), desc="Reading from %s" % input_file,
+                                            disable=not self.progress_bar),
+                                       start=self.shard.start_line):
                 item = json.loads(line.strip())
                 text = item["text"]
                 words = get_words(text=text, language=language)
@@ -203,7 +204,7 @@ class EAEMRCProcessor(EAEDataProcessor):
                                 )
                                 self.examples.append(example)
             if self.event_preds is not None:
-                assert trigger_idx == len(self.event_preds)
+                assert trigger_idx == self.shard.get_end_trigger(len(self.event_preds))
 
     def convert_examples_to_features(self) -> None:
         """Converts the `EAEInputExample`s into `EAEInputFeatures`s."""
@@ -211,19 +212,22 @@ class EAEMRCProcessor(EAEDataProcessor):
         self.data_for_evaluation["text_range"] = []
         self.data_for_evaluation["text"] = []
 
-        for example in tqdm(self.examples, desc="Processing features for MRC"):
-            # context
-            input_context = self.tokenizer(example.text,
-                                           truncation=True,
-                                           max_length=self.config.max_seq_length,
-                                           is_split_into_words=True)
-            # template
-            input_template = self.tokenizer(example.input_template,
-                                            truncation=True,
-                                            padding="max_length",
-                                            max_length=self.config.max_seq_length,
-                                            is_split_into_words=True)
-
+        # context
+        all_input_context = tokenize_in_batches(self.tokenizer,
+                                                (example.text for example in self.examples),
+                                                truncation=True,
+                                                max_length=self.config.max_seq_length,
+                                                is_split_into_words=True)
+        # template
+        all_input_template = tokenize_in_batches(self.tokenizer,
+                                                 (example.input_template for example in self.examples),
+                                                 truncation=True,
+                                                 max_length=self.config.max_seq_length,
+                                                 is_split_into_words=True)
+        for example, input_context, input_template in zip(tqdm(self.examples, desc="Processing features for MRC",
+                                                               disable=not self.progress_bar),
+                                                          all_input_context,
+                                                          all_input_template):
             input_context = self.remove_sub_word(self.tokenizer, input_context, example.text)
             # concatenate
             input_ids = input_context["input_ids"] + input_template["input_ids"]
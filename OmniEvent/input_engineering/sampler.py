@@ -0,0 +1,136 @@
+import numpy as np
+
+from torch.utils.data import Sampler
+from typing import Iterator, List, Optional
+
+
+class LengthGroupedBatchSampler(Sampler):
+    """Batches features of similar lengths together, so that the batches padded by `collate_fn()` waste few tokens.
+
+    The features are shuffled and split into groups of `group_size`, which are sorted by length and cut into batches,
+    so the batches are still random while their features have similar lengths. The batches hold `batch_size` features,
+    or as many as fit in `max_tokens` padded tokens if it is set. The batches are then shuffled and, in distributed
+    training, dealt to the ranks in turn, each rank getting the same number of batches.
+
+    With `max_tokens`, the number of batches depends on how the features are grouped, so it changes with the epoch,
+    while the `Trainer` computes the number of steps and the learning rate schedule from the length of the first
+    epoch. Every epoch is therefore cut, or completed by repeating its first batches, to the number of batches of the
+    first epoch, which may leave a few features out of an epoch or see them twice.
+
+    Attributes:
+        lengths (`np.ndarray`):
+            The number of tokens of each feature, e.g. from `get_lengths()` of the processors.
+        batch_size (`int`, `optional`):
+            The maximum number of features of a batch.
+        max_tokens (`int`, `optional`):
+            The maximum number of tokens of a batch once padded, a feature longer than that being batched alone.
+        group_size (`int`):
+            The number of features sorted by length together, `50 * batch_size` or 1000 by default.
+        shuffle (`bool`):
+            Whether to shuffle the features and the batches, otherwise the features are sorted by length.
+        seed (`int`):
+            The seed of the shuffling, combined with the epoch.
+        rank (`int`):
+            The distributed rank of the process.
+        world_size (`int`):
+            The number of distributed processes.
+        epoch (`int`):
+            The current epoch, set by `set_epoch()`.
+    """
+
+    def __init__(self,
+                 lengths: np.ndarray,
+                 batch_size: Optional[int] = None,
+                 max_tokens: Optional[int] = None,
+                 group_size: Optional[int] = None,
+                 shuffle: bool = True,
+                 seed: int = 42,
+                 rank: int = 0,
+                 world_size: int = 1) -> None:
+        """Constructs a `LengthGroupedBatchSampler`."""
+        if batch_size is None and max_tokens is None:
+            raise ValueError("Either batch_size or max_tokens must be set.")
+        assert 0 <= rank < world_size
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        if group_size is None:
+            group_size = 50 * batch_size if batch_size is not None else 1000
+        self.group_size = group_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self._batches = None
+        self._num_batches = None
+
+    def set_epoch(self, epoch: int) -> None:
+        """Sets the epoch, which changes the order the features are shuffled in, see `SetEpochCallback`."""
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self._batches = None
+
+    def split_group(self, indices: np.ndarray) -> List[List[int]]:
+        """Cuts the indices of a group sorted by decreasing length into batches."""
+        batches, batch, max_length = [], [], 0
+        for index in indices.tolist():
+            length = max(max_length, int(self.lengths[index]))
+            full = self.batch_size is not None and len(batch) == self.batch_size
+            too_long = self.max_tokens is not None and (len(batch) + 1) * length > self.max_tokens
+            if len(batch) != 0 and (full or too_long):
+                batches.append(batch)
+                batch, length = [], int(self.lengths[index])
+            batch.append(index)
+            max_length = length
+        if len(batch) != 0:
+            batches.append(batch)
+        return batches
+
+    def make_batches(self, epoch: int) -> List[List[int]]:
+        """Returns the batches of all the ranks for an epoch."""
+        rng = np.random.default_rng([self.seed, epoch])
+        if self.shuffle:
+            indices = rng.permutation(len(self.lengths))
+            groups = [indices[i:i + self.group_size] for i in range(0, len(indices), self.group_size)]
+        else:
+            groups = [np.arange(len(self.lengths))]
+        batches = []
+        for group in groups:
+            # stable, so that the features of the same length keep their order
+            order = np.argsort(-self.lengths[group], kind="stable")
+            batches.extend(self.split_group(group[order]))
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    @property
+    def num_batches(self) -> int:
+        """The number of batches of the first epoch, which every epoch is given."""
+        if self._num_batches is None:
+            self._num_batches = len(self.make_batches(0))
+        return self._num_batches
+
+    def get_batches(self) -> List[List[int]]:
+        """Returns the batches of this rank for the current epoch."""
+        if self._batches is not None:
+            return self._batches
+        batches = self.make_batches(self.epoch)
+        if self._num_batches is None and self.epoch == 0:
+            self._num_batches = len(batches)
+        # cut or repeat the first batches so that every epoch has the length the trainer expects
+        num_batches = self.num_batches
+        if len(batches) != 0:
+            batches = (batches * (num_batches // len(batches) + 1))[:num_batches]
+        # repeat the first batches so that every rank gets the same number of batches
+        if self.world_size > 1 and len(batches) != 0:
+            num_padding = -len(batches) % self.world_size
+            batches += (batches * (num_padding // len(batches) + 1))[:num_padding]
+        self._batches = batches[self.rank::self.world_size]
+        return self._batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        yield from self.get_batches()
+
+    def __len__(self) -> int:
+        return len(self.get_batches())
@@ -1,11 +1,11 @@
 import re
 import json
 import logging
-from typing import List, Union, Tuple, Optional
+from typing import Dict, List, Union, Tuple, Optional
 
 from tqdm import tqdm
 from collections import defaultdict
-from .input_utils import get_words, get_plain_label
+from .input_utils import get_words, get_plain_label, tokenize_in_batches
 from .base_processor import (
     EDInputExample,
     EDDataProcessor,
@@ -60,6 +60,8 @@ class EDSeq2SeqProcessor(EDDataProcessor):
     `convert_examples_to_features()` are  implemented; the rest of the attributes and functions are multiplexed from the
     `EDDataProcessor` class.
     """
+    # the labels are decoded rather than aligned with the input tokens
+    token_names = ["input_ids", "attention_mask", "token_type_ids"]
 
     def __init__(self,
                  config,
@@ -67,15 +69,16 @@ class EDSeq2SeqProcessor(EDDataProcessor):
                  input_file: str) -> None:
         """Constructs a `EDSeq2SeqProcessor`."""
         super().__init__(config, tokenizer)
-        self.read_examples(input_file)
-        self.convert_examples_to_features()
+        self.read_and_convert(input_file)
     
     def read_examples(self,
                       input_file: str) -> None:
         """Obtains a collection of `EDInputExample`s for the dataset."""
         self.examples = []
         with open(input_file, "r", encoding="utf-8") as f:
-            for idx, line in enumerate(tqdm(f.readlines(), desc="Reading from %s" % input_file)):
+            for idx, line in enumerate(tqdm(self.shard.read_lines(f), desc="Reading from %s" % input_file,
+                                            disable=not self.progress_bar),
+                                       start=self.shard.start_line):
                 item = json.loads(line.strip())
                 if "source" in item:
                     kwargs = {"source": [item["source"]]}
@@ -110,19 +113,22 @@ class EDSeq2SeqProcessor(EDDataProcessor):
     def convert_examples_to_features(self) -> None:
         """Converts the `EDInputExample`s into `EDInputFeatures`s."""
         self.input_features = []
-        for example in tqdm(self.examples, desc="Processing features for Seq2Seq"):
-            # context 
-            input_context = self.tokenizer(example.kwargs["source"]+example.text,
-                                           truncation=True,
-                                           padding="max_length",
-                                           max_length=self.config.max_seq_length,
-                                           is_split_into_words=True)
-            # output labels
-            label_outputs = self.tokenizer(example.labels.split(),
-                                           truncation=True,
-                                           padding="max_length",
-                                           max_length=self.config.max_out_length,
-                                           is_split_into_words=True)
+        # context
+        all_input_context = tokenize_in_batches(self.tokenizer,
+                                                (example.kwargs["source"] + example.text for example in self.examples),
+                                                truncation=True,
+                                                max_length=self.config.max_seq_length,
+                                                is_split_into_words=True)
+        # output labels
+        all_label_outputs = tokenize_in_batches(self.tokenizer,
+                                                (example.labels.split() for example in self.examples),
+                                                truncation=True,
+                                                max_length=self.config.max_out_length,
+                                                is_split_into_words=True)
+        for example, input_context, label_outputs in zip(tqdm(self.examples, desc="Processing features for Seq2Seq",
+                                                              disable=not self.progress_bar),
+                                                         all_input_context,
+                                                         all_label_outputs):
             # set -100 to unused token 
             for i, flag in enumerate(label_outputs["attention_mask"]):
                 if flag == 0:
@@ -136,6 +142,13 @@ class EDSeq2SeqProcessor(EDDataProcessor):
             self.input_features.append(features)
 
 
+    def get_widths(self) -> Dict[str, int]:
+        """Returns the length the sequences of each field of the features are padded to without `truncate_in_batch`."""
+        widths = super().get_widths()
+        widths["labels"] = self.config.max_out_length
+        return widths
+
+
 class EAESeq2SeqProcessor(EAEDataProcessor):
     """Data processor for sequence to sequence for event argument extraction.
 
@@ -144,6 +157,8 @@ class EAESeq2SeqProcessor(EAEDataProcessor):
     `convert_examples_to_features()` are  implemented; a new function entitled `insert_marker()` is defined, and
     the rest of the attributes and functions are multiplexed from the `EAEDataProcessor` class.
     """
+    # the labels are decoded rather than aligned with the input tokens
+    token_names = ["input_ids", "attention_mask", "token_type_ids"]
 
     def __init__(self,
                  config,
@@ -153,8 +168,7 @@ class EAESeq2SeqProcessor(EAEDataProcessor):
                  is_training: Optional[bool] = False) -> None:
         """Constructs a `EAESeq2SeqProcessor`."""
         super().__init__(config, tokenizer, pred_file, is_training)
-        self.read_examples(input_file)
-        self.convert_examples_to_features()
+        self.read_and_convert(input_file)
     
     def read_examples(self,
                       input_file: str) -> None:
@@ -163,9 +177,10 @@ class EAESeq2SeqProcessor(EAEDataProcessor):
         self.data_for_evaluation["golden_arguments"] = []
         self.data_for_evaluation["roles"] = []
         language = self.config.language
-        trigger_idx = 0
+        trigger_idx = self.shard.start_trigger
         with open(input_file, "r", encoding="utf-8") as f:
-            for line in tqdm(f.readlines(), desc="Reading from %s" % input_file):
+            for line in tqdm(self.shard.read_lines(f), desc="Reading from %s" % input_file,
+                             disable=not self.progress_bar):
                 item = json.loads(line.strip())
                 if "source" in item:
                     kwargs = {"source": [item["source"]]}
@@ -257,7 +272,7 @@ class EAESeq2SeqProcessor(EAEDataProcessor):
                             )
                             self.examples.append(example)
             if self.event_preds is not None and not self.config.golden_trigger:
-                assert trigger_idx == len(self.event_preds)
+                assert trigger_idx == self.shard.get_end_trigger(len(self.event_preds))
             print('there are {} examples'.format(len(self.examples)))
 
     @staticmethod
@@ -282,23 +297,26 @@ class EAESeq2SeqProcessor(EAEDataProcessor):
         """Converts the `EAEInputExample`s into `EAEInputFeatures`s."""
         self.input_features = []
         whitespace = True if self.config.language == "English" else False
-        for example in tqdm(self.examples, desc="Processing features for Seq2Seq"):
-            # context 
-            words = self.insert_marker(example.text,
-                                       [example.trigger_left, example.trigger_right],
-                                       self.config.markers,
-                                       whitespace)
-            input_context = self.tokenizer(example.kwargs["source"] + words,
-                                           truncation=True,
-                                           padding="max_length",
-                                           max_length=self.config.max_seq_length,
-                                           is_split_into_words=True)
-            # output labels
-            label_outputs = self.tokenizer(example.labels.split(),
-                                           padding="max_length",
-                                           truncation=True,
-                                           max_length=self.config.max_out_length,
-                                           is_split_into_words=True)
+        # context
+        words = (example.kwargs["source"] + self.insert_marker(example.text,
+                                                               [example.trigger_left, example.trigger_right],
+                                                               self.config.markers,
+                                                               whitespace) for example in self.examples)
+        all_input_context = tokenize_in_batches(self.tokenizer,
+                                                words,
+                                                truncation=True,
+                                                max_length=self.config.max_seq_length,
+                                                is_split_into_words=True)
+        # output labels
+        all_label_outputs = tokenize_in_batches(self.tokenizer,
+                                                (example.labels.split() for example in self.examples),
+                                                truncation=True,
+                                                max_length=self.config.max_out_length,
+                                                is_split_into_words=True)
+        for example, input_context, label_outputs in zip(tqdm(self.examples, desc="Processing features for Seq2Seq",
+                                                              disable=not self.progress_bar),
+                                                         all_input_context,
+                                                         all_label_outputs):
             # set -100 to unused token
             for i, flag in enumerate(label_outputs["attention_mask"]):
                 if flag == 0:
@@ -310,3 +328,9 @@ class EAESeq2SeqProcessor(EAEDataProcessor):
                 labels=label_outputs["input_ids"],
             )
             self.input_features.append(features)
+
+    def get_widths(self) -> Dict[str, int]:
+        """Returns the length the sequences of each field of the features are padded to without `truncate_in_batch`."""
+        widths = super().get_widths()
+        widths["labels"] = self.config.max_out_length
+        return widths
@@ -3,7 +3,7 @@ import logging
 from typing import List, Union, Any, Optional
 
 from tqdm import tqdm
-from .input_utils import get_words, get_left_and_right_pos, get_word_ids
+from .input_utils import get_words, get_left_and_right_pos, get_word_ids, tokenize_in_batches
 from .base_processor import (
     EDDataProcessor,
     EDInputExample,
@@ -34,9 +34,8 @@ class EDSLProcessor(EDDataProcessor):
                  input_file: str) -> None:
         """Constructs a EDSLProcessor."""
         super().__init__(config, tokenizer)
-        self.read_examples(input_file)
         self.is_overflow = []
-        self.convert_examples_to_features()
+        self.read_and_convert(input_file)
 
     def read_examples(self,
                       input_file: str) -> None:
@@ -45,7 +44,8 @@ class EDSLProcessor(EDDataProcessor):
         language = self.config.language
 
         with open(input_file, "r", encoding="utf-8") as f:
-            for line in tqdm(f.readlines(), desc="Reading from %s" % input_file):
+            for line in tqdm(self.shard.read_lines(f), desc="Reading from %s" % input_file,
+                             disable=not self.progress_bar):
                 item = json.loads(line.strip())
                 text = item["text"]
                 words = get_words(text=text, language=language)
@@ -83,13 +83,13 @@ class EDSLProcessor(EDDataProcessor):
     def convert_examples_to_features(self) -> None:
         """Converts the `EDInputExample`s into `EDInputFeatures`s."""
         self.input_features = []
-
-        for example in tqdm(self.examples, desc="Processing features for SL"):
-            outputs = self.tokenizer(example.text,
-                                     padding="max_length",
-                                     truncation=False,
-                                     max_length=self.config.max_seq_length,
-                                     is_split_into_words=True)
+        all_outputs = tokenize_in_batches(self.tokenizer,
+                                          (example.text for example in self.examples),
+                                          truncation=False,
+                                          max_length=self.config.max_seq_length,
+                                          is_split_into_words=True)
+        for example, outputs in zip(tqdm(self.examples, desc="Processing features for SL",
+                                         disable=not self.progress_bar), all_outputs):
             # Roberta tokenizer doesn't return token_type_ids
             if "token_type_ids" not in outputs:
                 outputs["token_type_ids"] = [0] * len(outputs["input_ids"])
@@ -137,17 +137,17 @@ class EAESLProcessor(EAEDataProcessor):
         self.positive_candidate_indices = []
         self.is_overflow = []
         self.config.role2id["X"] = -100
-        self.read_examples(input_file)
-        self.convert_examples_to_features()
+        self.read_and_convert(input_file)
 
     def read_examples(self,
                       input_file: str) -> None:
         """Obtains a collection of `EAEInputExample`s for the dataset."""
         self.examples = []
         language = self.config.language
-        trigger_idx = 0
+        trigger_idx = self.shard.start_trigger
         with open(input_file, "r", encoding="utf-8") as f:
-            for line in tqdm(f.readlines(), desc="Reading from %s" % input_file):
+            for line in tqdm(self.shard.read_lines(f), desc="Reading from %s" % input_file,
+                             disable=not self.progress_bar):
                 item = json.loads(line.strip())
                 text = item["text"]
                 words = get_words(text=text, language=language)
@@ -223,7 +223,7 @@ class EAESLProcessor(EAEDataProcessor):
                             self.examples.append(example)
                             self.positive_candidate_indices.append(trigger_idx-1)
             if self.event_preds is not None:
-                assert trigger_idx == len(self.event_preds)
+                assert trigger_idx == self.shard.get_end_trigger(len(self.event_preds))
 
     def get_final_labels(self,
                          labels: dict,
@@ -263,17 +263,20 @@ class EAESLProcessor(EAEDataProcessor):
         self.input_features = []
         self.is_overflow = []
 
-        for example in tqdm(self.examples, desc="Processing features for SL"):
-            text, labels = self.insert_marker(example.text,
+        marked_examples = [self.insert_marker(example.text,
                                               example.pred_type,
                                               example.labels,
                                               [example.trigger_left, example.trigger_right],
-                                              self.config.markers)
-            outputs = self.tokenizer(text,
-                                     padding="max_length",
-                                     truncation=False,
-                                     max_length=self.config.max_seq_length,
-                                     is_split_into_words=True)
+                                              self.config.markers) for example in self.examples]
+        all_outputs = tokenize_in_batches(self.tokenizer,
+                                          (text for text, _ in marked_examples),
+                                          truncation=False,
+                                          max_length=self.config.max_seq_length,
+                                          is_split_into_words=True)
+        for example, (text, labels), outputs in zip(tqdm(self.examples, desc="Processing features for SL",
+                                                         disable=not self.progress_bar),
+                                                    marked_examples,
+                                                    all_outputs):
             # Roberta tokenizer doesn't return token_type_ids
             if "token_type_ids" not in outputs:
                 outputs["token_type_ids"] = [0] * len(outputs["input_ids"])
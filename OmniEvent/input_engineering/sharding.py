@@ -0,0 +1,196 @@
+import os
+import copy
+import json
+import shutil
+import logging
+import multiprocessing
+
+from itertools import islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from .feature_store import compact_features
+from .feature_cache import (
+    commit_entry,
+    convert_examples,
+    create_entry,
+    load_cached_features,
+    load_or_convert_features,
+    save_features,
+)
+
+logger = logging.getLogger(__name__)
+
+# attributes filled by `read_examples` and `convert_examples_to_features`, concatenated over the shards
+MERGED_ATTRIBUTES = ["examples", "input_features", "is_overflow", "positive_candidate_indices"]
+
+
+class Shard(object):
+    """A contiguous range of lines of an input file.
+
+    `read_examples` reads the lines of `processor.shard` only, which is the whole file by default. The triggers of
+    the lines are numbered from `start_trigger`, so that the event predictions of EAE stay aligned with the triggers.
+    A shard can also carry its lines, which are then read instead of the file, see `streaming.py`.
+
+    Attributes:
+        start_line (`int`):
+            The index of the first line of the shard.
+        end_line (`int`, `optional`):
+            The index after the last line of the shard, `None` for the end of the file.
+        start_trigger (`int`):
+            The index of the first trigger of the shard among the triggers of the file.
+        end_trigger (`int`, `optional`):
+            The index after the last trigger of the shard, `None` for the end of the file.
+        lines (`List[str]`, `optional`):
+            The lines of the shard if they have been read already.
+    """
+
+    def __init__(self,
+                 start_line: int = 0,
+                 end_line: Optional[int] = None,
+                 start_trigger: int = 0,
+                 end_trigger: Optional[int] = None,
+                 lines: Optional[List[str]] = None) -> None:
+        """Constructs a `Shard`."""
+        self.start_line = start_line
+        self.end_line = end_line
+        self.start_trigger = start_trigger
+        self.end_trigger = end_trigger
+        self.lines = lines
+
+    def read_lines(self, f) -> List[str]:
+        """Returns the lines of the shard in the opened file `f`."""
+        if self.lines is not None:
+            return self.lines
+        return list(islice(f, self.start_line, self.end_line))
+
+    def get_end_trigger(self, num_triggers: int) -> int:
+        """Returns the index after the last trigger of the shard, given the number of triggers of the file."""
+        return num_triggers if self.end_trigger is None else self.end_trigger
+
+
+def count_triggers(item: Dict[str, Any]) -> int:
+    """Returns the number of triggers of a line an EAE processor consumes event predictions for."""
+    num_triggers = 0
+    if "events" in item:
+        num_triggers += sum(len(event["triggers"]) for event in item["events"])
+        num_triggers += len(item["negative_triggers"])
+    if "candidates" in item:
+        num_triggers += len(item["candidates"])
+    return num_triggers
+
+
+def get_shards(input_file: str,
+               num_shards: int,
+               with_triggers: bool = False) -> List[Shard]:
+    """Splits the lines of `input_file` into `num_shards` contiguous shards of about the same number of lines.
+
+    Args:
+        input_file (`str`):
+            The input file.
+        num_shards (`int`):
+            The number of shards, fewer if the file has fewer lines.
+        with_triggers (`bool`, `optional`, defaults to `False`):
+            Whether to count the triggers of each line to number the triggers of the shards, needed for EAE.
+    """
+    with open(input_file, "r", encoding="utf-8") as f:
+        if with_triggers:
+            num_triggers = [count_triggers(json.loads(line.strip())) for line in f]
+        else:
+            num_triggers = [0 for _ in f]
+    num_lines = len(num_triggers)
+    num_shards = max(min(num_shards, num_lines), 1)
+    shards = []
+    start_trigger = 0
+    for i in range(num_shards):
+        start_line, end_line = num_lines * i // num_shards, num_lines * (i + 1) // num_shards
+        end_trigger = start_trigger + sum(num_triggers[start_line:end_line])
+        shards.append(Shard(start_line, end_line, start_trigger, end_trigger))
+        start_trigger = end_trigger
+    return shards
+
+
+def _process_shard(args: Tuple) -> Dict[str, Any]:
+    """Reads and converts the examples of a shard in a worker process, see `read_and_convert`."""
+    processor, input_file, shard, convert, shard_path = args
+    processor.shard = shard
+    processor.read_examples(input_file)
+    result = dict(language=processor.config.language)
+    if convert:
+        result["state"] = convert_examples(processor)
+        if shard_path is not None:
+            # stream the features to the cache rather than sending them back
+            compact_features(processor)
+            save_features(shard_path, processor.input_features, dict())
+            processor.input_features = []
+    for name in MERGED_ATTRIBUTES + ["data_for_evaluation"]:
+        if hasattr(processor, name):
+            result[name] = getattr(processor, name)
+    return result
+
+
+def read_and_convert(processor,
+                     input_file: str,
+                     cache_path: Optional[str] = None) -> None:
+    """Reads the examples of `input_file` and converts them into features, using the cache entry `cache_path`.
+
+    If `config.preprocessing_num_workers` is larger than 1, the lines of the file are split into as many shards, each
+    read and converted by a process of a pool. The examples, features and evaluation data of the shards are merged in
+    the order of the lines, so that the result is the same as in a single process. With a cache entry, the workers
+    write the features of their shards to the cache, which are then memory-mapped, so that the features of the whole
+    file are never held by a single process.
+    """
+    if input_file is None:
+        # the processor reads its examples later, e.g. a `StreamingDataset`
+        return
+    num_workers = getattr(processor.config, "preprocessing_num_workers", None) or 1
+    if num_workers <= 1:
+        processor.read_examples(input_file)
+        load_or_convert_features(processor, cache_path)
+        return
+
+    cached = cache_path is not None and os.path.isdir(cache_path)
+    convert = not cached
+    tmp_path = create_entry(cache_path) if convert and cache_path is not None else None
+    shards = get_shards(input_file, num_workers, with_triggers=hasattr(processor, "event_preds"))
+    shard_names = ["shard-%05d" % i for i in range(len(shards))]
+    for name in MERGED_ATTRIBUTES:
+        if hasattr(processor, name):
+            setattr(processor, name, [])
+    # the workers get a copy, as the arguments are sent while the results of the first shards are merged
+    worker_processor = copy.copy(processor)
+    for name in MERGED_ATTRIBUTES:
+        if hasattr(worker_processor, name):
+            setattr(worker_processor, name, [])
+    if hasattr(worker_processor, "data_for_evaluation"):
+        worker_processor.data_for_evaluation = dict()
+    args = [(worker_processor, input_file, shard, convert,
+             os.path.join(tmp_path, name) if tmp_path is not None else None)
+            for shard, name in zip(shards, shard_names)]
+    state = {"is_overflow": [], "data_for_evaluation": dict()}
+    try:
+        with multiprocessing.Pool(min(num_workers, len(shards))) as pool:
+            for result in pool.imap(_process_shard, args):
+                for name in MERGED_ATTRIBUTES:
+                    if name in result:
+                        getattr(processor, name).extend(result[name])
+                for key, value in result.get("data_for_evaluation", dict()).items():
+                    processor.data_for_evaluation.setdefault(key, []).extend(value)
+                if convert:
+                    state["is_overflow"].extend(result["state"]["is_overflow"])
+                    for key, value in result["state"]["data_for_evaluation"].items():
+                        state["data_for_evaluation"].setdefault(key, []).extend(value)
+                # `read_examples` of seq2seq ED sets the language from the source of the lines
+                processor.config.language = result["language"]
+    except BaseException:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path)
+        raise
+    logger.info("Read %d examples of %s in %d shards" % (len(processor.examples), input_file, len(shards)))
+
+    if cached:
+        load_cached_features(processor, cache_path)
+    elif tmp_path is not None:
+        commit_entry(tmp_path, cache_path, {"shards": shard_names, "state": state})
+        load_cached_features(processor, cache_path)
+    else:
+        compact_features(processor)
@@ -0,0 +1,196 @@
+import os
+import json
+import random
+import logging
+import tempfile
+import torch
+
+from torch.utils.data import IterableDataset, get_worker_info
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .base_processor import EAEDataProcessor
+from ..utils import hash_json
+from .feature_store import compact_features
+from .sharding import MERGED_ATTRIBUTES, Shard, count_triggers
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingDataset(IterableDataset):
+    """Streams the features of an ED/EAE data processor from a jsonl file.
+
+    The lines of the file are split into chunks of `chunk_size` lines, which are assigned in turn to the DataLoader
+    workers of all the distributed ranks, so that each line is read and converted by exactly one worker. Each worker
+    reads and converts its chunks with the `read_examples()` and `convert_examples_to_features()` of the processor,
+    and yields the features as they are converted, so only a chunk of examples and the shuffle buffer are held in
+    memory whatever the size of the file. The offsets of the chunks are indexed once, so that the workers seek to
+    their chunks instead of reading the whole file.
+
+    As the dataset has no length, the `Trainer` requires `max_steps` to be set. The ranks may get a different number of
+    batches in an epoch, so distributed training should use `repeat=True`, which loops over the file and lets
+    `max_steps` end the training.
+
+    Attributes:
+        processor:
+            The data processor that reads and converts the chunks, constructed without an input file.
+        input_file (`str`):
+            The jsonl file the examples are read from.
+        chunk_size (`int`):
+            The number of lines read and converted at once.
+        shuffle_buffer_size (`int`):
+            The number of features the features are shuffled among, no shuffling if 0.
+        seed (`int`):
+            The seed of the shuffling, combined with the epoch and the worker.
+        repeat (`bool`):
+            Whether to loop over the file endlessly, shuffling each pass with the next epoch.
+        rank (`int`):
+            The distributed rank of the process, from `torch.distributed` by default.
+        world_size (`int`):
+            The number of distributed processes, from `torch.distributed` by default.
+        epoch (`int`):
+            The current epoch, set by `set_epoch()`.
+        chunk_index (`List[Tuple[int, int, int]]`):
+            The byte offset, first line and first trigger of each chunk, followed by those of the end of the file.
+    """
+
+    def __init__(self,
+                 processor_class,
+                 config,
+                 tokenizer,
+                 input_file: str,
+                 pred_file: Optional[str] = None,
+                 is_training: Optional[bool] = False,
+                 chunk_size: int = 1024,
+                 shuffle_buffer_size: int = 0,
+                 seed: int = 42,
+                 repeat: bool = False,
+                 rank: Optional[int] = None,
+                 world_size: Optional[int] = None) -> None:
+        """Constructs a `StreamingDataset`."""
+        assert chunk_size > 0 and shuffle_buffer_size >= 0
+        if issubclass(processor_class, EAEDataProcessor):
+            self.processor = processor_class(config, tokenizer, None, pred_file, is_training)
+        else:
+            self.processor = processor_class(config, tokenizer, None)
+        self.processor.progress_bar = False
+        self.input_file = input_file
+        self.chunk_size = chunk_size
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.repeat = repeat
+        if rank is None or world_size is None:
+            distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+            rank = torch.distributed.get_rank() if distributed else 0
+            world_size = torch.distributed.get_world_size() if distributed else 1
+        assert 0 <= rank < world_size
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self.chunk_index = self.get_chunk_index()
+
+    def set_epoch(self, epoch: int) -> None:
+        """Sets the epoch, which changes the order the features are shuffled in, see `SetEpochCallback`."""
+        self.epoch = epoch
+
+    def get_consumer(self) -> Tuple[int, int]:
+        """Returns the index of this worker among the workers of all ranks, and the number of workers."""
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        return self.rank * num_workers + worker_id, self.world_size * num_workers
+
+    def build_chunk_index(self) -> List[Tuple[int, int, int]]:
+        """Scans the file for the offsets of the chunks, see `chunk_index`.
+
+        With event predictions, the lines are parsed to count their triggers, so that the predictions stay aligned.
+        """
+        count = getattr(self.processor, "event_preds", None) is not None
+        chunk_index = []
+        offset, num_lines, num_triggers = 0, 0, 0
+        with open(self.input_file, "rb") as f:
+            for line in f:
+                if num_lines % self.chunk_size == 0:
+                    chunk_index.append((offset, num_lines, num_triggers))
+                offset += len(line)
+                num_lines += 1
+                if count:
+                    num_triggers += count_triggers(json.loads(line))
+        chunk_index.append((offset, num_lines, num_triggers))
+        return chunk_index
+
+    def get_chunk_index(self) -> List[Tuple[int, int, int]]:
+        """Returns the `chunk_index` of the file, kept in `config.feature_cache_dir` if it is set, so that the file is
+        scanned by a single rank and run."""
+        cache_dir = getattr(self.processor.config, "feature_cache_dir", None)
+        if cache_dir is None:
+            return self.build_chunk_index()
+        stat = os.stat(self.input_file)
+        key = hash_json({
+            "input_file": os.path.abspath(self.input_file),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "chunk_size": self.chunk_size,
+            "count": getattr(self.processor, "event_preds", None) is not None,
+        })
+        cache_path = os.path.join(cache_dir, f"chunk-index-{key}.json")
+        if os.path.exists(cache_path):
+            with open(cache_path, encoding="utf-8") as f:
+                return [tuple(chunk) for chunk in json.load(f)]
+        chunk_index = self.build_chunk_index()
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(chunk_index, f)
+        os.replace(tmp_path, cache_path)
+        return chunk_index
+
+    def read_chunks(self,
+                    consumer_id: int,
+                    num_consumers: int) -> Iterator[Shard]:
+        """Yields the chunks of lines of the file assigned to the consumer, as `Shard`s carrying their lines."""
+        with open(self.input_file, "rb") as f:
+            for chunk_idx in range(consumer_id, len(self.chunk_index) - 1, num_consumers):
+                offset, start_line, start_trigger = self.chunk_index[chunk_idx]
+                _, end_line, end_trigger = self.chunk_index[chunk_idx + 1]
+                f.seek(offset)
+                lines = [f.readline().decode("utf-8") for _ in range(end_line - start_line)]
+                yield Shard(start_line, end_line, start_trigger, end_trigger, lines)
+
+    def convert_chunk(self, shard: Shard) -> List[Dict[str, torch.Tensor]]:
+        """Reads and converts the examples of a chunk, and returns their features."""
+        processor = self.processor
+        processor.shard = shard
+        for name in MERGED_ATTRIBUTES:
+            if hasattr(processor, name):
+                setattr(processor, name, [])
+        if hasattr(processor, "data_for_evaluation"):
+            processor.data_for_evaluation = dict()
+        processor.read_examples(self.input_file)
+        processor.convert_examples_to_features()
+        compact_features(processor)
+        return [processor[i] for i in range(len(processor))]
+
+    def __iter__(self) -> Iterator[Dict[str, torch.Tensor]]:
+        consumer_id, num_consumers = self.get_consumer()
+        epoch = self.epoch
+        while True:
+            rng = random.Random(f"{self.seed}-{epoch}-{consumer_id}")
+            buffer = []
+            for shard in self.read_chunks(consumer_id, num_consumers):
+                for features in self.convert_chunk(shard):
+                    if len(buffer) < self.shuffle_buffer_size:
+                        buffer.append(features)
+                        continue
+                    if len(buffer) != 0:
+                        idx = rng.randrange(len(buffer))
+                        features, buffer[idx] = buffer[idx], features
+                    yield features
+            rng.shuffle(buffer)
+            yield from buffer
+            if not self.repeat:
+                return
+            epoch += 1
+
+    def collate_fn(self, batch, training: bool = False) -> Dict[str, torch.Tensor]:
+        """Collates the samples in batches with the `collate_fn()` of the processor."""
+        return self.processor.collate_fn(batch, training)
+
@@ -1,10 +1,11 @@
 import json
+import torch
 import logging
 
 from tqdm import tqdm
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 
-from .input_utils import check_is_argument, get_negative_argument_candidates
+from .input_utils import check_is_argument, get_negative_argument_candidates, tokenize_in_batches
 from .base_processor import (
     EDDataProcessor,
     EDInputExample,
@@ -31,15 +32,15 @@ class EDTCProcessor(EDDataProcessor):
                  input_file: str) -> None:
         """Constructs an EDTCProcessor."""
         super().__init__(config, tokenizer)
-        self.read_examples(input_file)
-        self.convert_examples_to_features()
+        self.read_and_convert(input_file)
 
     def read_examples(self,
                       input_file: str) -> None:
         """Obtains a collection of `EDInputExample`s for the dataset."""
         self.examples = []
         with open(input_file, "r") as f:
-            for line in tqdm(f.readlines(), desc="Reading from %s" % input_file):
+            for line in tqdm(self.shard.read_lines(f), desc="Reading from %s" % input_file,
+                             disable=not self.progress_bar):
                 item = json.loads(line.strip())
                 # training and valid set
                 if "events" in item:
@@ -75,24 +76,40 @@ class EDTCProcessor(EDDataProcessor):
                         )
                         self.examples.append(example)
 
+    @staticmethod
+    def insert_marker(text: str,
+                      trigger_position: List[int],
+                      markers: List[str],
+                      language: str) -> str:
+        """Adds a marker at the start and end position of the event trigger."""
+        text_left = text[:trigger_position[0]]
+        text_mid = text[trigger_position[0]:trigger_position[1]]
+        text_right = text[trigger_position[1]:]
+
+        if language == "Chinese":
+            return text_left + markers[0] + text_mid + markers[1] + text_right
+        else:
+            return text_left + markers[0] + " " + text_mid + " " + markers[1] + text_right
+
     def convert_examples_to_features(self) -> None:
         """Converts the `EDInputExample`s into `EDInputFeatures`s."""
         # merge and then tokenize
         self.input_features = []
-        for example in tqdm(self.examples, desc="Processing features for TC"):
-            text_left = example.text[:example.trigger_left]
-            text_mid = example.text[example.trigger_left:example.trigger_right]
-            text_right = example.text[example.trigger_right:]
-
-            if self.config.language == "Chinese":
-                text = text_left + self.config.markers[0] + text_mid + self.config.markers[1] + text_right
-            else:
-                text = text_left + self.config.markers[0] + " " + text_mid + " " + self.config.markers[1] + text_right
-
-            outputs = self.tokenizer(text, padding="max_length", truncation=True, max_length=self.config.max_seq_length)
+        texts = (self.insert_marker(example.text,
+                                    [example.trigger_left, example.trigger_right],
+                                    self.config.markers,
+                                    self.config.language) for example in self.examples)
+        all_outputs = tokenize_in_batches(self.tokenizer,
+                                          texts,
+                                          truncation=True,
+                                          max_length=self.config.max_seq_length)
+        left_marker_id = self.tokenizer.convert_tokens_to_ids(self.config.markers[0])
+        right_marker_id = self.tokenizer.convert_tokens_to_ids(self.config.markers[1])
+        for example, outputs in zip(tqdm(self.examples, desc="Processing features for TC",
+                                         disable=not self.progress_bar), all_outputs):
             try:
-                left = outputs["input_ids"].index(self.tokenizer.convert_tokens_to_ids(self.config.markers[0]))
-                right = outputs["input_ids"].index(self.tokenizer.convert_tokens_to_ids(self.config.markers[1]))
+                left = outputs["input_ids"].index(left_marker_id)
+                right = outputs["input_ids"].index(right_marker_id)
             except:
                 logger.warning("Markers are not in the input tokens.")
                 left, right = 0, 0
@@ -131,17 +148,17 @@ class EAETCProcessor(EAEDataProcessor):
                  is_training: Optional[bool] = False):
         """Constructs a `EAETCProcessor`."""
         super().__init__(config, tokenizer, pred_file, is_training)
-        self.read_examples(input_file)
-        self.convert_examples_to_features()
+        self.read_and_convert(input_file)
 
     def read_examples(self,
                       input_file: str) -> None:
         """Obtains a collection of `EAEInputExample`s for the dataset."""
         self.examples = []
-        trigger_idx = 0
+        trigger_idx = self.shard.start_trigger
         with open(input_file, "r") as f:
-            all_lines = f.readlines()
-            for line in tqdm(all_lines, desc="Reading from %s" % input_file):
+            all_lines = self.shard.read_lines(f)
+            for line in tqdm(all_lines, desc="Reading from %s" % input_file,
+                             disable=not self.progress_bar):
                 item = json.loads(line.strip())
                 if "events" in item:
                     for event in item["events"]:
@@ -189,7 +206,7 @@ class EAETCProcessor(EAEDataProcessor):
                         trigger_idx += 1
 
             if self.event_preds is not None:
-                assert trigger_idx == len(self.event_preds)
+                assert trigger_idx == self.shard.get_end_trigger(len(self.event_preds))
 
     @staticmethod
     def insert_marker(text: str,
@@ -241,17 +258,18 @@ class EAETCProcessor(EAEDataProcessor):
         # merge and then tokenize
         self.input_features = []
         whitespace = True if self.config.language == "English" else False
-        for example in tqdm(self.examples, desc="Processing features for TC"):
-            text = self.insert_marker(example.text,
-                                      example.pred_type,
-                                      [example.trigger_left, example.trigger_right],
-                                      [example.argument_left, example.argument_right],
-                                      self.config.markers,
-                                      whitespace)
-            outputs = self.tokenizer(text,
-                                     padding="max_length",
-                                     truncation=True,
-                                     max_length=self.config.max_seq_length)
+        texts = (self.insert_marker(example.text,
+                                    example.pred_type,
+                                    [example.trigger_left, example.trigger_right],
+                                    [example.argument_left, example.argument_right],
+                                    self.config.markers,
+                                    whitespace) for example in self.examples)
+        all_outputs = tokenize_in_batches(self.tokenizer,
+                                          texts,
+                                          truncation=True,
+                                          max_length=self.config.max_seq_length)
+        for example, outputs in zip(tqdm(self.examples, desc="Processing features for TC",
+                                         disable=not self.progress_bar), all_outputs):
             is_overflow = False
             # argument position 
             try:
@@ -291,3 +309,161 @@ class EAETCProcessor(EAEDataProcessor):
                 if is_overflow:
                     features.labels = -100
             self.input_features.append(features)
+
+
+class EAETCSpanProcessor(EAETCProcessor):
+    """Data processor for span classification for event argument extraction.
+
+    Data processor for token classification for event argument extraction, in which the candidate arguments of a
+    trigger are classified at once by `ModelForSpanClassification`. The examples are those of `EAETCProcessor`, one per
+    candidate argument, but the consecutive examples of a trigger are converted into a single feature: the text with
+    the trigger marked is tokenized once, and the features hold the token positions and labels of all its candidates.
+    The text is thus encoded once per trigger instead of once per candidate, while the model still predicts each
+    example, in the order of the examples. The token positions of the candidates are found with the offsets of a fast
+    tokenizer.
+    """
+    input_names = ["input_ids", "attention_mask", "token_type_ids", "trigger_left", "trigger_right", "argument_left",
+                   "argument_right", "labels"]
+    # the fields holding a value for each candidate argument of a feature
+    span_names = ["argument_left", "argument_right", "labels"]
+
+    def __init__(self,
+                 config,
+                 tokenizer: str,
+                 input_file: str,
+                 pred_file: str,
+                 is_training: Optional[bool] = False):
+        """Constructs a `EAETCSpanProcessor`."""
+        # the token ids of the markers, looked up once rather than for each trigger
+        self.marker_ids = {type: tokenizer.convert_tokens_to_ids(markers) for type, markers in config.markers.items()}
+        super().__init__(config, tokenizer, input_file, pred_file, is_training)
+
+    @property
+    def num_predictions(self) -> int:
+        """Returns the number of candidate arguments the model predicts, i.e. the number of examples."""
+        return int(self.input_features.get_lengths("argument_left").sum())
+
+    def get_pad_values(self) -> Dict[str, int]:
+        """Returns the value the sequences of each field of the features are padded with, keeping the -100 labels of
+        the overflowing candidates."""
+        pad_values = super().get_pad_values()
+        del pad_values["labels"]
+        return pad_values
+
+    def group_examples(self) -> List[List[EAEInputExample]]:
+        """Groups the consecutive examples of each trigger."""
+        groups = []
+        last_key = None
+        for example in self.examples:
+            key = (example.example_id, example.text, example.pred_type, example.trigger_left, example.trigger_right)
+            if key != last_key:
+                groups.append([])
+                last_key = key
+            groups[-1].append(example)
+        return groups
+
+    @staticmethod
+    def get_marked_position(position: int,
+                            trigger_position: List[int],
+                            markers: List[str],
+                            whitespace: str) -> int:
+        """Returns the position of a character of the text in the text with the trigger marked by `insert_marker()`."""
+        marked_position = position
+        if position >= trigger_position[0]:
+            marked_position += len(markers[0] + whitespace)
+        if position >= trigger_position[1]:
+            marked_position += len(whitespace + markers[1])
+        return marked_position
+
+    @staticmethod
+    def get_token_span(outputs,
+                       left: int,
+                       right: int) -> Tuple[Optional[int], Optional[int]]:
+        """Returns the first and last token of the characters `[left, right)`, `None`s if they have been truncated."""
+        token_left, token_right = None, None
+        for i in range(left, right):
+            token_left = outputs.char_to_token(i)
+            if token_left is not None:
+                break
+        for i in range(right - 1, left - 1, -1):
+            token_right = outputs.char_to_token(i)
+            if token_right is not None:
+                break
+        return token_left, token_right
+
+    def convert_examples_to_features(self) -> None:
+        """Converts the `EAEInputExample`s of each trigger into an `EAEInputFeatures`."""
+        self.input_features = []
+        whitespace = " " if self.config.language == "English" else ""
+        groups = self.group_examples()
+        # only the trigger is marked, the argument position being out of the text
+        texts = (self.insert_marker(group[0].text,
+                                    group[0].pred_type,
+                                    [group[0].trigger_left, group[0].trigger_right],
+                                    [-1, -1],
+                                    self.config.markers,
+                                    whitespace != "") for group in groups)
+        all_outputs = tokenize_in_batches(self.tokenizer,
+                                          texts,
+                                          truncation=True,
+                                          max_length=self.config.max_seq_length)
+        for group, outputs in zip(tqdm(groups, desc="Processing features for TC",
+                                       disable=not self.progress_bar), all_outputs):
+            example = group[0]
+            markers = self.config.markers[example.pred_type]
+            marker_ids = self.marker_ids[example.pred_type]
+            # trigger position
+            try:
+                trigger_left = outputs["input_ids"].index(marker_ids[0])
+                trigger_right = outputs["input_ids"].index(marker_ids[1])
+            except ValueError:
+                trigger_left, trigger_right = 0, 0
+                logger.warning("Trigger markers are not in the input tokens.")
+            # argument positions
+            trigger_position = [example.trigger_left, example.trigger_right]
+            argument_left, argument_right, labels = [], [], []
+            for candidate in group:
+                left = self.get_marked_position(candidate.argument_left, trigger_position, markers, whitespace)
+                right = self.get_marked_position(candidate.argument_right - 1, trigger_position, markers, whitespace)
+                left, right = self.get_token_span(outputs, left, right + 1)
+                is_overflow = left is None or right is None
+                if is_overflow:
+                    left, right = 0, 0
+                    logger.warning("Argument is not in the input tokens.")
+                argument_left.append(left)
+                argument_right.append(right)
+                if candidate.labels is not None:
+                    labels.append(self.config.role2id[candidate.labels] if not is_overflow else -100)
+            # Roberta tokenizer doesn't return token_type_ids
+            if "token_type_ids" not in outputs:
+                outputs["token_type_ids"] = [0] * len(outputs["input_ids"])
+
+            features = EAEInputFeatures(
+                example_id=example.example_id,
+                input_ids=outputs["input_ids"],
+                attention_mask=outputs["attention_mask"],
+                token_type_ids=outputs["token_type_ids"],
+                trigger_left=trigger_left,
+                trigger_right=trigger_right,
+                argument_left=argument_left,
+                argument_right=argument_right,
+            )
+            if example.labels is not None:
+                features.labels = labels
+            self.input_features.append(features)
+
+    def collate_fn(self, batch, training: bool = False) -> Dict[str, torch.Tensor]:
+        """Collates the samples in batches, padding the sequences and concatenating the candidate arguments.
+
+        The sequences are padded as `EAEDataProcessor.collate_fn()` does. The candidate arguments of the batch are
+        concatenated in the order of the examples, and `span_index` gives the index in the batch of the feature of
+        each of them.
+        """
+        output_batch = super().collate_fn([{key: value for key, value in x.items() if key not in self.span_names}
+                                           for x in batch], training)
+        num_spans = torch.tensor([len(x["argument_left"]) for x in batch])
+        output_batch["span_index"] = torch.repeat_interleave(torch.arange(len(batch)), num_spans)
+        for key in self.span_names:
+            if key in batch[0]:
+                output_batch[key] = torch.cat([x[key] for x in batch]).to(torch.long)
+        return output_batch
@@ -4,19 +4,14 @@
 # Licensed under the MIT License.
 
 from typing import List, Dict
-import os
 import re 
-import sys 
-sys.path.append("../")
-import pdb
-
-# debug = True if 'DEBUG' in os.environ else False
-# debug_step = True if 'DEBUG_STEP' in os.environ else False
-debug = False
-debug_step = False 
+import torch
+import logging
 
 from ..input_engineering.seq2seq_processor import type_start, type_end
 
+logger = logging.getLogger(__name__)
+
 
 def get_label_name_tree(label_name_list, tokenizer, end_symbol='<end>'):
     sub_token_tree = dict()
@@ -38,19 +33,44 @@ def get_label_name_tree(label_name_list, tokenizer, end_symbol='<end>'):
     return sub_token_tree
 
 
-def match_sublist(the_list, to_match):
-    """
-    :param the_list: [1, 2, 3, 4, 5, 6, 1, 2, 4, 5]
-    :param to_match: [1, 2]
-    :return:
-        [(0, 1), (6, 7)]
+class SourceIndex:
+    """Position index of a source sentence for extending generated spans with source tokens.
+
+    Maps each token to its positions once, and caches the end positions of every span looked up, so extending a span
+    by one token only checks the successors of its previous matches instead of sliding over the whole sentence.
     """
-    len_to_match = len(to_match)
-    matched_list = list()
-    for index in range(len(the_list) - len_to_match + 1):
-        if to_match == the_list[index:index + len_to_match]:
-            matched_list += [(index, index + len_to_match - 1)]
-    return matched_list
+    def __init__(self, src_sequence):
+        self.src_sequence = src_sequence
+        self.positions = dict()
+        for index, token in enumerate(src_sequence):
+            self.positions.setdefault(token, []).append(index)
+        self.matches = dict()
+
+    def match(self, to_match):
+        """
+        :param to_match: [1, 2] for the source [1, 2, 3, 4, 5, 6, 1, 2, 4, 5]
+        :return:
+            end positions of the matches, [1, 7]
+        """
+        to_match = tuple(to_match)
+        length = len(to_match)
+        while length > 1 and to_match[:length] not in self.matches:
+            length -= 1
+        if to_match[:length] not in self.matches:
+            self.matches[to_match[:1]] = self.positions.get(to_match[0], [])
+        ends = self.matches[to_match[:length]]
+        for index in range(length, len(to_match)):
+            token = to_match[index]
+            ends = [end + 1 for end in ends
+                    if end + 1 < len(self.src_sequence) and self.src_sequence[end + 1] == token]
+            self.matches[to_match[:index + 1]] = ends
+        return ends
+
+    def get_next_tokens(self, generated):
+        """Returns the source tokens that follow each match of `generated`, or the whole source if it is empty."""
+        if len(generated) == 0:
+            return self.src_sequence
+        return [self.src_sequence[end + 1] for end in self.match(generated) if end + 1 < len(self.src_sequence)]
 
 
 def find_bracket_position(generated_text, _type_start, _type_end):
@@ -61,20 +81,15 @@ def find_bracket_position(generated_text, _type_start, _type_end):
     return bracket_position
 
 
-def generated_search_src_sequence(generated, src_sequence, end_sequence_search_tokens=None):
-    # print(generated, src_sequence) if debug else None
-
+def generated_search_src_sequence(generated, src_sequence, end_sequence_search_tokens=None, src_index=None):
     if len(generated) == 0:
         # It has not been generated yet. All SRC are valid.
         return src_sequence
 
-    matched_tuples = match_sublist(the_list=src_sequence, to_match=generated)
+    if src_index is None:
+        src_index = SourceIndex(src_sequence)
 
-    valid_token = list()
-    for _, end in matched_tuples:
-        next_index = end + 1
-        if next_index < len(src_sequence):
-            valid_token += [src_sequence[next_index]]
+    valid_token = src_index.get_next_tokens(generated)
 
     if end_sequence_search_tokens:
         valid_token += end_sequence_search_tokens
@@ -83,48 +98,82 @@ def generated_search_src_sequence(generated, src_sequence, end_sequence_search_t
 
 
 def get_constraint_decoder(tokenizer, type_schema, source_prefix=None):
+    """Returns a `StruConstraintDecoder` for `type_schema`, or a `MultiSchemaConstraintDecoder` if `type_schema` maps
+    schema markers (e.g. `<ace>`) to the type schema of each, in which case `source_prefix` is ignored."""
+    if "role_list" not in type_schema:
+        return MultiSchemaConstraintDecoder.from_type_schemas(tokenizer, type_schema)
     return StruConstraintDecoder(tokenizer=tokenizer, type_schema=type_schema, source_prefix=source_prefix)
 
 
 class ConstraintDecoder:
-    def __init__(self, tokenizer, source_prefix):
+    def __init__(self, tokenizer, source_prefix, source_prefix_tokenized=None):
+        """`source_prefix_tokenized` gives the tokens of `source_prefix` when the sources are not tokenized as
+        `tokenizer.encode(source_prefix)`, e.g. when the prefix is a word of inputs split into words."""
         self.tokenizer = tokenizer
         self.source_prefix = source_prefix
-        self.source_prefix_tokenized = tokenizer.encode(source_prefix,
-                                                        add_special_tokens=False) if source_prefix else []
+        if source_prefix_tokenized is None:
+            source_prefix_tokenized = tokenizer.encode(source_prefix,
+                                                       add_special_tokens=False) if source_prefix else []
+        self.source_prefix_tokenized = list(source_prefix_tokenized)
 
     def get_state_valid_tokens(self, src_sentence: List[str], tgt_generated: List[str]) -> List[str]:
         pass
 
+    def prepare_src_sentence(self, src_sentence):
+        """Strips the source prefix and everything from the first eos token on."""
+        if self.source_prefix_tokenized:
+            src_sentence = src_sentence[len(self.source_prefix_tokenized):]
+        src_sentence = src_sentence.tolist()
+        if self.tokenizer.eos_token_id in src_sentence:
+            src_sentence = src_sentence[:src_sentence.index(self.tokenizer.eos_token_id)]
+        return src_sentence
+
     def constraint_decoding(self, batch_id, src_sentence, tgt_generated):
         if self.source_prefix_tokenized:
             # Remove Source Prefix for Generation
             src_sentence = src_sentence[len(self.source_prefix_tokenized):]
 
-        if debug:
-            # if batch_id == 4:
-            print("Src:", self.tokenizer.convert_ids_to_tokens(src_sentence))
-            print("Tgt:", self.tokenizer.convert_ids_to_tokens(tgt_generated))
-            print(batch_id, len(tgt_generated), tgt_generated)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Src: %s", self.tokenizer.convert_ids_to_tokens(src_sentence))
+            logger.debug("Tgt: %s", self.tokenizer.convert_ids_to_tokens(tgt_generated))
 
         valid_token_ids = self.get_state_valid_tokens(
             src_sentence.tolist(),
             tgt_generated.tolist()
         )
-        # pdb.set_trace()
+        return valid_token_ids
 
-        # if debug:
-        #     print('========================================')
-        #     print('valid tokens:', self.tokenizer.convert_ids_to_tokens(
-        #         valid_token_ids), valid_token_ids)
-        #     if debug_step:
-        #         input()
 
-        # return self.tokenizer.convert_tokens_to_ids(valid_tokens)
-        return valid_token_ids
+class StruDecodingState:
+    """Decoding state of one hypothesis for `StruConstraintDecoder`, advanced by one token at a time.
+
+    `last_special_token` is the last `type_start` or `type_end` generated, `tree` the node of the label-name tree
+    reached by the tokens since the last `type_start`, `span` holds the tokens generated after a complete label name,
+    and `broken` marks a label that left the tree. Generation runs the vectorized `StruConstraintLogitsProcessor`,
+    which holds the same state in tensors for all the hypotheses; this scalar one is its reference.
+    """
+    __slots__ = ["last_token", "last_special_token", "tree", "span", "broken"]
+
+    def __init__(self):
+        self.last_token = None
+        self.last_special_token = None
+        self.tree = None
+        self.span = None
+        self.broken = False
+
+    def copy(self):
+        state = StruDecodingState()
+        for name in self.__slots__:
+            setattr(state, name, getattr(self, name))
+        return state
 
 
 class StruConstraintDecoder(ConstraintDecoder):
+    """Constrains the generation to the flat records of the targets of `EDSeq2SeqProcessor` and
+    `EAESeq2SeqProcessor`, i.e. `type_start label: span type_end` records one after the other, then eos.
+
+    The labels are those of `type_schema["role_list"]`, and the spans are copied from the source.
+    """
     def __init__(self, tokenizer, type_schema, *args, **kwargs):
         super().__init__(tokenizer, *args, **kwargs)
         self.tree_end = '<tree-end>'
@@ -133,132 +182,175 @@ class StruConstraintDecoder(ConstraintDecoder):
                                              end_symbol=self.tree_end)
         self.type_start = self.tokenizer.convert_tokens_to_ids([type_start])[0]
         self.type_end = self.tokenizer.convert_tokens_to_ids([type_end])[0]
+        # compiled label-name trees of the vectorized grammar, per device
+        self.compiled_trees = dict()
+
+    def init_state(self):
+        return StruDecodingState()
+
+    def advance_state(self, state, token):
+        """Returns the state after generating `token` from `state`, which is left unchanged."""
+        state = state.copy()
+        state.last_token = token
+        if token == self.type_start or token == self.type_end:
+            state.last_special_token = token
+            state.tree = self.type_tree if token == self.type_start else None
+            state.span = None
+            state.broken = False
+        elif state.span is not None:
+            state.span = state.span + [token]
+        elif state.tree is not None and not state.broken:
+            if token not in state.tree:
+                state.broken = True
+            else:
+                state.tree = state.tree[token]
+                if self.tree_end in state.tree:
+                    # the label name is complete, the following tokens are the text span
+                    state.span = []
+        return state
+
+    def check_state(self, state):
+        if state.last_token == self.tokenizer.pad_token_id:
+            return 'start'
+        if state.last_special_token == self.type_start:
+            return 'generate_record'
+        if state.last_special_token == self.type_end:
+            return 'end_record'
+        return 'error'
+
+    def get_valid_tokens(self, state, src_index, tgt_generated=None):
+        """
+        :param state: decoding state after the generated tokens
+        :param src_index: `SourceIndex` of the source tokens without source prefix and eos
+        :param tgt_generated: generated tokens, only used for logging
+        :return:
+            List[int], valid token list
+        """
+        state_name = self.check_state(state)
 
-    def check_state(self, tgt_generated):
-        if tgt_generated[-1] == self.tokenizer.pad_token_id:
-            return 'start', -1
+        logger.debug("State: %s", state_name)
 
-        special_token_set = {self.type_start, self.type_end}
-        special_index_token = list(
-            filter(lambda x: x[1] in special_token_set, list(enumerate(tgt_generated))))
+        if state_name == 'error':
+            logger.warning("Invalid generated sequence %s for source %s.", tgt_generated, src_index.src_sequence)
+            valid_tokens = [self.tokenizer.eos_token_id]
 
-        last_special_index, last_special_token = special_index_token[-1]
+        elif state_name in ['start', 'end_record']:
+            # another record, unless there is no span to copy, or the end
+            valid_tokens = [self.type_start] if len(src_index.src_sequence) != 0 else []
+            valid_tokens.append(self.tokenizer.eos_token_id)
 
-        if len(special_index_token) == 1:
-            if last_special_token != self.type_start:
-                return 'error', 0
+        elif state_name == 'generate_record':
 
-        bracket_position = find_bracket_position(
-            tgt_generated, _type_start=self.type_start, _type_end=self.type_end)
-        start_number, end_number = len(bracket_position[self.type_start]), len(
-            bracket_position[self.type_end])
+            if state.last_token == self.type_start:
+                # Start Event Label
+                return list(self.type_tree.keys())
 
-        if start_number == end_number:
-            return 'end_generate', -1
-        if start_number == end_number + 1:
-            state = 'start_first_generation'
-        elif start_number == end_number + 2:
-            state = 'generate_span'
-        else:
-            state = 'error'
-        return state, last_special_index
+            elif state.broken:
+                logger.warning("An unexpected token is generated due to len(valid_tokens) < num_beams.")
+                valid_tokens = [self.tokenizer.eos_token_id]
 
-    def search_prefix_tree_and_sequence(self, generated: List[str], prefix_tree: Dict, src_sentence: List[str],
-                                        end_sequence_search_tokens: List[str] = None):
-        """
-        Generate Type Name + Text Span
-        :param generated:
-        :param prefix_tree:
-        :param src_sentence:
-        :param end_sequence_search_tokens:
-        :return:
-        """
-        tree = prefix_tree
-        for index, token in enumerate(generated):
-            tree = tree[token]
-            is_tree_end = len(tree) == 1 and self.tree_end in tree
-
-            if is_tree_end:
-                valid_token = generated_search_src_sequence(
-                    generated=generated[index + 1:],
-                    src_sequence=src_sentence,
-                    end_sequence_search_tokens=end_sequence_search_tokens,
+            elif state.span is not None:
+                valid_tokens = generated_search_src_sequence(
+                    generated=state.span,
+                    src_sequence=src_index.src_sequence,
+                    end_sequence_search_tokens=[self.type_end],
+                    src_index=src_index
                 )
-                return valid_token
-
-            if self.tree_end in tree:
-                try:
-                    valid_token = generated_search_src_sequence(
-                        generated=generated[index + 1:],
-                        src_sequence=src_sentence,
-                        end_sequence_search_tokens=end_sequence_search_tokens,
-                    )
-                    return valid_token
-                except IndexError:
-                    # Still search tree
-                    continue
 
-        valid_token = list(tree.keys())
-        return valid_token
+            else:
+                valid_tokens = list(state.tree.keys())
+
+        else:
+            raise NotImplementedError(
+                'State `%s` for %s is not implemented.' % (state_name, self.__class__))
+
+        logger.debug("Valid: %s", valid_tokens)
+        return valid_tokens
 
     def get_state_valid_tokens(self, src_sentence, tgt_generated):
         """
         :param src_sentence:
         :param tgt_generated:
         :return:
-            List[str], valid token list
+            List[int], valid token list
         """
         if self.tokenizer.eos_token_id in src_sentence:
             src_sentence = src_sentence[:src_sentence.index(
                 self.tokenizer.eos_token_id)]
 
-        state, index = self.check_state(tgt_generated)
+        state = self.init_state()
+        for token in tgt_generated:
+            state = self.advance_state(state, token)
+        return self.get_valid_tokens(state, SourceIndex(src_sentence), tgt_generated)
 
-        print("State: %s" % state) if debug else None
 
-        if state == 'error':
-            print("Error:")
-            print("Src:", src_sentence)
-            print("Tgt:", tgt_generated)
-            valid_tokens = [self.tokenizer.eos_token_id]
-
-        elif state == 'start':
-            valid_tokens = [self.type_start]
-
-        elif state == 'start_first_generation':
-            valid_tokens = [self.type_start, self.type_end]
+class MultiSchemaConstraintDecoder(ConstraintDecoder):
+    """Decodes sources of several schemas, each with the `StruConstraintDecoder` of its schema.
 
-        elif state == 'generate_span':
+    The schema of a source is recognized by the schema marker it starts with, which is the source prefix of the
+    decoder of that schema, so a batch mixing schemas is decoded in one `generate` call.
 
-            if tgt_generated[-1] == self.type_start:
-                # Start Event Label
-                return list(self.type_tree.keys())
+    Args:
+        tokenizer: Tokenizer shared by all decoders.
+        decoders (`Dict[str, StruConstraintDecoder]`): Decoder of each schema, whose `source_prefix` is its marker.
+    """
+    def __init__(self, tokenizer, decoders):
+        super().__init__(tokenizer, None)
+        assert len(decoders) > 0
+        for schema, decoder in decoders.items():
+            assert decoder.tokenizer is tokenizer and decoder.source_prefix_tokenized, \
+                "The decoder of %s needs the tokenizer and the schema marker as source prefix." % schema
+        self.decoders = decoders
+        self.prefixes = sorted([(tuple(decoder.source_prefix_tokenized), schema)
+                                for schema, decoder in decoders.items()], key=lambda x: -len(x[0]))
+        self.type_start = self.tokenizer.convert_tokens_to_ids([type_start])[0]
+        self.type_end = self.tokenizer.convert_tokens_to_ids([type_end])[0]
+        # compiled label-name trees of the vectorized grammar, per device
+        self.compiled_trees = dict()
+
+    @classmethod
+    def from_type_schemas(cls, tokenizer, type_schemas):
+        """Builds the decoders from the type schema (`{"role_list": [...]}`) of each schema marker."""
+        return cls(tokenizer, {schema: StruConstraintDecoder(tokenizer, type_schema, source_prefix=schema)
+                               for schema, type_schema in type_schemas.items()})
+
+    def get_schema(self, src_sentence):
+        """Returns the schema whose marker `src_sentence` starts with."""
+        for prefix, schema in self.prefixes:
+            if tuple(src_sentence[:len(prefix)]) == prefix:
+                return schema
+        raise ValueError("The source does not start with the marker of any of %s." % sorted(self.decoders))
+
+    def get_decoder(self, src_sentence):
+        if isinstance(src_sentence, torch.Tensor):
+            src_sentence = src_sentence.tolist()
+        return self.decoders[self.get_schema(src_sentence)]
+
+    def prepare_src_sentence(self, src_sentence):
+        return self.get_decoder(src_sentence).prepare_src_sentence(src_sentence)
 
-            elif tgt_generated[-1] == self.type_end:
-                raise RuntimeError('Invalid %s in %s' %
-                                   (self.type_end, tgt_generated))
+    def constraint_decoding(self, batch_id, src_sentence, tgt_generated):
+        return self.get_decoder(src_sentence).constraint_decoding(batch_id, src_sentence, tgt_generated)
 
-            else:
-                try:
-                    valid_tokens = self.search_prefix_tree_and_sequence(
-                        generated=tgt_generated[index + 1:],
-                        prefix_tree=self.type_tree,
-                        src_sentence=src_sentence,
-                        end_sequence_search_tokens=[self.type_end]
-                    )
-                except:
-                    print("Warning! An unexpected token is generated due to len(valid_tokens) < num_beams.")
-                    valid_tokens = [self.tokenizer.eos_token_id]
+    def get_state_valid_tokens(self, src_sentence, tgt_generated):
+        """
+        :param src_sentence: source tokens, starting with a schema marker
+        :param tgt_generated:
+        :return:
+            List[int], valid token list
+        """
+        decoder = self.get_decoder(src_sentence)
+        return decoder.get_state_valid_tokens(src_sentence[len(decoder.source_prefix_tokenized):], tgt_generated)
 
-        elif state == 'end_generate':
-            valid_tokens = [self.tokenizer.eos_token_id]
 
-        else:
-            raise NotImplementedError(
-                'State `%s` for %s is not implemented.' % (state, self.__class__))
+class SpanSource:
+    """A source sentence preprocessed once for `SpanConstraintDecoder`: its special tokens, and the index of the
+    tokens before the first of them, which are the ones spans are copied from."""
+    __slots__ = ["special_tokens", "src_index"]
 
-        print("Valid: %s" % valid_tokens) if debug else None
-        return valid_tokens
+    def __init__(self, special_tokens, src_index):
+        self.special_tokens = special_tokens
+        self.src_index = src_index
 
 
 class SpanConstraintDecoder(ConstraintDecoder):
@@ -268,6 +360,14 @@ class SpanConstraintDecoder(ConstraintDecoder):
         self.type_tree = get_label_name_tree(type_schema["role_list"],
                                              tokenizer=self.tokenizer,
                                              end_symbol=self.tree_end)
+        # the special tokens are looked up in the vocabulary once instead of matching every token at every step
+        special_template = re.compile(r"<extra_id_\d+>")
+        vocab = self.tokenizer.convert_ids_to_tokens(list(range(len(self.tokenizer))))
+        self.special_token_ids = [i for i, token in enumerate(vocab) if special_template.match(token) is not None]
+        self.special_token_set = frozenset(self.special_token_ids)
+        self.sep_token_id = self.tokenizer.convert_tokens_to_ids("[SEP]")
+        # special-token tables of the vectorized grammar, per device
+        self.special_slots = dict()
 
     def check_state(self, tgt_generated, special_tokens_in_tgt):
         if tgt_generated[-1] == self.tokenizer.pad_token_id:
@@ -281,62 +381,63 @@ class SpanConstraintDecoder(ConstraintDecoder):
             return "generate", index 
 
     def get_special_tokens(self, sentence):
-        special_template = re.compile("<extra_id_\d+>")
-        tokens = self.tokenizer.convert_ids_to_tokens(sentence)
-        special_tokens = []
-        for token in tokens:
-            if special_template.match(token) is not None:
-                special_tokens.append(token)
-        return self.tokenizer.convert_tokens_to_ids(special_tokens) 
+        return [token for token in sentence if token in self.special_token_set]
     
     def truncate_src(self, src_sentence):
-        special_template = re.compile("<extra_id_\d+>")
-        index = len(src_sentence)
-        tokens = self.tokenizer.convert_ids_to_tokens(src_sentence)
-        for i, token in enumerate(tokens):
-            if special_template.match(token) is not None:
-                index = i
-                break 
-        return src_sentence[:index]
+        for i, token in enumerate(src_sentence):
+            if token in self.special_token_set:
+                return src_sentence[:i]
+        return src_sentence
 
-    def get_state_valid_tokens(self, src_sentence, tgt_generated):
+    def prepare_source(self, src_sentence):
+        """Preprocesses a source sentence without source prefix and eos into a `SpanSource`."""
+        return SpanSource(self.get_special_tokens(src_sentence),
+                          SourceIndex(self.truncate_src(src_sentence)))
+
+    def get_valid_tokens(self, source, tgt_generated):
         """
-        :param src_sentence:
-        :param tgt_generated:
+        :param source: `SpanSource` of the source sentence
+        :param tgt_generated: generated tokens
         :return:
-            List[str], valid token list
+            List[int], valid token list
         """
-        if self.tokenizer.eos_token_id in src_sentence:
-            src_sentence = src_sentence[:src_sentence.index(
-                self.tokenizer.eos_token_id)]
-        
-        special_tokens_in_src = self.get_special_tokens(src_sentence)
         special_tokens_in_gen = self.get_special_tokens(tgt_generated)
-
-        # truncate 
-        src_sentence = self.truncate_src(src_sentence)
-
         state, index = self.check_state(tgt_generated, special_tokens_in_gen)
 
-
-        if state == 'start':
-            valid_tokens = [special_tokens_in_src[0]]
-
-        elif state == 'generate':
+        def get_generate_valid_tokens():
             # valid_tokens = [self.type_start, self.type_end]
-            valid_special_tokens = [self.tokenizer.convert_tokens_to_ids("[SEP]")]
-            for token in special_tokens_in_src:
+            valid_special_tokens = [self.sep_token_id]
+            for token in source.special_tokens:
                 if token not in special_tokens_in_gen:
                     valid_special_tokens.append(token)
             valid_tokens = generated_search_src_sequence(
                         generated=tgt_generated[index:],
-                        src_sequence=src_sentence,
+                        src_sequence=source.src_index.src_sequence,
                         end_sequence_search_tokens=[self.tokenizer.eos_token_id],
+                        src_index=source.src_index
                     )
-            valid_tokens = valid_special_tokens + valid_tokens
+            return valid_special_tokens + valid_tokens
+
+        if state == 'start':
+            valid_tokens = [source.special_tokens[0]]
+
+        elif state == 'generate':
+            valid_tokens = get_generate_valid_tokens()
         else:
             raise NotImplementedError(
                 'State `%s` for %s is not implemented.' % (state, self.__class__))
 
-        print("Valid: %s" % valid_tokens) if debug else None
-        return valid_tokens
\ No newline at end of file
+        logger.debug("Valid: %s", valid_tokens)
+        return valid_tokens
+
+    def get_state_valid_tokens(self, src_sentence, tgt_generated):
+        """
+        :param src_sentence:
+        :param tgt_generated:
+        :return:
+            List[int], valid token list
+        """
+        if self.tokenizer.eos_token_id in src_sentence:
+            src_sentence = src_sentence[:src_sentence.index(
+                self.tokenizer.eos_token_id)]
+        return self.get_valid_tokens(self.prepare_source(src_sentence), tgt_generated)
@@ -0,0 +1,345 @@
+import torch
+
+from typing import Dict
+from transformers import LogitsProcessor
+
+from .constraint_decoding import StruConstraintDecoder, SpanConstraintDecoder, MultiSchemaConstraintDecoder
+
+
+def compile_label_name_tree(type_tree, tree_end):
+    """Flattens a label-name tree from `get_label_name_tree` into tensors.
+
+    Node 0 is the root. `tokens[n]` and `children[n]` hold the child tokens and child nodes of node `n`, padded with
+    -1 and 0, and `label_end[n]` tells whether a label name ends at node `n`.
+    """
+    nodes = [type_tree]
+    edges = []
+    for node in nodes:
+        node_edges = []
+        for token, child in node.items():
+            if token == tree_end:
+                continue
+            node_edges.append((token, len(nodes)))
+            nodes.append(child)
+        edges.append(node_edges)
+    max_children = max(1, max(len(node_edges) for node_edges in edges))
+    tokens = torch.full((len(nodes), max_children), -1, dtype=torch.long)
+    children = torch.zeros((len(nodes), max_children), dtype=torch.long)
+    for n, node_edges in enumerate(edges):
+        for k, (token, child) in enumerate(node_edges):
+            tokens[n, k] = token
+            children[n, k] = child
+    label_end = torch.tensor([tree_end in node for node in nodes], dtype=torch.bool)
+    return tokens, children, label_end
+
+
+def pad_sequences(sequences, pad_value=-1):
+    max_length = max([1] + [len(sequence) for sequence in sequences])
+    padded = torch.full((len(sequences), max_length), pad_value, dtype=torch.long)
+    for i, sequence in enumerate(sequences):
+        padded[i, :len(sequence)] = torch.tensor(sequence, dtype=torch.long)
+    return padded
+
+
+class ConstraintLogitsProcessor(LogitsProcessor):
+    """Base class of the vectorized constraint decoding grammars.
+
+    The decoding state of all `batch_size * num_beams` hypotheses is held in tensors and advanced by the last
+    generated token at each step. Beam search may reorder hypotheses between steps, so the parent of each hypothesis
+    is found by comparing its prefix with the sequences of the previous step among the beams of the same batch
+    element. The tokens allowed by the state are scattered into a `[batch_size * num_beams, vocab]` mask.
+
+    Subclasses implement `init_states`, `advance` and `get_allowed_mask`.
+    """
+    def __init__(self, decoder, input_ids, num_beams=1):
+        self.decoder = decoder
+        self.num_beams = num_beams
+        self.device = input_ids.device
+        self.src_sentences = [decoder.prepare_src_sentence(src) for src in input_ids]
+        self.prev_input_ids = None
+        self.states = None
+        # batch element of each row once rows are dropped by `select_rows`
+        self.batch_index = None
+
+    def init_states(self, num_rows) -> Dict[str, torch.Tensor]:
+        raise NotImplementedError
+
+    def advance(self, states, tokens) -> Dict[str, torch.Tensor]:
+        raise NotImplementedError
+
+    def get_allowed_mask(self, states, last_tokens, vocab_size) -> torch.Tensor:
+        raise NotImplementedError
+
+    def get_batch_index(self, num_rows):
+        if self.batch_index is not None:
+            return self.batch_index
+        return torch.arange(num_rows, device=self.device) // self.num_beams
+
+    def select_rows(self, rows):
+        """Keeps the states of the hypotheses `rows` only, so that finished rows can be dropped from a greedy batch.
+        The next call must then pass the kept rows, each extended by one token."""
+        assert self.num_beams == 1 and self.states is not None
+        self.batch_index = self.get_batch_index(self.prev_input_ids.shape[0])[rows]
+        self.states = {key: value[rows] for key, value in self.states.items()}
+        self.prev_input_ids = self.prev_input_ids[rows]
+
+    def find_parents(self, input_ids):
+        """Returns the row of the previous step each hypothesis extends, or None if they cannot all be found."""
+        prev = self.prev_input_ids
+        if prev is None or prev.shape[0] != input_ids.shape[0] or prev.shape[1] + 1 != input_ids.shape[1]:
+            return None
+        group = self.num_beams
+        prefix = input_ids[:, :-1].view(-1, group, 1, prev.shape[1])
+        same = (prefix == prev.view(-1, 1, group, prev.shape[1])).all(-1)
+        if not bool(same.any(-1).all()):
+            return None
+        parents = same.to(torch.uint8).argmax(-1)
+        return (parents + torch.arange(parents.shape[0], device=self.device)[:, None] * group).view(-1)
+
+    def __call__(self, input_ids, scores):
+        parents = self.find_parents(input_ids)
+        if parents is None:
+            states = self.init_states(input_ids.shape[0])
+            for t in range(input_ids.shape[1]):
+                states = self.advance(states, input_ids[:, t])
+        else:
+            states = self.advance({key: value[parents] for key, value in self.states.items()}, input_ids[:, -1])
+        self.states, self.prev_input_ids = states, input_ids
+        allowed = self.get_allowed_mask(states, input_ids[:, -1], scores.shape[-1])
+        return scores.masked_fill(~allowed, -float("inf"))
+
+    @staticmethod
+    def scatter_tokens(mask, tokens, condition):
+        """Sets `mask[i, tokens[i, j]]` for the rows where `condition` holds, ignoring negative tokens.
+
+        `mask` has one spare column at the end which absorbs the ignored entries.
+        """
+        dummy = mask.shape[-1] - 1
+        tokens = torch.where(condition[:, None] & (tokens >= 0), tokens, torch.full_like(tokens, dummy))
+        mask.scatter_(1, tokens, True)
+
+    @staticmethod
+    def match_next(match, src, tokens, span_length):
+        """Advances the end positions `match` of the spans by `tokens`; an empty span matches anywhere."""
+        equal = src == tokens[:, None]
+        shifted = torch.zeros_like(match)
+        shifted[:, 1:] = match[:, :-1]
+        return torch.where((span_length == 0)[:, None], equal, shifted & equal)
+
+    @staticmethod
+    def next_src_tokens(src):
+        """Returns, for each source position, the source token following it (-1 at the end)."""
+        next_tokens = torch.full_like(src, -1)
+        next_tokens[:, :-1] = src[:, 1:]
+        return next_tokens
+
+
+def concat_label_name_trees(trees):
+    """Concatenates compiled label-name trees into one, and returns it with the root node of each tree."""
+    max_children = max(tokens.shape[1] for tokens, _, _ in trees)
+    all_tokens, all_children, roots, offset = [], [], [], 0
+    for tokens, children, _ in trees:
+        padding = (0, max_children - tokens.shape[1])
+        all_tokens.append(torch.nn.functional.pad(tokens, padding, value=-1))
+        all_children.append(torch.nn.functional.pad(children + offset, padding, value=0))
+        roots.append(offset)
+        offset += tokens.shape[0]
+    return (torch.cat(all_tokens), torch.cat(all_children), torch.cat([label_end for _, _, label_end in trees]),
+            roots)
+
+
+class StruConstraintLogitsProcessor(ConstraintLogitsProcessor):
+    """Vectorized version of the `StruConstraintDecoder` grammar.
+
+    A `MultiSchemaConstraintDecoder` is supported as well: the trees of its schemas are concatenated, and each label
+    name is walked from the root of the tree of its batch element's schema.
+    """
+    def __init__(self, decoder, input_ids, num_beams=1):
+        super().__init__(decoder, input_ids, num_beams)
+        self.tree_tokens, self.tree_children, self.tree_label_end, roots = self.get_compiled_tree(decoder,
+                                                                                                  self.device)
+        if isinstance(decoder, MultiSchemaConstraintDecoder):
+            schemas = [decoder.get_schema(src.tolist()) for src in input_ids]
+            self.roots = torch.tensor([roots[schema] for schema in schemas], dtype=torch.long, device=self.device)
+        else:
+            self.roots = torch.zeros(input_ids.shape[0], dtype=torch.long, device=self.device)
+        self.src = pad_sequences(self.src_sentences).to(self.device)
+        self.src_next = self.next_src_tokens(self.src)
+
+    @staticmethod
+    def get_compiled_tree(decoder, device):
+        """Returns the compiled label-name tree of `decoder` on `device` and the root node of each schema, compiling
+        it on first use only. This is the only memoization of the grammar: the allowed tokens of every hypothesis
+        are gathered from the tree on the device at each step, and caching them per (schema, node) would need a
+        host synchronization per step."""
+        compiled_trees = decoder.compiled_trees
+        if device not in compiled_trees:
+            if isinstance(decoder, MultiSchemaConstraintDecoder):
+                schemas = list(decoder.decoders)
+                trees = [compile_label_name_tree(decoder.decoders[schema].type_tree, decoder.decoders[schema].tree_end)
+                         for schema in schemas]
+                tokens, children, label_end, roots = concat_label_name_trees(trees)
+                roots = dict(zip(schemas, roots))
+            else:
+                tokens, children, label_end = compile_label_name_tree(decoder.type_tree, decoder.tree_end)
+                roots = {None: 0}
+            compiled_trees[device] = (tokens.to(device), children.to(device), label_end.to(device), roots)
+        return compiled_trees[device]
+
+    def init_states(self, num_rows):
+        zeros = torch.zeros(num_rows, dtype=torch.long, device=self.device)
+        return {
+            "last_special_token": zeros - 1,
+            "tree_node": zeros - 1,
+            "broken": zeros.bool(),
+            "in_span": zeros.bool(),
+            "span_length": zeros,
+            "match": torch.zeros((num_rows, self.src.shape[1]), dtype=torch.bool, device=self.device)
+        }
+
+    def advance(self, states, tokens):
+        decoder = self.decoder
+        is_start = tokens == decoder.type_start
+        is_end = tokens == decoder.type_end
+        is_special = is_start | is_end
+        node = states["tree_node"]
+        # label-name walk
+        walking = ~is_special & (node >= 0) & ~states["in_span"] & ~states["broken"]
+        child_tokens = self.tree_tokens[node.clamp(min=0)]
+        found = child_tokens == tokens[:, None]
+        child = (self.tree_children[node.clamp(min=0)] * found).sum(-1)
+        found = found.any(-1)
+        entering_span = walking & found & self.tree_label_end[child]
+        # span after the label name
+        extending = states["in_span"] & ~is_special
+        batch_index = self.get_batch_index(tokens.shape[0])
+        match = self.match_next(states["match"], self.src[batch_index], tokens, states["span_length"])
+        node = torch.where(walking & found, child, node)
+        node = torch.where(is_start, self.roots[batch_index], torch.where(is_end, torch.full_like(node, -1), node))
+        return {
+            "last_special_token": torch.where(is_special, tokens, states["last_special_token"]),
+            "tree_node": node,
+            "broken": ~is_special & (states["broken"] | (walking & ~found)),
+            "in_span": ~is_special & (states["in_span"] | entering_span),
+            "span_length": torch.where(extending, states["span_length"] + 1, torch.zeros_like(tokens)),
+            "match": match & extending[:, None]
+        }
+
+    def get_allowed_mask(self, states, last_tokens, vocab_size):
+        decoder = self.decoder
+        num_rows = last_tokens.shape[0]
+        batch_index = self.get_batch_index(num_rows)
+        is_start = last_tokens == decoder.tokenizer.pad_token_id
+        in_record = ~is_start & (states["last_special_token"] == decoder.type_start)
+        is_record_end = ~is_start & (states["last_special_token"] == decoder.type_end)
+        is_error = ~is_start & ~in_record & ~is_record_end
+        is_label_start = in_record & (last_tokens == decoder.type_start)
+        is_broken = in_record & ~is_label_start & states["broken"]
+        in_span = in_record & ~is_label_start & ~states["broken"] & states["in_span"]
+        in_tree = in_record & ~is_label_start & ~states["broken"] & ~states["in_span"]
+        span_started = states["span_length"] > 0
+        # a record needs a span to copy
+        has_source = self.src[batch_index, 0] >= 0
+
+        mask = torch.zeros((num_rows, vocab_size + 1), dtype=torch.bool, device=self.device)
+        mask[:, decoder.type_start] |= (is_start | is_record_end) & has_source
+        mask[:, decoder.type_end] |= in_span & span_started
+        mask[:, decoder.tokenizer.eos_token_id] |= is_start | is_record_end | is_error | is_broken
+        node = torch.where(is_label_start, self.roots[batch_index], states["tree_node"]).clamp(min=0)
+        self.scatter_tokens(mask, self.tree_tokens[node], is_label_start | in_tree)
+        self.scatter_tokens(mask, self.src[batch_index], in_span & ~span_started)
+        next_tokens = torch.where(states["match"], self.src_next[batch_index], torch.full_like(states["match"], -1,
+                                                                                               dtype=torch.long))
+        self.scatter_tokens(mask, next_tokens, in_span & span_started)
+        return mask[:, :vocab_size]
+
+
+class SpanConstraintLogitsProcessor(ConstraintLogitsProcessor):
+    """Vectorized version of the `SpanConstraintDecoder` grammar."""
+    def __init__(self, decoder, input_ids, num_beams=1):
+        super().__init__(decoder, input_ids, num_beams)
+        src_specials, truncated_src = [], []
+        for src in self.src_sentences:
+            src_specials.append(decoder.get_special_tokens(src))
+            truncated_src.append(decoder.truncate_src(src))
+        self.src_specials = pad_sequences(src_specials).to(self.device)
+        self.src = pad_sequences(truncated_src).to(self.device)
+        self.src_next = self.next_src_tokens(self.src)
+        self.special_slot = self.get_special_slot(decoder, self.device)
+        self.src_special_slots = torch.where(self.src_specials >= 0,
+                                             self.special_slot[self.src_specials.clamp(min=0)],
+                                             torch.full_like(self.src_specials, -1))
+        self.num_specials = len(decoder.special_token_ids)
+        self.sep_token_id = decoder.sep_token_id
+
+    @staticmethod
+    def get_special_slot(decoder, device):
+        """Returns the table numbering the special tokens of `decoder` on `device`, so that each hypothesis can
+        record which ones it has generated. Other tokens are mapped to -1."""
+        special_slots = decoder.special_slots
+        if device not in special_slots:
+            special_slot = torch.full((len(decoder.tokenizer) + 1,), -1, dtype=torch.long)
+            special_slot[decoder.special_token_ids] = torch.arange(len(decoder.special_token_ids))
+            special_slots[device] = special_slot.to(device)
+        return special_slots[device]
+
+    def init_states(self, num_rows):
+        zeros = torch.zeros(num_rows, dtype=torch.long, device=self.device)
+        return {
+            # one spare column for tokens which are not special
+            "generated": torch.zeros((num_rows, self.num_specials + 1), dtype=torch.bool, device=self.device),
+            "span_length": zeros,
+            "match": torch.zeros((num_rows, self.src.shape[1]), dtype=torch.bool, device=self.device)
+        }
+
+    def advance(self, states, tokens):
+        slots = self.special_slot[tokens.clamp(max=self.special_slot.shape[0] - 1)]
+        slots = torch.where(tokens < self.special_slot.shape[0] - 1, slots, torch.full_like(slots, -1))
+        is_special = slots >= 0
+        slots = torch.where(is_special, slots, torch.full_like(slots, self.num_specials))
+        # a repeated special token continues the span from its first occurrence, which matches nothing
+        is_new_special = is_special & ~states["generated"].gather(1, slots[:, None]).squeeze(1)
+        generated = states["generated"].clone()
+        generated[torch.arange(tokens.shape[0], device=self.device), slots] = True
+        batch_index = self.get_batch_index(tokens.shape[0])
+        match = self.match_next(states["match"], self.src[batch_index], tokens, states["span_length"])
+        return {
+            "generated": generated,
+            "span_length": torch.where(is_new_special, torch.zeros_like(tokens), states["span_length"] + 1),
+            "match": match & ~is_special[:, None]
+        }
+
+    def get_allowed_mask(self, states, last_tokens, vocab_size):
+        decoder = self.decoder
+        num_rows = last_tokens.shape[0]
+        batch_index = self.get_batch_index(num_rows)
+        src_specials = self.src_specials[batch_index]
+        src_special_slots = self.src_special_slots[batch_index]
+        used = states["generated"].gather(1, src_special_slots.clamp(min=0)) & (src_special_slots >= 0)
+        is_start = last_tokens == decoder.tokenizer.pad_token_id
+        is_error = ~is_start & ~states["generated"][:, :self.num_specials].any(-1)
+        is_generate = ~is_start & ~is_error
+        span_started = states["span_length"] > 0
+
+        mask = torch.zeros((num_rows, vocab_size + 1), dtype=torch.bool, device=self.device)
+        self.scatter_tokens(mask, src_specials[:, :1], is_start)
+        # without special tokens in the source there is nothing to generate
+        mask[:, decoder.tokenizer.eos_token_id] |= (is_start & (src_specials[:, 0] < 0)) | is_error
+        mask[:, self.sep_token_id] |= is_generate
+        self.scatter_tokens(mask, torch.where(used, torch.full_like(src_specials, -1), src_specials),
+                            is_generate)
+        self.scatter_tokens(mask, self.src[batch_index], is_generate & ~span_started)
+        mask[:, decoder.tokenizer.eos_token_id] |= is_generate & span_started
+        next_tokens = torch.where(states["match"], self.src_next[batch_index], torch.full_like(states["match"], -1,
+                                                                                               dtype=torch.long))
+        self.scatter_tokens(mask, next_tokens, is_generate & span_started)
+        return mask[:, :vocab_size]
+
+
+def get_constraint_logits_processor(decoder, input_ids, num_beams=1):
+    """Returns the vectorized `LogitsProcessor` of `decoder`'s grammar for generating from `input_ids`."""
+    if isinstance(decoder, (StruConstraintDecoder, MultiSchemaConstraintDecoder)):
+        return StruConstraintLogitsProcessor(decoder, input_ids, num_beams)
+    elif isinstance(decoder, SpanConstraintDecoder):
+        return SpanConstraintLogitsProcessor(decoder, input_ids, num_beams)
+    raise ValueError("No logits processor for %s." % decoder.__class__.__name__)
@@ -5,7 +5,7 @@ import torch.nn as nn
 from typing import Dict, Optional, Union
 from transformers import BartForConditionalGeneration, MT5ForConditionalGeneration, T5ForConditionalGeneration
 
-from OmniEvent.aggregation.aggregation import get_aggregation, aggregate
+from OmniEvent.aggregation.aggregation import get_aggregation, aggregate, aggregate_spans
 from OmniEvent.head.head import get_head
 from OmniEvent.head.classification import LinearHead
 from OmniEvent.arguments import (
@@ -22,8 +22,8 @@ def get_model(model_args,
     """Returns the model proposed to be utilized for training and prediction.
 
     Returns the model proposed to be utilized for training and prediction based on the pre-defined paradigm. The
-    paradigms of training and prediction include token classification, sequence labeling, Sequence-to-Sequence
-    (Seq2Seq), and Machine Reading Comprehension (MRC).
+    paradigms of training and prediction include token classification, span classification, sequence labeling,
+    Sequence-to-Sequence (Seq2Seq), and Machine Reading Comprehension (MRC).
 
     Args:
         model_args:
@@ -36,6 +36,8 @@ def get_model(model_args,
     """
     if model_args.paradigm == "token_classification":
         return ModelForTokenClassification(model_args, backbone)
+    elif model_args.paradigm == "span_classification":
+        return ModelForSpanClassification(model_args, backbone)
     elif model_args.paradigm == "sequence_labeling":
         return ModelForSequenceLabeling(model_args, backbone)
     elif model_args.paradigm == "seq2seq":
@@ -49,6 +51,8 @@ def get_model(model_args,
 def get_model_cls(model_args):
     if model_args.paradigm == "token_classification":
         return ModelForTokenClassification
+    elif model_args.paradigm == "span_classification":
+        return ModelForSpanClassification
     elif model_args.paradigm == "sequence_labeling":
         return ModelForSequenceLabeling
     elif model_args.paradigm == "seq2seq":
@@ -143,6 +147,53 @@ class ModelForTokenClassification(BaseModel):
         return dict(loss=loss, logits=logits)
 
 
+class ModelForSpanClassification(ModelForTokenClassification):
+    """BERT model for span classification.
+
+    BERT model for span classification, i.e. token classification of all the candidate arguments of a trigger at once.
+    The model encodes each trigger-marked sequence once, aggregates the hidden states to each of its candidate spans
+    through `aggregate_spans()`, and classifies each span to its argument role, while `ModelForTokenClassification`
+    encodes the sequence again for each candidate. The modules are those of `ModelForTokenClassification`, so the
+    weights of either model can be loaded into the other.
+    """
+
+    def forward(self,
+                input_ids: torch.Tensor,
+                attention_mask: torch.Tensor,
+                span_index: torch.Tensor,
+                token_type_ids: Optional[torch.Tensor] = None,
+                trigger_left: Optional[torch.Tensor] = None,
+                trigger_right: Optional[torch.Tensor] = None,
+                argument_left: Optional[torch.Tensor] = None,
+                argument_right: Optional[torch.Tensor] = None,
+                labels: Optional[torch.Tensor] = None) -> Dict[str, torch.Tensor]:
+        """Manipulates the inputs through a backbone, aggregation, and classification module,
+           returns the predicted logits of each span and loss."""
+        # backbone encode
+        outputs = self.backbone(input_ids=input_ids,
+                                attention_mask=attention_mask,
+                                token_type_ids=token_type_ids,
+                                return_dict=True)
+        hidden_states = outputs.last_hidden_state
+        # aggregation
+        hidden_state = aggregate_spans(self.config,
+                                       self.aggregation,
+                                       hidden_states,
+                                       span_index,
+                                       trigger_left,
+                                       trigger_right,
+                                       argument_left,
+                                       argument_right)
+        # classification
+        logits = self.cls_head(hidden_state)  # [num_spans, num_labels]
+        # compute loss
+        loss = None
+        if labels is not None:
+            loss_fn = nn.CrossEntropyLoss()
+            loss = loss_fn(logits, labels)
+        return dict(loss=loss, logits=logits)
+
+
 class ModelForSequenceLabeling(BaseModel):
     """BERT model for sequence labeling.
 
@@ -13,14 +13,16 @@
 # limitations under the License.
 
 import torch 
+import inspect
 import logging
+from functools import partial
 from torch.utils.data import DataLoader
 from typing import Optional, List
 from collections import defaultdict
 
 import numpy as np
 
-from transformers import Trainer
+from transformers import Trainer, TrainerCallback
 from transformers.trainer import (
     EvalLoopOutput, 
     deepspeed_init, 
@@ -39,9 +41,22 @@ if is_torch_tpu_available():
     import torch_xla.debug.metrics as met
     import torch_xla.distributed.parallel_loader as pl
 
+from .input_engineering.sampler import LengthGroupedBatchSampler
+from .input_engineering.streaming import StreamingDataset
+
 logger = logging.getLogger(__name__)
 
 
+class SetEpochCallback(TrainerCallback):
+    """Sets the epoch of a `StreamingDataset` or `LengthGroupedBatchSampler` used for training at the beginning of each
+    epoch, so that each epoch is shuffled differently."""
+
+    def on_epoch_begin(self, args, state, control, train_dataloader=None, **kwargs):
+        for target in [getattr(train_dataloader, "dataset", None), getattr(train_dataloader, "batch_sampler", None)]:
+            if isinstance(target, (StreamingDataset, LengthGroupedBatchSampler)):
+                target.set_epoch(int(state.epoch))
+
+
 class Trainer(Trainer):
     """Trainer for event extraction.
 
@@ -52,6 +67,54 @@ class Trainer(Trainer):
     def __init__(self, *args, **kwargs):
         """Constructs a `Trainer`."""
         super().__init__(*args, **kwargs)
+        self.add_callback(SetEpochCallback())
+
+    def get_train_collator(self):
+        """Returns the data collator of the training batches.
+
+        The `collate_fn()` of the data processors pads the training batches to their longest sequences, the fixed
+        widths only being needed to concatenate predictions.
+        """
+        if "training" in inspect.signature(self.data_collator).parameters:
+            return partial(self.data_collator, training=True)
+        return self.data_collator
+
+    def get_train_dataloader(self) -> DataLoader:
+        """Returns the training dataloader.
+
+        A `StreamingDataset` splits its lines among the distributed ranks itself, so it is not wrapped in an
+        `IterableDatasetShard`, with which every rank would read and convert the whole file. With `group_by_length` or
+        `max_tokens_per_batch`, the features of a data processor are batched by a `LengthGroupedBatchSampler`, which
+        also deals the batches to the distributed ranks. The batches are collated by `get_train_collator()`.
+        """
+        if isinstance(self.train_dataset, StreamingDataset):
+            return DataLoader(self.train_dataset,
+                              batch_size=self._train_batch_size,
+                              collate_fn=self.get_train_collator(),
+                              num_workers=self.args.dataloader_num_workers,
+                              pin_memory=self.args.dataloader_pin_memory)
+        if not hasattr(self.train_dataset, "get_lengths"):
+            return super().get_train_dataloader()
+        max_tokens = getattr(self.args, "max_tokens_per_batch", None)
+        if self.args.group_by_length or max_tokens is not None:
+            batch_sampler = LengthGroupedBatchSampler(self.train_dataset.get_lengths(),
+                                                      batch_size=self._train_batch_size if max_tokens is None else None,
+                                                      max_tokens=max_tokens,
+                                                      seed=self.args.seed,
+                                                      rank=self.args.process_index,
+                                                      world_size=self.args.world_size)
+            return DataLoader(self.train_dataset,
+                              batch_sampler=batch_sampler,
+                              collate_fn=self.get_train_collator(),
+                              num_workers=self.args.dataloader_num_workers,
+                              pin_memory=self.args.dataloader_pin_memory)
+        return DataLoader(self.train_dataset,
+                          batch_size=self._train_batch_size,
+                          sampler=self._get_train_sampler(),
+                          collate_fn=self.get_train_collator(),
+                          drop_last=self.args.dataloader_drop_last,
+                          num_workers=self.args.dataloader_num_workers,
+                          pin_memory=self.args.dataloader_pin_memory)
 
     def evaluation_loop(self,
                         dataloader: DataLoader,
@@ -103,6 +166,10 @@ class Trainer(Trainer):
         self.callback_handler.eval_dataloader = dataloader
         # Do this before wrapping.
         eval_dataset = getattr(dataloader, "dataset", None)
+        # the processors classifying several candidates per feature, e.g. `EAETCSpanProcessor`, predict a variable
+        # number of rows per batch, which the gathering across processes would misalign
+        if hasattr(eval_dataset, "num_predictions") and args.world_size > 1:
+            raise ValueError(f"{type(eval_dataset).__name__} can only be evaluated in a single process.")
 
         if is_torch_tpu_available():
             dataloader = pl.ParallelLoader(dataloader, [args.device]).per_device_loader(args.device)
@@ -198,15 +265,18 @@ class Trainer(Trainer):
                 num_samples = self.num_examples(dataloader)
             else:  # both len(dataloader.dataset) and len(dataloader) fail
                 num_samples = observed_num_examples
+        # the losses are per feature, while the processors classifying several candidates per feature predict a row
+        # per candidate
+        num_predictions = getattr(eval_dataset, "num_predictions", num_samples)
 
         # Number of losses has been rounded to a multiple of batch_size and in a distributed training, the number of
         # samplers has been rounded to a multiple of batch_size, so we truncate.
         if all_losses is not None:
             all_losses = all_losses[:num_samples]
         if all_preds is not None:
-            all_preds = nested_truncate(all_preds, num_samples)
+            all_preds = nested_truncate(all_preds, num_predictions)
         if all_labels is not None:
-            all_labels = nested_truncate(all_labels, num_samples)
+            all_labels = nested_truncate(all_labels, num_predictions)
 
         # Metrics!
         if self.compute_metrics is not None and all_preds is not None and all_labels is not None:
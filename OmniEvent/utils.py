@@ -1,5 +1,6 @@
 import os 
 import json 
+import hashlib
 import requests
 import tqdm 
 
@@ -17,6 +18,20 @@ FILE_NAMES = {
 }
 
 
+def hash_file(path):
+    """Returns the sha256 of the content of a file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_json(obj):
+    """Returns the sha256 of a json-serializable object."""
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
 def download(path, base_path, url):
     req = requests.get(url, stream=True)
     file = open(path, "wb")
@@ -10,7 +10,7 @@ from collections import defaultdict
 from transformers import set_seed, EarlyStoppingCallback
 
 from OmniEvent.arguments import DataArguments, ModelArguments, TrainingArguments, ArgumentParser
-from OmniEvent.input_engineering.token_classification_processor import EAETCProcessor
+from OmniEvent.input_engineering.token_classification_processor import EAETCProcessor, EAETCSpanProcessor
 
 from OmniEvent.model.model import get_model
 from OmniEvent.backbone.backbone import get_backbone
@@ -82,7 +82,8 @@ backbone, tokenizer, config = get_backbone(model_args.model_type, model_args.mod
                                            new_tokens=insert_markers)
 model = get_model(model_args, backbone)
 model.cuda()
-data_class = EAETCProcessor
+# the span classification encodes each trigger once for all its candidate arguments
+data_class = EAETCSpanProcessor if model_args.paradigm == "span_classification" else EAETCProcessor
 metric_fn = compute_F1
 
 # dataset 
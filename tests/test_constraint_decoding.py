@@ -0,0 +1,215 @@
+import os
+import json
+import random
+import tempfile
+import unittest
+import sys
+from unittest import mock
+sys.path.append("..")
+import torch
+from types import SimpleNamespace
+from transformers.modeling_outputs import BaseModelOutput
+from OmniEvent.infer import get_tokenizer
+from OmniEvent.arguments import DataArguments
+from OmniEvent.model.constraint_decoding import StruConstraintDecoder, SpanConstraintDecoder, get_constraint_decoder
+from OmniEvent.model.constraint_logits_processor import get_constraint_logits_processor
+from OmniEvent.infer_module import constraint
+from OmniEvent.infer_module.constraint import register_schema_labels, get_schema_decoder, get_multi_schema_decoder
+from OmniEvent.infer_module.seq2seq import EDProcessor, greedy_generate
+from OmniEvent.input_engineering.seq2seq_processor import EDSeq2SeqProcessor, type_start, type_end
+
+
+class ScriptedModel(torch.nn.Module):
+    """Seq2seq model stub whose decoder prefers the next token of the script of each row, then eos.
+
+    The row of each input is carried by its encoder states, and the decoding step by the cache, so that they follow
+    the rows `greedy_generate` keeps in the batch. `num_rows` records the number of rows of each decoder step.
+    """
+    def __init__(self, scripts, tokenizer):
+        super().__init__()
+        self.scripts = scripts
+        self.config = SimpleNamespace(decoder_start_token_id=tokenizer.pad_token_id, vocab_size=len(tokenizer),
+                                      eos_token_id=tokenizer.eos_token_id)
+        self.num_rows = []
+
+    def get_encoder(self):
+        def encode(input_ids, attention_mask):
+            return BaseModelOutput(last_hidden_state=torch.arange(input_ids.shape[0]).float()[:, None, None])
+        return encode
+
+    def forward(self, encoder_outputs, attention_mask, decoder_input_ids, past_key_values=None, use_cache=True):
+        rows = encoder_outputs.last_hidden_state[:, 0, 0].long()
+        steps = past_key_values[0][0] if past_key_values is not None else torch.zeros_like(rows)
+        self.num_rows.append(len(rows))
+        logits = torch.zeros((len(rows), 1, self.config.vocab_size))
+        for i, (row, step) in enumerate(zip(rows.tolist(), steps.tolist())):
+            script = self.scripts[row]
+            logits[i, 0, script[step] if step < len(script) else self.config.eos_token_id] = 1
+        return SimpleNamespace(logits=logits, past_key_values=((steps + 1,),))
+
+
+class TestConstraintDecoding(unittest.TestCase):
+
+    def setUp(self):
+        # the registered labels and the decoders are global, restore them after each test
+        for patcher in [mock.patch.dict(constraint.SCHEMA_LABELS["ED"]),
+                        mock.patch.dict(constraint.SCHEMA_LABELS["EAE"]),
+                        mock.patch.dict(constraint._decoders)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def check_logits_processor(self, decoder, texts, num_beams=2, steps=20):
+        """Compares the mask of the logits processor with `constraint_decoding()` on random beam reorders."""
+        tokenizer = decoder.tokenizer
+        input_ids = tokenizer(texts, return_tensors="pt", padding=True)["input_ids"]
+        processor = get_constraint_logits_processor(decoder, input_ids, num_beams)
+        generated = torch.full((len(texts) * num_beams, 1), tokenizer.pad_token_id)
+        for _ in range(steps):
+            scores = processor(generated, torch.zeros(generated.shape[0], len(tokenizer)))
+            next_tokens = []
+            for row, sent in enumerate(generated):
+                allowed = sorted(set(decoder.constraint_decoding(row // num_beams, input_ids[row // num_beams],
+                                                                 sent)))
+                self.assertEqual((scores[row] == 0).nonzero().view(-1).tolist(), allowed)
+                next_tokens.append(random.choice(allowed))
+            generated = torch.cat([generated, torch.tensor(next_tokens)[:, None]], dim=1)
+            reorder = [row // num_beams * num_beams + random.randrange(num_beams) for row in range(len(generated))]
+            generated = generated[reorder]
+
+    def test_stru_logits_processor(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        decoder = StruConstraintDecoder(tokenizer, {"role_list": ["attack", "attacker", "place"]}, None)
+        self.check_logits_processor(decoder, ["the attack on the place by the attacker", "troops moved"])
+
+    def test_span_logits_processor(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        decoder = SpanConstraintDecoder(tokenizer, {"role_list": ["attack"]}, None)
+        self.check_logits_processor(decoder, ["the attack <extra_id_3> on the place <extra_id_5>",
+                                              "<extra_id_1> troops moved"])
+
+    def test_select_rows(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        decoder = StruConstraintDecoder(tokenizer, {"role_list": ["attack", "attacker", "place"]}, None)
+        input_ids = tokenizer(["the attack on the place", "troops moved", "the attacker"], return_tensors="pt",
+                              padding=True)["input_ids"]
+        processor = get_constraint_logits_processor(decoder, input_ids)
+        generated = torch.full((3, 1), tokenizer.pad_token_id)
+        rows = [0, 1, 2]
+        for step in range(12):
+            scores = processor(generated, torch.zeros(generated.shape[0], len(tokenizer)))
+            next_tokens = []
+            for row, sent in zip(rows, generated):
+                allowed = sorted(set(decoder.constraint_decoding(row, input_ids[row], sent)))
+                self.assertEqual((scores[len(next_tokens)] == 0).nonzero().view(-1).tolist(), allowed)
+                next_tokens.append(random.choice(allowed))
+            generated = torch.cat([generated, torch.tensor(next_tokens)[:, None]], dim=1)
+            if step == 4:
+                # drop the first row as a greedy batch drops a finished one
+                processor.select_rows(torch.tensor([1, 2]))
+                generated, rows = generated[1:], rows[1:]
+
+    def test_multi_schema_logits_processor(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        decoder = get_constraint_decoder(tokenizer, {"<ace>": {"role_list": ["attack", "transport"]},
+                                                     "<maven>": {"role_list": ["attack", "motion", "place"]}})
+        texts = ["<maven>the attack on the place", "<ace>troops were moving", "<ace>the attack"]
+        self.assertEqual([decoder.get_schema(src) for src in tokenizer(texts)["input_ids"]],
+                         ["<maven>", "<ace>", "<ace>"])
+        self.check_logits_processor(decoder, texts)
+        with self.assertRaises(ValueError):
+            decoder.get_schema(tokenizer("<kbp>troops")["input_ids"])
+
+    def test_multi_schema_processor_inputs(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        register_schema_labels("ace", ["attack", "transport"], task="ED")
+        register_schema_labels("duee", ["出售", "攻击"], task="ED")
+        texts, schemas = ["troops were moving", "军队发动攻击"], ["<ace>", "<duee>"]
+        decoder = get_multi_schema_decoder(tokenizer, schemas, task="ED")
+        input_ids = EDProcessor(tokenizer, device="cpu").tokenize(texts, schemas)["input_ids"]
+        self.assertEqual([decoder.get_schema(src.tolist()) for src in input_ids], schemas)
+        # the marker is stripped from the source the spans are copied from
+        self.assertEqual(decoder.prepare_src_sentence(input_ids[1]),
+                         tokenizer(list(texts[1]), is_split_into_words=True, add_special_tokens=False)["input_ids"])
+        processor = get_constraint_logits_processor(decoder, input_ids)
+        scores = processor(torch.full((2, 1), tokenizer.pad_token_id), torch.zeros(2, len(tokenizer)))
+        self.assertTrue(bool((scores == 0).any(-1).all()))
+
+    def get_processor_features(self, tokenizer):
+        """Returns the features of an ED example with two events, whose target holds two records."""
+        item = {"id": "0", "text": "a massive aerial assault pounded Baghdad killing three soldiers", "source": "<ace>",
+                "events": [{"type": "Attack", "triggers": [{"trigger_word": "assault", "position": [17, 24]}]},
+                           {"type": "Die", "triggers": [{"trigger_word": "killing", "position": [41, 48]}]}]}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_file = os.path.join(tmp_dir, "test.jsonl")
+            with open(input_file, "w") as f:
+                f.write(json.dumps(item) + "\n")
+            return EDSeq2SeqProcessor(DataArguments(max_seq_length=64, max_out_length=64), tokenizer, input_file)[0]
+
+    def test_processor_target(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        register_schema_labels("ace", ["attack", "die", "transport"], task="ED")
+        decoder = get_schema_decoder(tokenizer, "ace", task="ED")
+        features = self.get_processor_features(tokenizer)
+        input_ids, target = features["input_ids"][None], features["labels"].tolist()
+        start, end = tokenizer.convert_tokens_to_ids([type_start, type_end])
+        self.assertEqual(target.count(start), 2)
+        # the whole target of the processor, two flat records and eos, is allowed by both grammars
+        processor = get_constraint_logits_processor(decoder, input_ids)
+        generated = [tokenizer.pad_token_id]
+        for token in target:
+            allowed = decoder.constraint_decoding(0, input_ids[0], torch.tensor(generated))
+            scores = processor(torch.tensor([generated]), torch.zeros(1, len(tokenizer)))
+            self.assertEqual((scores[0] == 0).nonzero().view(-1).tolist(), sorted(set(allowed)))
+            self.assertIn(token, allowed)
+            if generated[-1] in [tokenizer.pad_token_id, end]:
+                # a record ends with the sequence or is followed by another one
+                self.assertEqual(sorted(allowed), sorted([start, tokenizer.eos_token_id]))
+            elif generated[-1] == start:
+                # a label follows the start of a record
+                self.assertNotIn(start, allowed)
+                self.assertNotIn(end, allowed)
+            generated.append(token)
+        self.assertEqual(generated[-1], tokenizer.eos_token_id)
+
+    def test_greedy_generate(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        register_schema_labels("ace", ["attack", "die", "transport"], task="ED")
+        decoder = get_schema_decoder(tokenizer, "ace", task="ED")
+        features = self.get_processor_features(tokenizer)
+        target = features["labels"].tolist()
+        end = tokenizer.convert_tokens_to_ids(type_end)
+        first_record = target[:target.index(end) + 1]
+        # the second row would go on with a source word after its first record, which the grammar does not allow
+        source_word = features["input_ids"][-2].item()
+        scripts = [target, first_record + [source_word] * 3, target]
+        inputs = {"input_ids": features["input_ids"][None].repeat(3, 1),
+                  "attention_mask": features["attention_mask"][None].repeat(3, 1)}
+        model = ScriptedModel(scripts, tokenizer)
+        logits_processor = get_constraint_logits_processor(decoder, inputs["input_ids"])
+        outputs = greedy_generate(model, tokenizer, inputs, max_length=64, logits_processor=logits_processor)
+        pad = [tokenizer.pad_token_id]
+        # the rows end with the eos after their last record, not at the end of the first one
+        self.assertEqual(outputs[0], pad + target)
+        self.assertEqual(outputs[1], pad + first_record + [tokenizer.eos_token_id])
+        self.assertEqual(outputs[2], pad + target)
+        # the second row is dropped from the batch once it has ended
+        self.assertEqual(model.num_rows[len(first_record) + 1], 2)
+        # without constraints the second row keeps generating its script
+        outputs = greedy_generate(ScriptedModel(scripts, tokenizer), tokenizer, inputs, max_length=64)
+        self.assertEqual(outputs[1], pad + scripts[1] + [tokenizer.eos_token_id])
+
+    def test_schema_decoder(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        register_schema_labels("ace", ["attack", "transport", "NA"], task="ED")
+        decoder = get_schema_decoder(tokenizer, "<ace>", task="ED")
+        self.assertIs(decoder, get_schema_decoder(tokenizer, "ace", task="ED"))
+        self.check_logits_processor(decoder, ["<ace>troops were moving", "<ace>the attack"])
+        self.assertEqual(len(decoder.compiled_trees), 1)
+        register_schema_labels("ace", ["attack"], task="ED")
+        self.assertIsNot(decoder, get_schema_decoder(tokenizer, "ace", task="ED"))
+        with self.assertRaises(ValueError):
+            get_schema_decoder(tokenizer, "kbp", task="EAE")
+
+
+if __name__ == "__main__":
+    unittest.main()
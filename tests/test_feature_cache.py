@@ -0,0 +1,69 @@
+import os
+import json
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+import torch
+from OmniEvent.infer import get_tokenizer
+from OmniEvent.arguments import DataArguments
+from OmniEvent.input_engineering.feature_store import FeatureStore, ShardedFeatures
+from OmniEvent.input_engineering.seq2seq_processor import EDSeq2SeqProcessor
+
+
+class TestFeatureCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmp_dir.name, "test.jsonl")
+        items = [{"id": "a", "text": "a massive aerial assault pounded Baghdad", "source": "<ace>",
+                  "events": [{"type": "Attack", "triggers": [{"trigger_word": "assault", "position": [17, 24]}]}]},
+                 {"id": "b", "text": "troops were moving", "source": "<ace>", "events": []}]
+        with open(self.input_file, "w") as f:
+            for item in items:
+                f.write(json.dumps(item) + "\n")
+        self.tokenizer = get_tokenizer("s2s-mt5-ed")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_processor(self, feature_cache_dir, max_seq_length=32, preprocessing_num_workers=None, dataset_name=None):
+        config = DataArguments(max_seq_length=max_seq_length, max_out_length=16, feature_cache_dir=feature_cache_dir,
+                               preprocessing_num_workers=preprocessing_num_workers, dataset_name=dataset_name)
+        return EDSeq2SeqProcessor(config, self.tokenizer, self.input_file)
+
+    def assert_same_features(self, processor, expected):
+        self.assertEqual(len(processor), len(expected))
+        self.assertEqual(processor.get_ids(), expected.get_ids())
+        for i in range(len(expected)):
+            for key, value in expected[i].items():
+                self.assertTrue(torch.equal(processor[i][key], value))
+
+    def test_feature_cache(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        expected = self.get_processor(None)
+        self.get_processor(cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        cached = self.get_processor(cache_dir)
+        self.assertIsInstance(cached.input_features, FeatureStore)
+        self.assert_same_features(cached, expected)
+        # a different configuration gets its own entry
+        self.get_processor(cache_dir, max_seq_length=16)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+        # e.g. the MRC questions are translated for ACE2005-ZH
+        self.get_processor(cache_dir, dataset_name="ACE2005-ZH")
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+    def test_sharded_conversion(self):
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        expected = self.get_processor(None)
+        self.assert_same_features(self.get_processor(None, preprocessing_num_workers=2), expected)
+        # the workers write the shards to the cache, which are then loaded on a hit
+        for _ in range(2):
+            processor = self.get_processor(cache_dir, preprocessing_num_workers=2)
+            self.assertIsInstance(processor.input_features, ShardedFeatures)
+            self.assert_same_features(processor, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import sys
+sys.path.append("..")
+import torch
+from OmniEvent.input_engineering.base_processor import EAEInputFeatures
+from OmniEvent.input_engineering.feature_store import FeatureStore, pad_and_stack
+
+
+class TestFeatureStore(unittest.TestCase):
+
+    def test_feature_store(self):
+        input_features = [EAEInputFeatures("a", [5, 6, 7, 0], [1, 1, 1, 0], labels=[3, -100, -100, -100]),
+                          EAEInputFeatures("b", [300, 0, 0, 0], [1, 0, 0, 0], argument_left=2, labels=[1, 2, 3, 4])]
+        store = FeatureStore.from_features(EAEInputFeatures, input_features,
+                                           {"input_ids": 0, "attention_mask": 0, "labels": -100})
+        self.assertEqual(store.get_lengths("input_ids").tolist(), [3, 1])
+        self.assertEqual(store[1].example_id, "b")
+        self.assertEqual(store[1].argument_left, 2)
+        self.assertIsNone(store[0].token_type_ids)
+        tensors = store.get_tensors(0, ["input_ids", "token_type_ids", "labels"])
+        self.assertEqual(list(tensors), ["input_ids", "labels"])
+        self.assertEqual(tensors["input_ids"].tolist(), [5, 6, 7])
+        self.assertEqual(tensors["labels"].tolist(), [3])
+        # the rows are views of the columns
+        self.assertEqual(tensors["input_ids"].data_ptr(), store.get_tensor("input_ids", 0).data_ptr())
+        batch = pad_and_stack([store.get_tensor("labels", i) for i in range(2)], -100, torch.long, 4)
+        self.assertEqual(batch.tolist(), [features.labels for features in input_features])
+
+
+if __name__ == "__main__":
+    unittest.main()
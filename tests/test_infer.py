@@ -1,8 +1,12 @@
+import io
 import json 
 import unittest
 import sys 
 sys.path.append("..")
-from OmniEvent.infer import infer
+from OmniEvent.infer import infer, infer_batch
+from OmniEvent.infer_module.seq2seq import get_length_buckets, get_ed_result, get_eae_result, prepare_for_eae_from_pred
+from OmniEvent.infer_module.stream import read_lines, read_batches
+from OmniEvent.infer_module.pipeline import run_pipeline
 
 class TestInfer(unittest.TestCase):
 
@@ -16,6 +20,83 @@ class TestInfer(unittest.TestCase):
         self.assertEqual(result[1]["trigger"], "pounded")
         self.assertEqual(result[1]["type"], "injure")
 
+    def test_seq2seq_batch(self):
+        input_texts = [
+            "U.S. and British troops were moving on the strategic southern port city of Basra Saturday after a massive aerial assault pounded Baghdad at dawn",
+            "Nothing happened.",
+            "U.S. and British troops were moving on the strategic southern port city of Basra Saturday after a massive aerial assault pounded Baghdad at dawn"
+        ]
+        results = infer_batch(input_texts, schemas="ace", task="EE", batch_size=2)
+        self.assertEqual(len(results), len(input_texts))
+        for text, result in zip(input_texts, results):
+            self.assertEqual(result["text"], text)
+        self.assertEqual(results[0]["events"], results[2]["events"])
+
+    def test_seq2seq_bucketed_batch(self):
+        input_texts = [
+            "U.S. and British troops were moving on the strategic southern port city of Basra Saturday after a massive aerial assault pounded Baghdad at dawn",
+            "Nothing happened."
+        ]
+        results = infer_batch(input_texts, schemas="ace", task="EE", max_tokens=64)
+        self.assertEqual([result["text"] for result in results], input_texts)
+        self.assertEqual(results, infer_batch(input_texts, schemas="ace", task="EE", batch_size=1))
+
+    def test_length_buckets(self):
+        self.assertEqual(get_length_buckets([5, 9, 2, 9, 4], max_tokens=18), [[1, 3], [0, 4, 2]])
+        self.assertEqual(get_length_buckets([30, 4], max_tokens=8), [[0], [1]])
+        self.assertEqual(get_length_buckets([5, 9]), [[0, 1]])
+
+    def test_seq2seq_pipeline(self):
+        input_texts = [
+            "U.S. and British troops were moving on the strategic southern port city of Basra Saturday after a massive aerial assault pounded Baghdad at dawn",
+            "Nothing happened.",
+            "A massive aerial assault pounded Baghdad at dawn"
+        ]
+        results = infer_batch(input_texts, schemas="ace", task="EE", batch_size=1, pipeline=True)
+        self.assertEqual(results, infer_batch(input_texts, schemas="ace", task="EE", batch_size=1))
+
+    def test_alignment(self):
+        text = "the attack on Baghdad followed an attack near Baghdad by British troops"
+        triggers = [(0, "attack", "attack"), (0, "attack", "attack"), (1, "attack", "attack")]
+        results = get_ed_result([text, "nothing"], triggers)
+        self.assertEqual([event["offset"] for event in results[0]["events"]], [[4, 10], [34, 40]])
+        self.assertEqual(results[1]["events"], [])
+        instances = prepare_for_eae_from_pred([text], triggers[:2], ["<ace>"])
+        results = get_eae_result(instances, [[(0, "place", "Baghdad")], [(1, "place", "Baghdad"), (1, "attacker", "Britishtroops")]])
+        arguments = [event["arguments"] for event in results[0]["events"]]
+        self.assertEqual(arguments[0][0]["offset"], [14, 21])
+        self.assertEqual(arguments[1][0]["offset"], [46, 53])
+        self.assertEqual(arguments[1][1]["mention"], "British troops")
+
+    def test_run_pipeline(self):
+        outputs = run_pipeline(range(10), [lambda x: x + 1, lambda x: x * 2])
+        self.assertEqual(list(outputs), [(x + 1) * 2 for x in range(10)])
+        def fail(x):
+            if x == 3:
+                raise KeyError(x)
+            return x
+        with self.assertRaises(KeyError):
+            list(run_pipeline(range(10), [fail]))
+
+
+class TestStream(unittest.TestCase):
+
+    def test_read_batches(self):
+        data = b'{"id": 1, "text": "a"}\n\nbroken\n{"id": 2, "text": "b"}\n{"text": "c"}\n'
+        batches = list(read_batches(read_lines(io.BytesIO(data)), "jsonl", "ace", batch_size=2))
+        self.assertEqual([[doc["text"] for doc in docs] for docs, _ in batches], [["a", "b"], ["c"]])
+        self.assertEqual(batches[-1][1], len(data))
+        # resuming from the offset of the first batch yields the rest
+        resumed = list(read_batches(read_lines(io.BytesIO(data), batches[0][1]), "jsonl", "ace", batch_size=2))
+        self.assertEqual([[doc["text"] for doc in docs] for docs, _ in resumed], [["c"]])
+
+    def test_read_batches_unsupported_schema(self):
+        data = b'{"text": "a"}\n{"text": "b", "schema": "unknown"}\n{"text": 1}\n{"text": "c", "schema": "duee"}\n'
+        batches = list(read_batches(read_lines(io.BytesIO(data)), "jsonl", "ace", batch_size=3))
+        self.assertEqual([[(doc["text"], doc["schema"]) for doc in docs] for docs, _ in batches],
+                         [[("a", "ace"), ("c", "duee")]])
+        self.assertEqual(batches[-1][1], len(data))
+
 
 if __name__ == "__main__":
     unittest.main()
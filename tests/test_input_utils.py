@@ -0,0 +1,23 @@
+import unittest
+import sys
+sys.path.append("..")
+from OmniEvent.infer import get_tokenizer
+from OmniEvent.input_engineering.input_utils import tokenize_in_batches
+
+
+class TestInputUtils(unittest.TestCase):
+
+    def test_tokenize_in_batches(self):
+        tokenizer = get_tokenizer("s2s-mt5-ed")
+        texts = [["troops", "were", "moving"], ["the", "attack"], [], ["a", "massive", "aerial", "assault"]] * 3
+        kwargs = dict(padding="max_length", truncation=True, max_length=6, is_split_into_words=True)
+        outputs = list(tokenize_in_batches(tokenizer, iter(texts), batch_size=5, **kwargs))
+        self.assertEqual(len(outputs), len(texts))
+        for text, batch_outputs in zip(texts, outputs):
+            single_outputs = tokenizer(text, **kwargs)
+            self.assertEqual(dict(batch_outputs), dict(single_outputs))
+            self.assertEqual(batch_outputs.word_ids(), single_outputs.word_ids())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+import torch
+from unittest import mock
+from transformers import MT5Config, MT5ForConditionalGeneration
+from OmniEvent.infer_module.quantization import get_quantized, get_quantized_path
+
+
+class TestQuantization(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = self.tmp_dir.name
+        self.config = MT5Config(vocab_size=64, d_model=16, d_kv=4, d_ff=32, num_layers=1, num_heads=2,
+                                decoder_start_token_id=0)
+        self.save_checkpoint(0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def save_checkpoint(self, seed):
+        torch.manual_seed(seed)
+        MT5ForConditionalGeneration(self.config).save_pretrained(self.path)
+
+    def assert_same_outputs(self, model, expected):
+        input_ids = torch.tensor([[1, 2, 3, 4]])
+        decoder_input_ids = torch.tensor([[0, 5]])
+        with torch.no_grad():
+            self.assertTrue(torch.equal(model(input_ids=input_ids, decoder_input_ids=decoder_input_ids).logits,
+                                        expected(input_ids=input_ids, decoder_input_ids=decoder_input_ids).logits))
+
+    def test_cache(self):
+        quantized = get_quantized(MT5ForConditionalGeneration, self.path)
+        self.assertTrue(os.path.exists(get_quantized_path(self.path)))
+        self.assert_same_outputs(get_quantized(MT5ForConditionalGeneration, self.path), quantized)
+        # the cache is not reused once the checkpoint changes
+        self.save_checkpoint(1)
+        requantized = get_quantized(MT5ForConditionalGeneration, self.path)
+        self.assert_same_outputs(get_quantized(MT5ForConditionalGeneration, self.path), requantized)
+        with self.assertRaises(AssertionError):
+            self.assert_same_outputs(requantized, quantized)
+
+    def test_read_only(self):
+        # the checkpoint directory is not writable
+        with mock.patch("tempfile.mkstemp", side_effect=PermissionError("read-only")):
+            quantized = get_quantized(MT5ForConditionalGeneration, self.path)
+        self.assertFalse(os.path.exists(get_quantized_path(self.path)))
+        self.assert_same_outputs(get_quantized(MT5ForConditionalGeneration, self.path), quantized)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import sys
+sys.path.append("..")
+import numpy as np
+from OmniEvent.input_engineering.sampler import LengthGroupedBatchSampler
+
+
+class TestSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.lengths = np.random.default_rng(0).integers(1, 100, size=1000)
+
+    def test_batch_size(self):
+        sampler = LengthGroupedBatchSampler(self.lengths, batch_size=16)
+        batches = list(sampler)
+        self.assertEqual(len(batches), len(sampler))
+        self.assertEqual(sorted(sum(batches, [])), list(range(len(self.lengths))))
+        self.assertTrue(all(len(batch) <= 16 for batch in batches))
+        # the batches are padded to fewer tokens than random batches
+        padded = sum(len(batch) * self.lengths[batch].max() for batch in batches)
+        self.assertLess(padded, 1.2 * self.lengths.sum())
+        sampler.set_epoch(1)
+        self.assertNotEqual(list(sampler), batches)
+
+    def test_max_tokens(self):
+        sampler = LengthGroupedBatchSampler(self.lengths, max_tokens=256)
+        batches = list(sampler)
+        self.assertEqual(sorted(sum(batches, [])), list(range(len(self.lengths))))
+        for batch in batches:
+            self.assertLessEqual(len(batch) * self.lengths[batch].max(), 256)
+
+    def test_stable_length(self):
+        sampler = LengthGroupedBatchSampler(self.lengths, max_tokens=256)
+        num_batches = len(sampler)
+        for epoch in range(1, 5):
+            sampler.set_epoch(epoch)
+            self.assertEqual(len(list(sampler)), num_batches)
+        # the length is the one of the first epoch even if it is asked after the epoch is set
+        sampler = LengthGroupedBatchSampler(self.lengths, max_tokens=256)
+        sampler.set_epoch(3)
+        self.assertEqual(len(sampler), num_batches)
+
+    def test_distributed(self):
+        samplers = [LengthGroupedBatchSampler(self.lengths, batch_size=7, rank=rank, world_size=3) for rank in range(3)]
+        batches = [list(sampler) for sampler in samplers]
+        self.assertEqual(len(set(len(rank_batches) for rank_batches in batches)), 1)
+        indices = sum(sum(batches, []), [])
+        self.assertEqual(set(indices), set(range(len(self.lengths))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import json
+import torch
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+from transformers import BertConfig, BertModel
+from OmniEvent.infer import get_tokenizer
+from OmniEvent.arguments import DataArguments, ModelArguments
+from OmniEvent.model.model import get_model
+from OmniEvent.input_engineering.sequence_labeling_processor import EDSLProcessor
+
+
+class TestSequenceLabeling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmp_dir.name, "train.jsonl")
+        items = [{"id": "a", "text": "a massive aerial assault pounded Baghdad",
+                  "events": [{"type": "Attack", "triggers": [{"trigger_word": "assault", "position": [17, 24]}]}]},
+                 {"id": "b", "text": "troops were moving", "events": []}]
+        with open(self.input_file, "w") as f:
+            for item in items:
+                f.write(json.dumps(item) + "\n")
+        self.tokenizer = get_tokenizer("s2s-mt5-ed")
+        self.config = DataArguments(max_seq_length=32, return_token_type_ids=True)
+        self.config.type2id = {"O": 0, "B-Attack": 1, "I-Attack": 2}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_training_collate(self):
+        processor = EDSLProcessor(self.config, self.tokenizer, self.input_file)
+        features = [processor[i] for i in range(len(processor))]
+        batch = processor.collate_fn(features, training=True)
+        # the labels and token types, stored without their trailing padding, are padded to the inputs
+        width = max(len(x["attention_mask"]) for x in features)
+        for key in ["input_ids", "attention_mask", "token_type_ids", "labels"]:
+            self.assertEqual(batch[key].shape, (len(features), width))
+        eval_batch = processor.collate_fn(features)
+        for key, value in batch.items():
+            self.assertTrue(torch.equal(value, eval_batch[key][:, :width]))
+        for head_type in ["linear", "crf"]:
+            model_args = ModelArguments(model_name_or_path="bert", model_type="bert", paradigm="sequence_labeling",
+                                        head_type=head_type, hidden_size=32, head_scale=1)
+            model_args.num_labels = len(self.config.type2id)
+            backbone = BertModel(BertConfig(vocab_size=len(self.tokenizer), hidden_size=32, num_hidden_layers=1,
+                                            num_attention_heads=2, intermediate_size=64))
+            outputs = get_model(model_args, backbone)(**batch)
+            self.assertEqual(outputs["logits"].shape[:2], (len(features), width))
+            self.assertTrue(torch.isfinite(outputs["loss"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
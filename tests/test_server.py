@@ -0,0 +1,98 @@
+import json
+import time
+import unittest
+import threading
+import urllib.error
+import urllib.request
+import sys
+sys.path.append("..")
+from unittest import mock
+from http.server import ThreadingHTTPServer
+from OmniEvent.infer_module.server import MicroBatcher, get_handler
+
+
+class FakeInfer(object):
+    """Stub of `infer_micro_batch` recording its batches and failing any batch containing the text `bad`."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, texts, schemas, all_triggers, ed_pair, eae_pair, task, bf16=False, max_tokens=None):
+        self.batches.append(list(texts))
+        if "bad" in texts:
+            raise RuntimeError("inference failed")
+        return [{"text": text, "events": []} for text in texts]
+
+
+class TestMicroBatcher(unittest.TestCase):
+
+    def get_batcher(self, **kwargs):
+        self.infer = FakeInfer()
+        patcher = mock.patch("OmniEvent.infer.infer_micro_batch", self.infer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        batcher = MicroBatcher(ed_pair=(None, None), eae_pair=(None, None), **kwargs)
+        self.addCleanup(batcher.close)
+        return batcher
+
+    def test_coalescing(self):
+        batcher = self.get_batcher(max_batch_size=3, max_wait=5)
+        texts = ["first", "second", "third"]
+        futures = [batcher.submit(text, task="ED") for text in texts]
+        results = [future.result(timeout=5) for future in futures]
+        self.assertEqual([result["text"] for result in results], texts)
+        self.assertEqual(self.infer.batches, [texts])
+
+    def test_max_wait(self):
+        batcher = self.get_batcher(max_batch_size=32, max_wait=0.05)
+        start = time.monotonic()
+        result = batcher.submit("alone", task="ED").result(timeout=5)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertEqual(result["text"], "alone")
+        self.assertEqual(self.infer.batches, [["alone"]])
+
+    def test_error_isolation(self):
+        batcher = self.get_batcher(max_batch_size=3, max_wait=5)
+        futures = [batcher.submit(text, task="ED") for text in ["first", "bad", "third"]]
+        self.assertEqual(futures[0].result(timeout=5)["text"], "first")
+        with self.assertRaises(RuntimeError):
+            futures[1].result(timeout=5)
+        self.assertEqual(futures[2].result(timeout=5)["text"], "third")
+        self.assertEqual(self.infer.batches, [["first", "bad", "third"], ["first"], ["bad"], ["third"]])
+
+    def test_invalid_requests(self):
+        batcher = self.get_batcher(max_batch_size=2, max_wait=0.05)
+        for kwargs in [dict(text=1), dict(text="a b", task="EAE"), dict(text="a b", task="EAE", triggers=["a"]),
+                       dict(text="a b", task="EAE", triggers=[["a", 0]]),
+                       dict(text="a b", task="EAE", triggers=[["a", 0, 9]]),
+                       dict(text="a b", schema="unknown")]:
+            with self.assertRaises(ValueError):
+                batcher.submit(**kwargs)
+        # the rejected requests are not queued
+        self.assertEqual(batcher.submit("a b", task="EAE", triggers=[["a", 0, 1]]).result(timeout=5)["text"], "a b")
+        self.assertEqual(self.infer.batches, [["a b"]])
+
+    def test_http(self):
+        batcher = self.get_batcher(max_batch_size=2, max_wait=0.05)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), get_handler(batcher, timeout=5))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = "http://127.0.0.1:%d/infer" % server.server_address[1]
+
+        def post(body):
+            request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"), method="POST")
+            try:
+                with urllib.request.urlopen(request, timeout=5) as response:
+                    return response.status, json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                return e.code, json.loads(e.read())
+
+        self.assertEqual(post({"text": "a b", "task": "ED"}), (200, {"text": "a b", "events": []}))
+        self.assertEqual(post({"text": ["a b"], "task": "ED"})[0], 400)
+        self.assertEqual(post({"text": "a b", "task": "EAE", "triggers": [["a", 0]]})[0], 400)
+        self.assertEqual(post({"task": "ED"})[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
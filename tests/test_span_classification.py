@@ -0,0 +1,94 @@
+import os
+import json
+import torch
+import tempfile
+import unittest
+import sys
+sys.path.append("..")
+from collections import defaultdict
+from transformers import BertConfig, BertModel
+from OmniEvent.infer import get_tokenizer
+from OmniEvent.arguments import DataArguments, ModelArguments
+from OmniEvent.model.model import get_model
+from OmniEvent.aggregation.aggregation import select_marker
+from OmniEvent.input_engineering.token_classification_processor import EAETCProcessor, EAETCSpanProcessor
+
+
+class TestSpanClassification(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmp_dir.name, "train.jsonl")
+        item = {"id": "0", "text": "a massive aerial assault pounded Baghdad killing three soldiers",
+                "events": [{"type": "Attack", "triggers": [{"id": "0-0", "position": [17, 24], "arguments": [
+                               {"role": "Place", "mentions": [{"position": [33, 40]}]}]}]},
+                           {"type": "Die", "triggers": [{"id": "0-1", "position": [41, 48], "arguments": [
+                               {"role": "Victim", "mentions": [{"position": [49, 63]}]}]}]}],
+                "negative_triggers": [],
+                "entities": [{"mentions": [{"position": [33, 40]}]},
+                             {"mentions": [{"position": [49, 63]}]},
+                             {"mentions": [{"position": [10, 16]}]}]}
+        with open(self.input_file, "w") as f:
+            for i in range(3):
+                f.write(json.dumps(item) + "\n")
+        markers = defaultdict(list)
+        for i, type in enumerate(["Attack", "Die"]):
+            markers[type] = [f"<event_{i}>", f"</event_{i}>"]
+        markers["argument"] = ["<argument>", "</argument>"]
+        self.tokenizer = get_tokenizer("s2s-mt5-ed")
+        self.tokenizer.add_tokens([m for ms in markers.values() for m in ms], special_tokens=True)
+        self.config = DataArguments(max_seq_length=64, golden_trigger=True)
+        self.config.role2id = {"NA": 0, "Place": 1, "Victim": 2}
+        self.config.markers = markers
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_processor(self):
+        pair_processor = EAETCProcessor(self.config, self.tokenizer, self.input_file, None, True)
+        processor = EAETCSpanProcessor(self.config, self.tokenizer, self.input_file, None, True)
+        # one feature per trigger, one prediction per example
+        self.assertEqual(len(processor), 6)
+        self.assertEqual(processor.num_predictions, len(pair_processor))
+        batch = processor.collate_fn([processor[i] for i in range(len(processor))])
+        pair_batch = pair_processor.collate_fn([pair_processor[i] for i in range(len(pair_processor))])
+        self.assertEqual(batch["labels"].tolist(), pair_batch["labels"].tolist())
+        for example, index, left, right in zip(processor.examples, batch["span_index"], batch["argument_left"],
+                                               batch["argument_right"]):
+            argument = self.tokenizer.decode(batch["input_ids"][index, left:right + 1])
+            self.assertEqual(argument, example.text[example.argument_left:example.argument_right])
+
+    def test_training_collate(self):
+        processor = EAETCSpanProcessor(self.config, self.tokenizer, self.input_file, None, True)
+        features = [processor[i] for i in range(len(processor))]
+        batch = processor.collate_fn(features)
+        train_batch = processor.collate_fn(features, training=True)
+        # the training batches are padded to their longest inputs rather than to max_seq_length
+        width = max(len(x["input_ids"]) for x in features)
+        self.assertEqual(batch["input_ids"].shape[1], self.config.max_seq_length)
+        self.assertEqual(train_batch["input_ids"].shape[1], width)
+        for key, value in train_batch.items():
+            self.assertTrue(torch.equal(value, batch[key][:, :width] if value.dim() == 2 else batch[key]))
+
+    def test_model(self):
+        processor = EAETCSpanProcessor(self.config, self.tokenizer, self.input_file, None, True)
+        batch = processor.collate_fn([processor[i] for i in range(len(processor))])
+        model_args = ModelArguments(model_name_or_path="bert", model_type="bert", paradigm="span_classification",
+                                    aggregation="marker", hidden_size=32, head_scale=2)
+        model_args.num_labels = 3
+        backbone = BertModel(BertConfig(vocab_size=len(self.tokenizer), hidden_size=32, num_hidden_layers=1,
+                                        num_attention_heads=2, intermediate_size=64))
+        model = get_model(model_args, backbone).eval()
+        with torch.no_grad():
+            logits = model(**batch)["logits"]
+            # the same as repeating the sequence for each span
+            hidden_states = backbone(input_ids=batch["input_ids"],
+                                     attention_mask=batch["attention_mask"]).last_hidden_state
+            expected = model.cls_head(select_marker(hidden_states[batch["span_index"]], batch["argument_left"],
+                                                    batch["argument_right"]))
+        self.assertEqual(logits.shape, (processor.num_predictions, 3))
+        self.assertTrue(torch.allclose(logits, expected, atol=1e-5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import json
+import tempfile
+import unittest
+import sys
+from unittest import mock
+sys.path.append("..")
+from OmniEvent.infer import get_tokenizer
+from OmniEvent.arguments import DataArguments
+from OmniEvent.input_engineering.streaming import StreamingDataset
+from OmniEvent.input_engineering.seq2seq_processor import EDSeq2SeqProcessor
+
+
+class TestStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.tmp_dir.name, "test.jsonl")
+        with open(self.input_file, "w") as f:
+            for i in range(10):
+                item = {"id": str(i), "text": "a massive aerial assault pounded Baghdad", "source": "<ace>",
+                        "events": [{"type": "Attack", "triggers": [{"trigger_word": "assault", "position": [17, 24]}]}]}
+                f.write(json.dumps(item) + "\n")
+        self.tokenizer = get_tokenizer("s2s-mt5-ed")
+        self.config = DataArguments(max_seq_length=32, max_out_length=16)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_features(self, dataset):
+        return [tuple((key, tuple(value.tolist())) for key, value in sorted(features.items())) for features in dataset]
+
+    def test_streaming(self):
+        processor = EDSeq2SeqProcessor(self.config, self.tokenizer, self.input_file)
+        expected = self.get_features(processor[i] for i in range(len(processor)))
+        dataset = StreamingDataset(EDSeq2SeqProcessor, self.config, self.tokenizer, self.input_file, chunk_size=3)
+        self.assertEqual(self.get_features(dataset), expected)
+        # the ranks get disjoint chunks covering the whole file
+        features = []
+        for rank in range(2):
+            features += self.get_features(StreamingDataset(EDSeq2SeqProcessor, self.config, self.tokenizer,
+                                                           self.input_file, chunk_size=3, shuffle_buffer_size=4,
+                                                           rank=rank, world_size=2))
+        self.assertEqual(sorted(features), sorted(expected))
+
+    def test_chunk_index(self):
+        config = DataArguments(max_seq_length=32, max_out_length=16,
+                               feature_cache_dir=os.path.join(self.tmp_dir.name, "cache"))
+        dataset = StreamingDataset(EDSeq2SeqProcessor, config, self.tokenizer, self.input_file, chunk_size=4)
+        with open(self.input_file, "rb") as f:
+            lines = f.readlines()
+        offsets = [sum(len(line) for line in lines[:i]) for i in (0, 4, 8, 10)]
+        self.assertEqual(dataset.chunk_index, [(offset, i, 0) for offset, i in zip(offsets, (0, 4, 8, 10))])
+        self.assertEqual([shard.lines for shard in dataset.read_chunks(1, 2)], [[line.decode() for line in lines[4:8]]])
+        # the index is kept in the cache and read by the other datasets of the file
+        self.assertEqual(len(os.listdir(config.feature_cache_dir)), 1)
+        with mock.patch.object(StreamingDataset, "build_chunk_index") as build_chunk_index:
+            cached = StreamingDataset(EDSeq2SeqProcessor, config, self.tokenizer, self.input_file, chunk_size=4)
+        build_chunk_index.assert_not_called()
+        self.assertEqual(cached.chunk_index, dataset.chunk_index)
+
+
+if __name__ == "__main__":
+    unittest.main()